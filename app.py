@@ -4,18 +4,40 @@ import tempfile
 import zipfile
 from pathlib import Path
 from datetime import datetime
-from typing import List, Optional, Dict, Any, Tuple
+from typing import List, Optional, Dict, Any, Tuple, Iterator
 import time
+import uuid
+import itertools
 import yaml
+from PIL import Image, ImageDraw, ImageOps
 from engine import (
+    BackendUnavailableError,
     GeminiEnhancementEngine,
     GeminiConfig
 )
 from utils.about import ABOUT
+from utils.backends import ModelBackend, get_local_backend
 from utils.filters import ImageFilterManager
+from utils.frame_cache import PreparedFrameCache
+from utils.metrics import start_metrics_server
 from utils.image import (
+    BatchPreflight,
     ImageConfig
 )
+from utils.pipeline import BatchItem, PipelineJob
+from utils.presets import PresetError, PresetStore, get_preset_library
+from utils.profiling import get_profiler
+from utils.results import EnhancementResult, ResultHistory
+from utils.scheduler import BULK, INTERACTIVE
+from utils.warmup import start_warm_up
+from utils.usage import PROCESS_USAGE, BudgetExceededError, UsageLabels, UsageLedger, UsageTracker
+
+
+@st.cache_resource
+def _read_config(path: str) -> Dict[str, Any]:
+    with open(path, "r", encoding="utf-8") as file:
+        return yaml.safe_load(file)
+
     
 class PhotoProApp:
     def __init__(self, config_path: str = "data.yaml"):
@@ -26,8 +48,8 @@ class PhotoProApp:
         self._initialize_session_state()
     
     def _load_config(self, path: str) -> Dict[str, Any]:
-        with open(path, "r", encoding="utf-8") as file:
-            return yaml.safe_load(file)
+        # Parsed once per process; treat as read-only
+        return _read_config(path)
     
     def _setup_streamlit_config(self) -> None:
         st.set_page_config(
@@ -46,7 +68,7 @@ class PhotoProApp:
     
     def _initialize_session_state(self)->None:
         if 'enhancement_history' not in st.session_state:
-            st.session_state.enhancement_history = []
+            st.session_state.enhancement_history = ResultHistory()
         if 'current_session_id' not in st.session_state:
             st.session_state.current_session_id = None
         if 'processing_stats' not in st.session_state:
@@ -57,8 +79,32 @@ class PhotoProApp:
             }
         if 'active_filters' not in st.session_state:
             st.session_state.active_filters = {}
+        if 'usage_ledger' not in st.session_state:
+            st.session_state.usage_ledger = UsageLedger('Session')
+        if 'tenant_id' not in st.session_state:
+            # Identifies this browser session to the process-wide call scheduler
+            st.session_state.tenant_id = uuid.uuid4().hex[:12]
+        if 'frame_cache' not in st.session_state:
+            # Prepared pixels of this session's uploads, reused when an upload is processed again
+            st.session_state.frame_cache = PreparedFrameCache(
+                int(os.environ.get("PHOTOPRO_FRAME_CACHE_MB", "256")) * 1024 * 1024
+            )
+    
+    def _get_local_backend_url(self) -> Optional[str]:
+        try:
+            return st.secrets["LOCAL_BACKEND_URL"]
+        except:
+            return os.environ.get("PHOTOPRO_LOCAL_BACKEND_URL")
+    
+    def _create_backend(self) -> Optional[ModelBackend]:
+        local_backend_url = self._get_local_backend_url()
+        if local_backend_url:
+            return get_local_backend(local_backend_url)
+        return None
     
     def _get_api_key(self)->str:
+        if self._get_local_backend_url():
+            return ""
         try:
             return st.secrets["GEMINI_API_KEY"]
         except:
@@ -105,6 +151,14 @@ class PhotoProApp:
             5
         )
         
+        upload_quality = st.sidebar.slider(
+            self.config["sidebar"]["image_settings_slider_title_upload_quality"], 
+            self.config["sidebar"]["image_settings_slider_min_upload_quality"], 
+            self.config["sidebar"]["image_settings_slider_max_upload_quality"], 
+            self.config["sidebar"]["image_settings_slider_upload_quality"], 
+            5
+        )
+        
         # Processing options
         st.sidebar.markdown(self.config["sidebar"]["processing_options"])
         max_retries = st.sidebar.slider(
@@ -114,19 +168,69 @@ class PhotoProApp:
             self.config["sidebar"]["processing_options_slider_retry"]
         )
         
+        cpu_workers = st.sidebar.slider(
+            self.config["sidebar"]["processing_options_slider_title_cpu_workers"], 
+            0, 
+            min(os.cpu_count() or 1, self.config["sidebar"]["processing_options_slider_max_cpu_workers"]), 
+            0
+        )
+        
+        hedge_enabled = st.sidebar.checkbox(
+            self.config["sidebar"]["processing_options_hedge_title"],
+            value=False,
+            help=self.config["sidebar"]["processing_options_hedge_help"]
+        )
+        
+        near_duplicate_reuse = st.sidebar.checkbox(
+            self.config["sidebar"]["processing_options_reuse_title"],
+            value=False,
+            help=self.config["sidebar"]["processing_options_reuse_help"]
+        )
+        
+        session_token_budget = st.sidebar.number_input(
+            self.config["sidebar"]["processing_options_token_budget_title"],
+            min_value=0,
+            value=0,
+            step=10000,
+            help=self.config["sidebar"]["processing_options_token_budget_help"]
+        )
+        st.session_state.usage_ledger.budget_tokens = session_token_budget or None
+        
+        if os.environ.get("PHOTOPRO_ADMIN") == "1":
+            self._display_profiling_controls()
+        
         image_config = ImageConfig(
             max_size=(max_size, max_size),
-            quality=quality
+            quality=quality,
+            upload_quality=upload_quality,
+            cpu_workers=cpu_workers
         )
         
         gemini_config = GeminiConfig(
-            max_retries=max_retries
+            max_retries=max_retries,
+            hedge_enabled=hedge_enabled,
+            near_duplicate_reuse=near_duplicate_reuse
         )
         
         return image_config, gemini_config
     
     
-    def _process_uploaded_images(self, uploaded_files: List, prompt: str, api_key: str,  image_config: ImageConfig, gemini_config: GeminiConfig)->None:
+    def _display_profiling_controls(self) -> None:
+        # Process-wide, so only offered to admins
+        profiler = get_profiler()
+        st.sidebar.markdown(self.config["sidebar"]["profiling"])
+        enabled = st.sidebar.toggle(
+            self.config["sidebar"]["profiling_toggle"],
+            value=profiler.config.enabled,
+            help=self.config["sidebar"]["profiling_help"]
+        )
+        rate = st.sidebar.slider(
+            self.config["sidebar"]["profiling_rate"], 1, 100, max(1, round(profiler.config.sample_rate * 100))
+        )
+        profiler.configure(enabled, rate / 100)
+    
+    def _process_uploaded_images(self, uploaded_files: List, prompt: str, api_key: str,  image_config: ImageConfig, gemini_config: GeminiConfig,
+                                 usage_labels: UsageLabels = None)->None:
         if not uploaded_files:
             st.warning(self.config["warning"]["upload"])
             return
@@ -138,46 +242,86 @@ class PhotoProApp:
         # temporary directory for processing
         with tempfile.TemporaryDirectory() as temp_dir:
             try:
-                engine = GeminiEnhancementEngine(api_key, gemini_config, image_config)
-                
                 results = []
+                
+                # Reject invalid files and collapse duplicates before any API work
+                preflight = BatchPreflight(image_config).run(
+                    [(uploaded_file.name, uploaded_file.getbuffer()) for uploaded_file in uploaded_files]
+                )
+                for filename, reason in preflight.rejected:
+                    st.error(f"Failed to enhance {filename}: {reason}")
+                    results.append(EnhancementResult.failure(filename, reason))
+                    st.session_state.processing_stats['failed_enhancements'] += 1
+                
+                if preflight.duplicate_count:
+                    st.info(f"Skipping {preflight.duplicate_count} duplicate upload(s); results are shared.")
+                
+                usage = UsageTracker([st.session_state.usage_ledger, PROCESS_USAGE], usage_labels or UsageLabels())
+                engine = GeminiEnhancementEngine(
+                    api_key, gemini_config, image_config, backend=self._create_backend(), usage=usage,
+                    tenant=st.session_state.tenant_id, frame_cache=st.session_state.frame_cache
+                )
+                
+                if engine.breaker.is_open:
+                    self._display_backend_unavailable(engine.breaker.last_failure_class, engine.breaker.retry_after)
+                    return
+                
+                backend_unavailable = None
+                budget_exceeded = None
                 progress_bar = st.progress(0)
                 status_text = st.empty()
                 
-                for i, uploaded_file in enumerate(uploaded_files):
-                    # progress
-                    progress = (i + 1) / len(uploaded_files)
-                    progress_bar.progress(progress)
-                    status_text.text(f"Processing {uploaded_file.name}... ({i+1}/{len(uploaded_files)})")
-                    
-                    # Save uploaded file temporarily
-                    temp_path = os.path.join(temp_dir, uploaded_file.name)
-                    with open(temp_path, "wb") as f:
-                        f.write(uploaded_file.getbuffer())
-                    
-                    try:
-                        # Enhance
-                        result = engine.enhance_image(temp_path, prompt, temp_dir)
-                        result['original_filename'] = uploaded_file.name
-                        result['success'] = True
-                        results.append(result)
+                batch_items = [
+                    BatchItem(entry, uploaded_files[entry.index].name, uploaded_files[entry.index].getvalue)
+                    for entry in preflight.unique
+                ]
+                # Animated GIF/WebP and multi-page TIFF go through the per-frame path
+                frame_items = [item for item in batch_items if item.key.multi_frame]
+                batch_items = [item for item in batch_items if not item.key.multi_frame]
+                total_items = len(batch_items) + len(frame_items)
+                
+                # A single upload is interactive; larger batches yield to other sessions' single edits
+                lane = INTERACTIVE if len(batch_items) == 1 else BULK
+                with engine.shared_prompt(prompt, total_items):
+                    jobs = itertools.chain(
+                        engine.enhance_batch(batch_items, prompt, temp_dir, lane=lane),
+                        self._enhance_frame_items(engine, frame_items, prompt, temp_dir)
+                    )
+                    for i, job in enumerate(jobs):
+                        entry = job.item.key
                         
-                        # stats
-                        st.session_state.processing_stats['successful_enhancements'] += 1
+                        # progress
+                        progress = (i + 1) / total_items
+                        progress_bar.progress(progress)
+                        status_text.text(f"Processed {job.item.name} ({i+1}/{total_items})")
                         
-                    except Exception as e:
-                        st.error(f"Failed to enhance {uploaded_file.name}: {str(e)}")
-                        results.append({
-                            'original_filename': uploaded_file.name,
-                            'error': str(e),
-                            'success': False
-                        })
-                        st.session_state.processing_stats['failed_enhancements'] += 1
+                        if job.error is None:
+                            job.result.success = True
+                            entry_results = preflight.fan_out(entry, job.result)
+                            results.extend(entry_results)
+                            
+                            # stats
+                            st.session_state.processing_stats['successful_enhancements'] += len(entry_results)
+                        else:
+                            if isinstance(job.error, BackendUnavailableError):
+                                backend_unavailable = job.error
+                            elif isinstance(job.error, BudgetExceededError):
+                                budget_exceeded = job.error
+                            else:
+                                st.error(f"Failed to enhance {job.item.name}: {str(job.error)}")
+                            entry_results = preflight.fan_out(entry, EnhancementResult.failure(job.item.name, str(job.error)))
+                            results.extend(entry_results)
+                            st.session_state.processing_stats['failed_enhancements'] += len(entry_results)
                 
                 # Clear
                 progress_bar.empty()
                 status_text.empty()
                 
+                if backend_unavailable is not None:
+                    self._display_backend_unavailable(engine.breaker.last_failure_class, backend_unavailable.retry_after)
+                if budget_exceeded is not None:
+                    st.error(self.config["error"]["budget_exceeded"].format(reason=str(budget_exceeded)))
+                
                 # stats
                 st.session_state.processing_stats['total_images'] += len(uploaded_files)
                 
@@ -189,9 +333,241 @@ class PhotoProApp:
             except Exception as e:
                 st.error(f"Processing failed: {str(e)}")
     
-    def _display_enhancement_results(self, results: List[Dict[str, Any]]) -> None:
-        successful_results = [r for r in results if r.get('success', False)]
-        failed_results = [r for r in results if not r.get('success', False)]
+    def _enhance_frame_items(self, engine: GeminiEnhancementEngine, items: List[BatchItem], prompt: str,
+                             temp_dir: str) -> Iterator[PipelineJob]:
+        for index, item in enumerate(items):
+            job = PipelineJob(item, index)
+            image_path = os.path.join(temp_dir, f"frames_{index}_{os.path.basename(item.name)}")
+            with open(image_path, "wb") as f:
+                f.write(item.read())
+            try:
+                with st.spinner(self.config["frames"]["spinner"].format(filename=item.name)):
+                    job.result = engine.enhance_frames(image_path, prompt, os.path.join(temp_dir, f"frames_{index}"))
+            except Exception as e:
+                job.error = e
+            finally:
+                os.remove(image_path)
+            yield job
+    
+    def _process_edit_step(self, uploaded_file, prompt: str, api_key: str, image_config: ImageConfig,
+                           gemini_config: GeminiConfig, usage_labels: UsageLabels = None) -> None:
+        usage = UsageTracker([st.session_state.usage_ledger, PROCESS_USAGE], usage_labels or UsageLabels())
+        engine = GeminiEnhancementEngine(
+            api_key, gemini_config, image_config, backend=self._create_backend(), usage=usage,
+            tenant=st.session_state.tenant_id, frame_cache=st.session_state.frame_cache
+        )
+        
+        if engine.breaker.is_open:
+            self._display_backend_unavailable(engine.breaker.last_failure_class, engine.breaker.retry_after)
+            return
+        
+        try:
+            # A new upload starts a new session; otherwise keep refining the last result in memory
+            session = st.session_state.get('edit_session')
+            if session is None or st.session_state.get('edit_source') != uploaded_file.file_id:
+                if session is not None:
+                    session.close()
+                    st.session_state.edit_session = None
+                with tempfile.TemporaryDirectory() as temp_dir:
+                    image_path = os.path.join(temp_dir, uploaded_file.name)
+                    with open(image_path, "wb") as f:
+                        f.write(uploaded_file.getbuffer())
+                    session = engine.start_edit_session(image_path, self.config["edit"]["max_undo"])
+                st.session_state.edit_session = session
+                st.session_state.edit_source = uploaded_file.file_id
+            
+            with st.spinner(self.config["edit"]["spinner"]):
+                result = engine.edit(session, prompt)
+            
+            result.original_filename = uploaded_file.name
+            result.success = True
+            st.session_state.processing_stats['successful_enhancements'] += 1
+            st.session_state.enhancement_history.append(result)
+            
+        except BackendUnavailableError as e:
+            self._display_backend_unavailable(engine.breaker.last_failure_class, e.retry_after)
+        except BudgetExceededError as e:
+            st.error(self.config["error"]["budget_exceeded"].format(reason=str(e)))
+        except Exception as e:
+            st.error(f"Processing failed: {str(e)}")
+            st.session_state.processing_stats['failed_enhancements'] += 1
+        finally:
+            st.session_state.processing_stats['total_images'] += 1
+    
+    def _process_region_edit(self, uploaded_file, prompt: str, box: Tuple[int, int, int, int], api_key: str,
+                             image_config: ImageConfig, gemini_config: GeminiConfig,
+                             usage_labels: UsageLabels = None) -> None:
+        usage = UsageTracker([st.session_state.usage_ledger, PROCESS_USAGE], usage_labels or UsageLabels())
+        engine = GeminiEnhancementEngine(
+            api_key, gemini_config, image_config, backend=self._create_backend(), usage=usage,
+            tenant=st.session_state.tenant_id, frame_cache=st.session_state.frame_cache
+        )
+        
+        if engine.breaker.is_open:
+            self._display_backend_unavailable(engine.breaker.last_failure_class, engine.breaker.retry_after)
+            return
+        
+        with tempfile.TemporaryDirectory() as temp_dir:
+            try:
+                image_path = os.path.join(temp_dir, uploaded_file.name)
+                with open(image_path, "wb") as f:
+                    f.write(uploaded_file.getbuffer())
+                
+                with st.spinner(self.config["region"]["spinner"]):
+                    result = engine.enhance_region(image_path, prompt, box, os.path.join(temp_dir, "out"))
+                
+                result.original_filename = uploaded_file.name
+                result.success = True
+                st.session_state.processing_stats['successful_enhancements'] += 1
+                self._display_enhancement_results([result])
+                st.session_state.enhancement_history.append(result)
+                
+            except BackendUnavailableError as e:
+                self._display_backend_unavailable(engine.breaker.last_failure_class, e.retry_after)
+            except BudgetExceededError as e:
+                st.error(self.config["error"]["budget_exceeded"].format(reason=str(e)))
+            except Exception as e:
+                st.error(f"Processing failed: {str(e)}")
+                st.session_state.processing_stats['failed_enhancements'] += 1
+            finally:
+                st.session_state.processing_stats['total_images'] += 1
+    
+    def _process_variants(self, uploaded_file, prompt: str, count: int, api_key: str, image_config: ImageConfig,
+                          gemini_config: GeminiConfig, usage_labels: UsageLabels = None) -> None:
+        usage = UsageTracker([st.session_state.usage_ledger, PROCESS_USAGE], usage_labels or UsageLabels())
+        engine = GeminiEnhancementEngine(
+            api_key, gemini_config, image_config, backend=self._create_backend(), usage=usage,
+            tenant=st.session_state.tenant_id, frame_cache=st.session_state.frame_cache
+        )
+        
+        if engine.breaker.is_open:
+            self._display_backend_unavailable(engine.breaker.last_failure_class, engine.breaker.retry_after)
+            return
+        
+        with tempfile.TemporaryDirectory() as temp_dir:
+            try:
+                image_path = os.path.join(temp_dir, uploaded_file.name)
+                with open(image_path, "wb") as f:
+                    f.write(uploaded_file.getbuffer())
+                
+                with st.spinner(self.config["variants"]["spinner"].format(count=count)):
+                    results = engine.enhance_variants(image_path, prompt, count, os.path.join(temp_dir, "out"))
+                
+                for result in results:
+                    result.original_filename = uploaded_file.name
+                    result.success = True
+                st.session_state.processing_stats['successful_enhancements'] += 1
+                self._display_variants(results)
+                st.session_state.enhancement_history.extend(results)
+                
+            except BackendUnavailableError as e:
+                self._display_backend_unavailable(engine.breaker.last_failure_class, e.retry_after)
+            except BudgetExceededError as e:
+                st.error(self.config["error"]["budget_exceeded"].format(reason=str(e)))
+            except Exception as e:
+                st.error(f"Processing failed: {str(e)}")
+                st.session_state.processing_stats['failed_enhancements'] += 1
+            finally:
+                st.session_state.processing_stats['total_images'] += 1
+    
+    def _display_variants(self, results: List[EnhancementResult]) -> None:
+        st.markdown(self.config["variants"]["header"].format(count=len(results)))
+        
+        cols = st.columns(len(results))
+        for col, result in zip(cols, results):
+            with col:
+                if not result.enhanced_images:
+                    st.info("\n\n".join(result.text_responses))
+                    continue
+                image_info = result.enhanced_images[0]
+                st.image(image_info.path, caption=f"Variant {result.variant}", use_container_width=True)
+                with open(image_info.path, "rb") as file:
+                    st.download_button(
+                        label=f"📥 Variant {result.variant}",
+                        data=file.read(),
+                        file_name=f"variant{result.variant}_{result.original_filename}",
+                        mime=image_info.mime,
+                        key=f"download_{result.session_id}",
+                        on_click="ignore"
+                    )
+    
+    def _display_region_selector(self, uploaded_file) -> Optional[Tuple[int, int, int, int]]:
+        if not st.toggle(
+            self.config["region"]["toggle_title"],
+            help=self.config["region"]["toggle_help"],
+            key="region_edit"
+        ):
+            return None
+        
+        with Image.open(uploaded_file) as img:
+            width, height = img.size
+            if img.getexif().get(0x0112) in (5, 6, 7, 8):
+                width, height = height, width
+            img.draft('RGB', (512, 512))
+            preview = ImageOps.exif_transpose(img).convert('RGB')
+        preview.thumbnail((512, 512))
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            left, right = st.slider(self.config["region"]["horizontal"], 0, 100, (25, 75), key="region_x")
+            top, bottom = st.slider(self.config["region"]["vertical"], 0, 100, (25, 75), key="region_y")
+        
+        box = (width * left // 100, height * top // 100, width * right // 100, height * bottom // 100)
+        scale = preview.size[0] / width
+        ImageDraw.Draw(preview).rectangle([int(v * scale) for v in box], outline=(255, 64, 64), width=3)
+        with col2:
+            st.image(preview, caption=self.config["region"]["preview_caption"].format(
+                width=box[2] - box[0], height=box[3] - box[1]
+            ))
+        return box
+    
+    @st.fragment
+    def _display_edit_session(self) -> None:
+        session = st.session_state.get('edit_session')
+        if session is None:
+            return
+        
+        st.markdown(self.config["edit"]["header"].format(steps=len(session.steps)))
+        caption = session.steps[-1].prompt if session.steps else self.config["images"]["original_image_caption"]
+        st.image(session.current, caption=caption, use_container_width=True)
+        
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            if st.button(self.config["edit"]["undo"], disabled=not session.can_undo):
+                session.undo()
+                st.rerun(scope="fragment")
+        with col2:
+            if st.button(self.config["edit"]["reset"]):
+                session.close()
+                st.session_state.edit_session = None
+                st.session_state.edit_source = None
+                st.rerun(scope="fragment")
+        with col3:
+            if session.steps and session.steps[-1].enhanced_images:
+                latest = session.steps[-1].enhanced_images[0]
+                with open(latest.path, "rb") as file:
+                    st.download_button(
+                        label="📥 Download Enhanced Image",
+                        data=file.read(),
+                        file_name=latest.filename,
+                        mime=latest.mime,
+                        on_click="ignore"
+                    )
+        
+        if session.steps:
+            with st.expander(self.config["edit"]["steps"]):
+                for i, step in enumerate(session.steps, 1):
+                    st.markdown(f"{i}. {step.prompt} ({step.processing_time_seconds:.2f}s)")
+    
+    def _display_backend_unavailable(self, reason: Optional[str], retry_after: float) -> None:
+        st.error(self.config["error"]["backend_unavailable"].format(
+            reason=reason or "errors",
+            retry_after=retry_after
+        ))
+    
+    def _display_enhancement_results(self, results: List[EnhancementResult]) -> None:
+        successful_results = [r for r in results if r.success]
+        failed_results = [r for r in results if not r.success]
         
         if successful_results:
             st.markdown('<div class="success-message">', unsafe_allow_html=True)
@@ -199,36 +575,51 @@ class PhotoProApp:
             st.markdown('</div>', unsafe_allow_html=True)
             
             for result in successful_results:
-                st.markdown(f"### 🖼️ Enhanced: {result['original_filename']}")
+                st.markdown(f"### 🖼️ Enhanced: {result.original_filename}")
+                if result.reused_from:
+                    st.caption(self.config["images"]["reused_caption"].format(
+                        session_id=result.reused_from, distance=result.hash_distance
+                    ))
+                if result.quality_issues:
+                    st.warning(self.config["images"]["quality_warning"].format(
+                        issues=", ".join(self.config["images"]["quality_issues"][issue] for issue in result.quality_issues)
+                    ))
                 
                 col1, col2 = st.columns(2)
                 
                 with col2:
-                    if result['enhanced_images']:
-                        enhanced_img_path = result['enhanced_images'][0]['path']
-                        st.image(enhanced_img_path, caption="Enhanced Image", use_container_width=True)
+                    if result.enhanced_images:
+                        image_info = result.enhanced_images[0]
+                        enhanced_img_path = image_info.path
+                        st.image(image_info.preview_path or enhanced_img_path, caption="Enhanced Image", use_container_width=True)
+                        if result.frame_count is not None:
+                            st.caption(self.config["frames"]["caption"].format(
+                                unique=result.unique_frames, total=result.frame_count
+                            ))
                         
                         with open(enhanced_img_path, "rb") as file:
                             st.download_button(
                                 label="📥 Download Enhanced Image",
                                 data=file.read(),
-                                file_name=f"enhanced_{result['original_filename']}",
-                                mime="image/png"
+                                file_name=f"enhanced_{result.original_filename}",
+                                mime=image_info.mime,
+                                on_click="ignore"
                             )
                 
                 with st.expander("📊 Enhancement Details"):
+                    details = result.to_dict()
                     st.json({
-                        'processing_time': f"{result.get('processing_time_seconds', 0):.2f} seconds",
-                        'session_id': result.get('session_id', 'N/A'),
-                        'timestamp': result.get('timestamp', 'N/A'),
-                        'image_info': result.get('enhanced_images', [{}])[0] if result.get('enhanced_images') else {}
+                        'processing_time': f"{result.processing_time_seconds:.2f} seconds",
+                        'session_id': result.session_id or 'N/A',
+                        'timestamp': details['timestamp'] or 'N/A',
+                        'image_info': details['enhanced_images'][0] if result.enhanced_images else {}
                     })
         
         if failed_results:
             st.markdown('<div class="error-message">', unsafe_allow_html=True)
             st.markdown(f"❌ Failed to enhance {len(failed_results)} image(s)")
             for result in failed_results:
-                st.markdown(f"- {result['original_filename']}: {result.get('error', 'Unknown error')}")
+                st.markdown(f"- {result.original_filename}: {result.error or 'Unknown error'}")
             st.markdown('</div>', unsafe_allow_html=True)
     
     def _display_batch_processing_tab(self) -> List:
@@ -239,7 +630,7 @@ class PhotoProApp:
         
         uploaded_files = st.file_uploader(
             self.config["images"]["uplaod_images_title"],
-            type=['png', 'jpg', 'jpeg', 'webp'],
+            type=['png', 'jpg', 'jpeg', 'webp', 'gif', 'tif', 'tiff'],
             accept_multiple_files=True,
             help=self.config["images"]["uplaod_images_help"]
         )
@@ -257,6 +648,7 @@ class PhotoProApp:
         
         return uploaded_files
     
+    @st.fragment
     def _display_analytics_tab(self) -> None:
         st.markdown(
             f'<div class="section-header">{self.config["monitor"]["monitoring_header"]}</div>', 
@@ -280,18 +672,21 @@ class PhotoProApp:
             success_rate = (stats['successful_enhancements'] / stats['total_images']) * 100
             st.metric("Success Rate", f"{success_rate:.1f}%")
         
+        self._display_usage()
+        self._display_profiles()
+        
         if st.session_state.enhancement_history:
             st.markdown(self.config["monitor"]["history_header"])
             
-            for result in st.session_state.enhancement_history[-10:]:
+            for result in st.session_state.enhancement_history.recent(10):
                 with st.expander(
-                    f"🖼️ {result.get('original_filename', 'Unknown')} - "
-                    f"{result.get('timestamp', 'N/A')[:19]}"
+                    f"🖼️ {result.original_filename or 'Unknown'} - "
+                    f"{result.timestamp_iso or 'N/A'}"
                 ):
-                    st.json(result)
+                    st.json(result.to_dict())
         
         if st.button(self.config["monitor"]["history_clear"]):
-            st.session_state.enhancement_history = []
+            st.session_state.enhancement_history = ResultHistory()
             st.session_state.processing_stats = {
                 'total_images': 0,
                 'successful_enhancements': 0,
@@ -299,6 +694,79 @@ class PhotoProApp:
             }
             st.success(self.config["monitor"]["history_clear_res"])
     
+    def _display_usage(self) -> None:
+        st.markdown(self.config["monitor"]["usage_header"])
+        
+        for ledger in (st.session_state.usage_ledger, PROCESS_USAGE):
+            usage = ledger.snapshot()
+            totals = usage['totals']
+            col1, col2, col3, col4 = st.columns(4)
+            with col1:
+                st.metric(f"{ledger.name} {self.config['monitor']['usage_calls']}", totals['calls'])
+            with col2:
+                st.metric(f"{ledger.name} {self.config['monitor']['usage_input_tokens']}", f"{totals['input_tokens']:,}")
+            with col3:
+                st.metric(f"{ledger.name} {self.config['monitor']['usage_output_tokens']}", f"{totals['output_tokens']:,}")
+            with col4:
+                budget = usage['budget_tokens']
+                st.metric(
+                    f"{ledger.name} {self.config['monitor']['usage_budget']}",
+                    f"{budget - ledger.totals.total_tokens:,}" if budget else "∞"
+                )
+        
+        session_usage = st.session_state.usage_ledger.snapshot()
+        if session_usage['by_template']:
+            with st.expander(self.config["monitor"]["usage_by_template"]):
+                st.dataframe(session_usage['by_template'])
+        filter_usage = self.image_filter_manager.get_filter_usage(st.session_state.usage_ledger)
+        if filter_usage:
+            with st.expander(self.config["monitor"]["usage_by_filter"]):
+                st.dataframe(filter_usage)
+    
+    def _display_profiles(self) -> None:
+        profiler = get_profiler()
+        reports = profiler.reports()
+        if not reports and not profiler.config.enabled:
+            return
+        
+        st.markdown(self.config["monitor"]["profiles_header"])
+        st.caption(self.config["monitor"]["profiles_status"].format(
+            status="on" if profiler.config.enabled else "off",
+            rate=profiler.config.sample_rate * 100,
+            directory=profiler.config.output_dir
+        ))
+        if not reports:
+            return
+        
+        report = st.selectbox(
+            self.config["monitor"]["profiles_select"], reports,
+            format_func=lambda r: f"{r.name} ({datetime.fromtimestamp(r.created):%H:%M:%S})"
+        )
+        try:
+            with open(report.report_path, encoding='utf-8') as file:
+                st.code(file.read(), language=None)
+            with open(report.collapsed_path, 'rb') as file:
+                collapsed = file.read()
+            with open(report.stats_path, 'rb') as file:
+                stats = file.read()
+        except FileNotFoundError:
+            # Pruned between listing and reading
+            return
+        
+        with st.expander(self.config["monitor"]["profiles_collapsed"]):
+            st.code(collapsed.decode('utf-8'), language=None)
+        col1, col2 = st.columns(2)
+        with col1:
+            st.download_button(
+                self.config["monitor"]["profiles_download_collapsed"], data=collapsed,
+                file_name=f"{report.name}.collapsed", mime="text/plain", on_click="ignore"
+            )
+        with col2:
+            st.download_button(
+                self.config["monitor"]["profiles_download_stats"], data=stats,
+                file_name=f"{report.name}.prof", mime="application/octet-stream", on_click="ignore"
+            )
+    
     def _display_about_tab(self) -> None:
         st.markdown(
             f'<div class="section-header">{self.config["about_us"]["header"]}</div>', 
@@ -306,7 +774,7 @@ class PhotoProApp:
         )
         st.markdown(ABOUT)
     
-    def _display_filter_controls(self) -> Dict[str, Any]:
+    def _display_filter_controls(self, key_suffix: str = "") -> Dict[str, Any]:
         st.markdown("### 🎨 Image Filters Configuration")
         
         selected_filters = []
@@ -320,7 +788,7 @@ class PhotoProApp:
                     with cols[i % 2]:
                         if st.checkbox(
                             filter_name.replace('_', ' ').title(), 
-                            key=f"filter_{filter_name}"
+                            key=f"filter_{filter_name}_{key_suffix}"
                         ):
                             selected_filters.append(filter_name)
         
@@ -340,6 +808,9 @@ class PhotoProApp:
                         col_idx = 0
                         
                         for param_name, options in filter_params.items():
+                            widget_key = f"{filter_name}_{param_name}_{key_suffix}"
+                            # Values applied from a preset live in session state; passing the default too makes Streamlit warn
+                            default = options.get("default") if isinstance(options, dict) and widget_key not in st.session_state else None
                             with cols[col_idx % 2]:
                                 if isinstance(options, dict) and options.get("type") == "slider":
                                     # slider
@@ -347,9 +818,9 @@ class PhotoProApp:
                                         f"{param_name.replace('_', ' ').title()} ({options['unit']})",
                                         min_value=options["min"],
                                         max_value=options["max"],
-                                        value=options["default"],
+                                        value=default,
                                         step=options["step"],
-                                        key=f"{filter_name}_{param_name}"
+                                        key=widget_key
                                     )
                                 elif isinstance(options, dict) and options.get("type") == "number_input":
                                     # numbers
@@ -357,29 +828,29 @@ class PhotoProApp:
                                         f"{param_name.replace('_', ' ').title()} ({options['unit']})",
                                         min_value=options["min"],
                                         max_value=options["max"],
-                                        value=options["default"],
-                                        key=f"{filter_name}_{param_name}"
+                                        value=default,
+                                        key=widget_key
                                     )
                                 elif isinstance(options, dict) and options.get("type") == "text_input":
                                     # texts
                                     params[param_name] = st.text_input(
                                         param_name.replace('_', ' ').title(),
-                                        value=options["default"],
+                                        value=default,
                                         placeholder=options.get("placeholder", ""),
-                                        key=f"{filter_name}_{param_name}"
+                                        key=widget_key
                                     )
                                 elif isinstance(options, list):
                                     # selection
                                     params[param_name] = st.selectbox(
                                         param_name.replace('_', ' ').title(),
                                         options,
-                                        key=f"{filter_name}_{param_name}"
+                                        key=widget_key
                                     )
                                 else:
                                     params[param_name] = st.text_input(
                                         param_name.replace('_', ' ').title(),
                                         value=str(options),
-                                        key=f"{filter_name}_{param_name}"
+                                        key=widget_key
                                     )
                             col_idx += 1
                     
@@ -390,7 +861,102 @@ class PhotoProApp:
         
         return configured_filters
     
-    def _display_prompt_selector_with_filters(self, key_suffix: str = "") -> str:
+    def _get_preset_store(self) -> Optional[PresetStore]:
+        if 'preset_store' not in st.session_state:
+            try:
+                library = get_preset_library()
+            except PresetError as e:
+                st.error(self.config["presets"]["unavailable"].format(reason=str(e)))
+                library = None
+            # Each browser session saves, deletes and imports only its own presets
+            st.session_state.preset_store = PresetStore(filter_manager=self.image_filter_manager, library=library)
+        return st.session_state.preset_store
+    
+    def _apply_preset(self, key_suffix: str) -> None:
+        # Runs as a button callback, before the filter widgets are created again
+        store = self._get_preset_store()
+        preset = store.get(st.session_state.get(f"preset_choice_{key_suffix}")) if store else None
+        if preset is None:
+            return
+        
+        for filter_name in self.image_filter_manager.get_all_prompts():
+            st.session_state[f"filter_{filter_name}_{key_suffix}"] = filter_name in preset.filters
+        for filter_name, params in preset.filters.items():
+            for param_name, value in params.items():
+                st.session_state[f"{filter_name}_{param_name}_{key_suffix}"] = value
+    
+    def _display_preset_picker(self, store: PresetStore, key_suffix: str) -> None:
+        with st.expander(self.config["presets"]["header"], expanded=False):
+            st.caption(self.config["presets"]["session_note"])
+            names = store.names()
+            if not names:
+                st.caption(self.config["presets"]["empty"])
+            else:
+                col1, col2, col3 = st.columns([3, 1, 1], vertical_alignment="bottom")
+                with col1:
+                    choice = st.selectbox(self.config["presets"]["select"], names, key=f"preset_choice_{key_suffix}")
+                with col2:
+                    st.button(
+                        self.config["presets"]["apply"], key=f"preset_apply_{key_suffix}",
+                        on_click=self._apply_preset, args=(key_suffix,)
+                    )
+                with col3:
+                    if st.button(self.config["presets"]["delete"], key=f"preset_delete_{key_suffix}"):
+                        try:
+                            store.delete(choice)
+                            st.rerun(scope="fragment")
+                        except PresetError as e:
+                            st.error(str(e))
+                
+                st.download_button(
+                    self.config["presets"]["export"],
+                    data=store.export(),
+                    file_name="photopro_presets.json",
+                    mime="application/json",
+                    key=f"preset_export_{key_suffix}",
+                    on_click="ignore"
+                )
+            
+            imported_file = st.file_uploader(
+                self.config["presets"]["import"], type=['json'], key=f"preset_import_{key_suffix}"
+            )
+            if imported_file is not None and st.session_state.get(f"preset_imported_{key_suffix}") != imported_file.file_id:
+                st.session_state[f"preset_imported_{key_suffix}"] = imported_file.file_id
+                try:
+                    imported = store.import_presets(imported_file.getvalue())
+                    st.success(self.config["presets"]["imported"].format(count=len(imported)))
+                except PresetError as e:
+                    st.error(str(e))
+    
+    def _display_preset_save(self, store: PresetStore, configured_filters: Dict[str, Any], key_suffix: str) -> None:
+        col1, col2 = st.columns([3, 1], vertical_alignment="bottom")
+        with col1:
+            name = st.text_input(self.config["presets"]["name"], key=f"preset_name_{key_suffix}")
+        with col2:
+            save = st.button(self.config["presets"]["save"], key=f"preset_save_{key_suffix}")
+        if save:
+            try:
+                preset = store.save(name, configured_filters)
+                st.success(self.config["presets"]["saved"].format(name=preset.name))
+            except PresetError as e:
+                st.error(str(e))
+    
+    def _compile_filter_prompt(self, store: Optional[PresetStore], configured_filters: Dict[str, Any]) -> str:
+        if store is None:
+            return self.image_filter_manager.combine_filter_prompts(configured_filters)
+        preset = store.find(configured_filters)
+        if preset is not None:
+            st.caption(self.config["presets"]["matched"].format(name=preset.name))
+        return store.compiled_prompt(configured_filters)
+    
+    @st.fragment
+    def _display_prompt_selector_with_filters(self, key_suffix: str = "") -> None:
+        """
+        Prompt type, filter panel and preview, rerun on their own when a widget changes.
+        
+        The resulting prompt and usage labels are stored in ``st.session_state`` under
+        ``prompt_selection_<key_suffix>``; read them with ``_get_prompt_selection``.
+        """
         prompt_option = st.radio(
             "Choose prompt type:",
             ["Custom Prompt", "Filter-Based Prompt", "Combined Prompt"],
@@ -398,6 +964,8 @@ class PhotoProApp:
         )
         
         final_prompt = ""
+        configured_filters = {}
+        store = self._get_preset_store() if prompt_option != "Custom Prompt" else None
         
         if prompt_option == "Custom Prompt":
             final_prompt = st.text_area(
@@ -408,19 +976,18 @@ class PhotoProApp:
             )
         
         elif prompt_option == "Filter-Based Prompt":
-            configured_filters = self._display_filter_controls()
+            if store:
+                self._display_preset_picker(store, key_suffix)
+            configured_filters = self._display_filter_controls(key_suffix)
             
             if configured_filters:
-                final_prompt = self.image_filter_manager.combine_filter_prompts(configured_filters)
+                final_prompt = self._compile_filter_prompt(store, configured_filters)
+                if store:
+                    self._display_preset_save(store, configured_filters, key_suffix)
                 
                 if final_prompt:
                     with st.expander("Preview Combined Prompt", expanded=False):
-                        st.text_area(
-                            "Combined Filter Prompt:", 
-                            value=final_prompt, 
-                            height=200, 
-                            disabled=True
-                        )
+                        st.code(final_prompt, language=None, wrap_lines=True)
             else:
                 st.info("Select and configure filters above to generate the prompt.")
         
@@ -432,11 +999,15 @@ class PhotoProApp:
                 key=f"combined_custom_prompt_{key_suffix}"
             )
             
-            configured_filters = self._display_filter_controls()
+            if store:
+                self._display_preset_picker(store, key_suffix)
+            configured_filters = self._display_filter_controls(key_suffix)
             filter_prompt = (
-                self.image_filter_manager.combine_filter_prompts(configured_filters) 
+                self._compile_filter_prompt(store, configured_filters)
                 if configured_filters else ""
             )
+            if configured_filters and store:
+                self._display_preset_save(store, configured_filters, key_suffix)
             
             if custom_prompt and filter_prompt:
                 final_prompt = f"{custom_prompt}\n\nAdditionally, apply these filters:\n{filter_prompt}"
@@ -447,14 +1018,26 @@ class PhotoProApp:
             
             if final_prompt:
                 with st.expander("Preview Combined Prompt", expanded=False):
-                    st.text_area(
-                        "Final Combined Prompt:", 
-                        value=final_prompt, 
-                        height=200, 
-                        disabled=True
-                    )
+                    st.code(final_prompt, language=None, wrap_lines=True)
+        
+        st.session_state[f"prompt_selection_{key_suffix}"] = (
+            final_prompt, self.image_filter_manager.usage_labels(prompt_option, configured_filters)
+        )
+    
+    def _get_prompt_selection(self, key_suffix: str) -> Tuple[str, UsageLabels]:
+        return st.session_state.get(f"prompt_selection_{key_suffix}", ("", UsageLabels()))
+    
+    @st.fragment
+    def _display_batch_actions(self, uploaded_files: List, api_key: str, image_config: ImageConfig,
+                               gemini_config: GeminiConfig) -> None:
+        # Clicking process reruns only this fragment: progress and results render here
+        prompt, usage_labels = self._get_prompt_selection("batch_prompt")
         
-        return final_prompt
+        if st.button(self.config["main"]["process_action_batch"], type="primary"):
+            if uploaded_files and prompt:
+                self._process_uploaded_images(
+                    uploaded_files, prompt, api_key, image_config, gemini_config, usage_labels
+                )
     
     def run(self) -> None:
         api_key = self._get_api_key()
@@ -463,6 +1046,10 @@ class PhotoProApp:
         
         image_config, gemini_config = self._display_sidebar()
         
+        if os.environ.get("PHOTOPRO_WARMUP") == "1":
+            # Once per process and key, in the background, so the first enhancement is not the slow one
+            start_warm_up(api_key, self._create_backend(), gemini_config, image_config)
+        
         # Tab 1: Single Image Processing
         with tab1:
             st.markdown(
@@ -472,10 +1059,11 @@ class PhotoProApp:
             
             uploaded_file = st.file_uploader(
                 self.config["images"]["uplaod_image_label"],
-                type=['png', 'jpg', 'jpeg', 'webp'],
+                type=['png', 'jpg', 'jpeg', 'webp', 'gif', 'tif', 'tiff'],
                 help=self.config["images"]["uplaod_image_help"]
             )
             
+            region_box = None
             if uploaded_file:
                 col1, col2 = st.columns(2)
                 with col1:
@@ -484,25 +1072,53 @@ class PhotoProApp:
                         caption=self.config["images"]["original_image_caption"], 
                         use_container_width=True
                     )
+                region_box = self._display_region_selector(uploaded_file)
+            
+            self._display_prompt_selector_with_filters("prompt")
+            prompt, usage_labels = self._get_prompt_selection("prompt")
+            
+            iterative = st.toggle(
+                self.config["edit"]["toggle_title"],
+                help=self.config["edit"]["toggle_help"],
+                key="iterative_edit"
+            )
             
-            prompt = self._display_prompt_selector_with_filters("prompt")
+            variant_count = st.number_input(
+                self.config["variants"]["title"],
+                min_value=1,
+                max_value=self.config["variants"]["max"],
+                value=1,
+                help=self.config["variants"]["help"],
+                key="variant_count"
+            )
             
             if st.button(self.config["main"]["process_action"], type="primary"):
                 if uploaded_file and prompt:
-                    self._process_uploaded_images(
-                        [uploaded_file], prompt, api_key, image_config, gemini_config
-                    )
+                    if iterative:
+                        self._process_edit_step(
+                            uploaded_file, prompt, api_key, image_config, gemini_config, usage_labels
+                        )
+                    elif region_box is not None:
+                        self._process_region_edit(
+                            uploaded_file, prompt, region_box, api_key, image_config, gemini_config, usage_labels
+                        )
+                    elif variant_count > 1:
+                        self._process_variants(
+                            uploaded_file, prompt, variant_count, api_key, image_config, gemini_config, usage_labels
+                        )
+                    else:
+                        self._process_uploaded_images(
+                            [uploaded_file], prompt, api_key, image_config, gemini_config, usage_labels
+                        )
+            
+            if iterative:
+                self._display_edit_session()
         
         # Tab 2: Batch Processing
         with tab2:
             uploaded_files = self._display_batch_processing_tab()
-            prompt = self._display_prompt_selector_with_filters("batch_prompt")
-            
-            if st.button(self.config["main"]["process_action_batch"], type="primary"):
-                if uploaded_files and prompt:
-                    self._process_uploaded_images(
-                        uploaded_files, prompt, api_key, image_config, gemini_config
-                    )
+            self._display_prompt_selector_with_filters("batch_prompt")
+            self._display_batch_actions(uploaded_files, api_key, image_config, gemini_config)
         
         # Tab 3: Monitoring
         with tab3:
@@ -514,6 +1130,12 @@ class PhotoProApp:
 
 
 def main():
+    metrics_port = os.environ.get("PHOTOPRO_METRICS_PORT")
+    if metrics_port:
+        start_metrics_server(int(metrics_port))
+    process_token_budget = os.environ.get("PHOTOPRO_PROCESS_TOKEN_BUDGET")
+    if process_token_budget:
+        PROCESS_USAGE.budget_tokens = int(process_token_budget)
     app = PhotoProApp()
     app.run()
 
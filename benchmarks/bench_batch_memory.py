@@ -0,0 +1,73 @@
+"""
+Peak RSS of the bounded batch pipeline at different batch sizes.
+
+Each batch size runs in its own subprocess (``ru_maxrss`` never goes down) against the
+local fake backend:
+
+    python -m benchmarks.bench_batch_memory --sizes 10 100 500
+"""
+import argparse
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+
+def make_jpeg(width: int = 4000, height: int = 3000) -> bytes:
+    """A 12 MP test photo: gradients plus noise so JPEG cannot compress it away."""
+    gradient = Image.linear_gradient('L').resize((width, height))
+    noise = Image.fromarray(np.random.default_rng(0).integers(0, 255, (height, width), dtype=np.uint8))
+    image = Image.merge('RGB', [gradient, gradient.transpose(Image.Transpose.ROTATE_180), noise])
+    buffer = BytesIO()
+    image.save(buffer, format='JPEG', quality=92)
+    return buffer.getvalue()
+
+
+def run_batch(size: int, latency: float) -> None:
+    from engine import GeminiEnhancementEngine
+    from utils.backends import LocalHTTPBackend
+    from utils.fake_backend import FakeGeminiServer
+    from utils.pipeline import BatchItem
+
+    data = make_jpeg()
+    server = FakeGeminiServer(port=0, latency_seconds=latency).start()
+    engine = GeminiEnhancementEngine(backend=LocalHTTPBackend(server.base_url))
+    items = (BatchItem(i, f"image_{i}.jpg", lambda: data) for i in range(size))
+
+    start = time.perf_counter()
+    failures = 0
+    with tempfile.TemporaryDirectory() as output_dir:
+        for job in engine.enhance_batch(items, "Make it warmer", output_dir):
+            failures += job.error is not None
+    elapsed = time.perf_counter() - start
+    server.stop()
+
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{size:>5} images  {elapsed:7.1f}s  peak RSS {peak_mb:7.1f} MB  failures {failures}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 500])
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--child', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        run_batch(args.child, args.latency)
+        return
+
+    for size in args.sizes:
+        subprocess.run(
+            [sys.executable, '-m', 'benchmarks.bench_batch_memory', '--child', str(size), '--latency', str(args.latency)],
+            check=True
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Throughput of the CPU stages (decode/resize + PNG save) in-process vs. in the process pool.
+
+    python -m benchmarks.bench_cpu_pool --images 100 --workers 1 2 4 8
+
+Each configuration prepares and saves every image from a thread pool as wide as the
+worker count, which is how ``enhance_batch`` drives the stages.
+"""
+import argparse
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.bench_batch_memory import make_jpeg
+from utils.cpu_pool import CPUStagePool
+from utils.image import ImageConfig, ImageProcessor
+
+
+def run(paths, output_dir: str, workers: int, use_pool: bool) -> float:
+    config = ImageConfig()
+    pool = CPUStagePool(workers) if use_pool else None
+    processor = ImageProcessor(config)
+
+    def process(index_path):
+        index, path = index_path
+        output_path = os.path.join(output_dir, f"out_{index}.png")
+        if pool is not None:
+            image = pool.prepare_image(path, config)
+            pool.save_enhanced_image(image, output_path, config)
+        else:
+            image = processor.prepare_image(path)
+            processor.save_enhanced_image(image, output_path)
+
+    if pool is not None:
+        # Exclude worker start-up from the measurement
+        list(ThreadPoolExecutor(workers).map(lambda _: pool.prepare_image(paths[0], config), range(workers)))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(workers) as executor:
+        list(executor.map(process, enumerate(paths)))
+    elapsed = time.perf_counter() - start
+
+    if pool is not None:
+        pool.shutdown()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--images', type=int, default=100)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        data = make_jpeg()
+        paths = []
+        for i in range(args.images):
+            path = os.path.join(work_dir, f"in_{i}.jpg")
+            with open(path, "wb") as f:
+                f.write(data)
+            paths.append(path)
+
+        baseline = run(paths, work_dir, 1, use_pool=False)
+        print(f"in-process           {baseline:7.1f}s  {args.images / baseline:6.2f} img/s")
+        for workers in args.workers:
+            elapsed = run(paths, work_dir, workers, use_pool=True)
+            print(f"pool x{workers:<2}             {elapsed:7.1f}s  {args.images / elapsed:6.2f} img/s  "
+                  f"speedup {baseline / elapsed:4.2f}x")
+
+
+if __name__ == "__main__":
+    main()
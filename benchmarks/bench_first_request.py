@@ -0,0 +1,90 @@
+"""
+Latency of the first enhancement in a fresh process, with and without warm-up.
+
+Each run starts a new interpreter (so imports, client construction and codec set-up are
+cold) against the local fake backend:
+
+    python -m benchmarks.bench_first_request --runs 5
+
+With ``--warmup`` the child warms up first and only then times the request, which is
+what a user sees when the warm-up has finished before their first click.
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def run_child(base_url: str, image_path: str, warmup: bool) -> None:
+    start = time.perf_counter()
+    warmup_ms = 0.0
+    if warmup:
+        from utils.backends import get_local_backend
+        from utils.warmup import warm_up
+        warm_up(backend=get_local_backend(base_url))
+        warmup_ms = (time.perf_counter() - start) * 1000
+
+    # Cold runs pay for the SDK and engine imports inside the request, as the app does
+    request_start = time.perf_counter()
+    from engine import GeminiEnhancementEngine
+    from utils.backends import get_local_backend
+    engine = GeminiEnhancementEngine(backend=get_local_backend(base_url))
+    with tempfile.TemporaryDirectory() as output_dir:
+        engine.enhance_image(image_path, "Make it warmer", output_dir)
+    first_ms = (time.perf_counter() - request_start) * 1000
+
+    # Steady state for comparison
+    second_start = time.perf_counter()
+    with tempfile.TemporaryDirectory() as output_dir:
+        engine.enhance_image(image_path, "Make it warmer", output_dir)
+    second_ms = (time.perf_counter() - second_start) * 1000
+
+    print(json.dumps({
+        'warmup_ms': warmup_ms,
+        'first_ms': first_ms,
+        'second_ms': second_ms,
+        'process_ms': (time.perf_counter() - start) * 1000
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--child', nargs=2, metavar=('URL', 'IMAGE'), help=argparse.SUPPRESS)
+    parser.add_argument('--warmup', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        run_child(*args.child, args.warmup)
+        return
+
+    from benchmarks.bench_batch_memory import make_jpeg
+    from utils.fake_backend import FakeGeminiServer
+
+    server = FakeGeminiServer(port=0, latency_seconds=args.latency).start()
+    with tempfile.NamedTemporaryFile(suffix=".jpg") as image_file:
+        image_file.write(make_jpeg(1600, 1200))
+        image_file.flush()
+
+        for warmup in (False, True):
+            samples = []
+            for _ in range(args.runs):
+                command = [sys.executable, '-m', 'benchmarks.bench_first_request', '--child', server.base_url, image_file.name]
+                output = subprocess.run(command + (['--warmup'] if warmup else []),
+                                        check=True, capture_output=True, text=True).stdout
+                samples.append(json.loads(output.strip().splitlines()[-1]))
+
+            median = {key: statistics.median(sample[key] for sample in samples) for key in samples[0]}
+            print(
+                f"{'warm' if warmup else 'cold'}  first request {median['first_ms']:7.0f} ms  "
+                f"second {median['second_ms']:6.0f} ms  warm-up {median['warmup_ms']:6.0f} ms  (median of {args.runs})"
+            )
+    server.stop()
+
+
+if __name__ == "__main__":
+    main()
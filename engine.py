@@ -1,24 +1,50 @@
 import os
+import time
 import uuid
+import shutil
+import tempfile
+import threading
+import weakref
 
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Optional, Tuple, Dict, Any, List
-from dataclasses import dataclass
+from typing import Optional, Tuple, Dict, Any, List, Callable, Iterable, Iterator, Sized
+from dataclasses import dataclass, replace
 from datetime import datetime
 
 import numpy as np
 from PIL import Image, ImageOps
-from google import genai
 from google.genai import types
 
-from utils.handler import PhotoProError, logs
+from utils.circuit import CircuitBreaker, classify_failure, get_circuit_breaker
+from utils.cpu_pool import CPUStagePool, get_cpu_pool
+from utils.backends import ModelBackend, ModelRouter, PromptCachingBackend, RoutingRule, get_gemini_backend
+from utils.hedging import get_hedge_policy, hedged_call, run_async
+from utils.handler import PhotoProError, log_session, logs, stage_timer
+from utils.frame_cache import FRAME_KEY_INFO, PreparedFrameCache
+from utils.frames import (
+    FRAME_FORMATS, Frame, FrameConfig, FrameDeduper, is_multi_frame, iter_frames, restore_alpha, save_frames
+)
 from utils.image import ImageConfig, ImageProcessingError, ImageProcessor
+from utils.metrics import (
+    API_CALLS, API_RETRIES, BYTES_DOWNLOADED, BYTES_UPLOADED, CACHE_LOOKUPS,
+    ENHANCE_FAILURES, ENHANCE_REQUESTS, ENHANCE_SUCCESSES, QUALITY_CHECKS, QUALITY_RETRIES, observe_stage_timings
+)
+from utils.quality import QualityConfig, RetryBudget, check_output
+from utils.phash import PerceptualIndex, dhash, get_reuse_index, reuse_key
+from utils.profiling import profiled
+from utils.scheduler import BULK, INTERACTIVE, FairScheduler, get_scheduler
+from utils.result_cache import ResultCache, decode_response, encode_response, get_result_cache, result_cache_key
+from utils.pipeline import BatchItem, BatchPipeline, PipelineConfig, PipelineJob
+from utils.results import EnhancedImage, EnhancementResult
+from utils.usage import BudgetExceededError, UsageRecord, UsageTracker, estimate_usage
 logger = logs()
 
-
-
-
+# Whether a backend/model honours candidate_count > 1, learned on first use per process
+_candidate_count_support: Dict[Tuple[str, str], bool] = {}
 
 
 @dataclass
@@ -28,30 +54,161 @@ class GeminiConfig:
     response_modalities: List[str] = None
     timeout_seconds: int = 60
     max_retries: int = 3
+    routing_rules: List[RoutingRule] = None
+    # Shared-prompt batches upload the instruction prefix once as cached content
+    prompt_cache_enabled: bool = True
+    prompt_cache_min_requests: int = 2
+    prompt_cache_ttl_seconds: int = 900
+    # Opt-in hedging: duplicate attempts slower than the observed percentile latency
+    hedge_enabled: bool = False
+    hedge_percentile: float = 95.0
+    hedge_budget_fraction: float = 0.05
+    hedge_min_samples: int = 20
+    # Circuit breaker shared by all engines using the same backend
+    circuit_failure_threshold: int = 5
+    circuit_recovery_seconds: float = 30.0
+    # Reuse a prior result when a near-identical image comes back with the same prompt
+    near_duplicate_reuse: bool = False
+    near_duplicate_max_distance: int = 4
     
     def __post_init__(self):
         if self.response_modalities is None:
             self.response_modalities = ['TEXT', 'IMAGE']
+        if self.routing_rules is None:
+            self.routing_rules = []
 
 
 class GeminiAPIError(PhotoProError):
     pass
 
 
+class BackendUnavailableError(GeminiAPIError):
+    """Raised without calling the backend while its circuit breaker is open."""
+    
+    def __init__(self, message: str, retry_after: float = 0.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class EditSession:
+    """
+    In-memory state of an iterative edit: the current image and a bounded undo stack.
+    
+    Each refinement sends the previous result, still decoded, as the next input, so steps
+    skip reading, decoding and resizing the original upload.
+    """
+    
+    def __init__(self, image: Image.Image, source_name: str, max_undo: int = 10):
+        self.current = image
+        self.source_name = source_name
+        self.steps: List[EnhancementResult] = []
+        self.output_dir = tempfile.mkdtemp(prefix="photopro_edit_")
+        self._undo: deque = deque(maxlen=max_undo)
+        # Sessions dropped without close() (expired browser sessions) still remove their outputs
+        self._cleanup = weakref.finalize(self, shutil.rmtree, self.output_dir, True)
+    
+    @property
+    def can_undo(self) -> bool:
+        return bool(self._undo)
+    
+    def push(self, image: Image.Image, result: EnhancementResult) -> None:
+        if len(self._undo) == self._undo.maxlen:
+            self._undo[0].close()
+        self._undo.append(self.current)
+        self.current = image
+        self.steps.append(result)
+    
+    def undo(self) -> bool:
+        """Go back to the previous image; returns False when there is nothing to undo."""
+        if not self._undo:
+            return False
+        self.current.close()
+        self.current = self._undo.pop()
+        self.steps.pop()
+        return True
+    
+    def close(self) -> None:
+        for image in [self.current, *self._undo]:
+            image.close()
+        self._undo.clear()
+        self._cleanup()
+
+
 class GeminiEnhancementEngine:    
-    def __init__(self, api_key: str, gemini_config: GeminiConfig = None, image_config: ImageConfig = None):
+    def __init__(self, api_key: str = None, gemini_config: GeminiConfig = None, image_config: ImageConfig = None,
+                 backend: ModelBackend = None, cpu_pool: CPUStagePool = None, usage: UsageTracker = None,
+                 reuse_index: PerceptualIndex = None, result_cache: ResultCache = None,
+                 scheduler: FairScheduler = None, tenant: str = 'default', quality: QualityConfig = None,
+                 frame_cache: PreparedFrameCache = None):
         self.gemini_config = gemini_config or GeminiConfig()
         self.image_config = image_config or ImageConfig()
         self.image_processor = ImageProcessor(self.image_config)
+        self.cpu_pool = cpu_pool or get_cpu_pool(self.image_config.cpu_workers)
+        self.usage = usage or UsageTracker()
+        self.result_cache = result_cache or get_result_cache()
+        self.scheduler = scheduler or get_scheduler()
+        self.tenant = tenant
+        self.quality = quality or QualityConfig()
+        self.quality_budget = RetryBudget(self.quality.retry_budget_fraction, self.quality.retry_budget_window)
+        self.frame_cache = frame_cache
+        self.reuse_index = reuse_index
+        if reuse_index is None and self.gemini_config.near_duplicate_reuse:
+            self.reuse_index = get_reuse_index(self.gemini_config.near_duplicate_max_distance)
         
-        # Configure Gemini API
+        # Configure model backend
         try:
-            self.client = genai.Client(api_key=api_key)
-            logger.info("Gemini API configured successfully")
+            self.backend = backend or get_gemini_backend(api_key)
+            logger.info(f"Model backend '{self.backend.name}' configured successfully")
         except Exception as e:
             raise GeminiAPIError(f"Failed to configure Gemini API: {str(e)}")
+        
+        self.router = ModelRouter(self.backend, self.gemini_config.model_name, self.gemini_config.routing_rules)
+        self.breaker = self._circuit_breaker(self.backend)
+        
+        self._shared_prompt: Optional[str] = None
+        self._prompt_caches: Dict[Tuple[int, str], Optional[str]] = {}
+        self._prompt_cache_backends: Dict[int, ModelBackend] = {}
+        self._prompt_cache_lock = threading.Lock()
+    
+    @contextmanager
+    def shared_prompt(self, prompt: str, expected_requests: int) -> Iterator[None]:
+        """
+        Mark a batch of requests that all use the same prompt.
+        
+        While the context is open the prompt is uploaded once per backend/model as cached
+        content and each request only carries its image. Backends without prompt caching,
+        or failures to create/use the cache, fall back to sending the full prompt.
+        
+        Args:
+            prompt (str): Prompt shared by every request in the batch
+            expected_requests (int): Number of requests expected in the batch
+        """
+        if (not self.gemini_config.prompt_cache_enabled
+                or expected_requests < self.gemini_config.prompt_cache_min_requests):
+            yield
+            return
+        
+        self._shared_prompt = prompt
+        try:
+            yield
+        finally:
+            with self._prompt_cache_lock:
+                for (backend_id, model_name), cache_name in self._prompt_caches.items():
+                    if cache_name:
+                        try:
+                            self._prompt_cache_backends[backend_id].delete_prompt_cache(cache_name)
+                        except Exception as e:
+                            logger.warning(f"Failed to delete prompt cache {cache_name}: {str(e)}")
+                self._shared_prompt = None
+                self._prompt_caches = {}
+                self._prompt_cache_backends = {}
     
-    def enhance_image(self, image_path: str, prompt: str, output_dir: str = None) -> Dict[str, Any]:
+    def check_health(self) -> bool:
+        """Check that the default backend and model are reachable."""
+        return self.backend.health(self.gemini_config.model_name)
+    
+    @profiled('enhance_image')
+    def enhance_image(self, image_path: str, prompt: str, output_dir: str = None) -> EnhancementResult:
         """
         Enhance an image using Gemini AI with the given prompt.
         
@@ -61,94 +218,913 @@ class GeminiEnhancementEngine:
             output_dir (str, optional): Directory to save enhanced images
             
         Returns:
-            Dict[str, Any]: Result containing enhanced image info and metadata
+            EnhancementResult: Result containing enhanced image info and metadata
             
         Raises:
             ImageProcessingError: If image processing fails
             GeminiAPIError: If Gemini API call fails
+            BudgetExceededError: If the call would exceed a session or process token budget
         """
         start_time = datetime.now()
         session_id = str(uuid.uuid4())[:8]
+        timings = {}
         
-        logger.info(f"Starting enhancement session {session_id} for image: {image_path}")
+        with log_session(session_id):
+            logger.info(f"Starting enhancement session {session_id} for image: {image_path}")
+            ENHANCE_REQUESTS.inc(mode='single')
+            
+            try:
+                # Prepare image
+                with stage_timer(timings, 'prepare'):
+                    processed_image = self._prepare_image(image_path)
+                
+                if output_dir is None:
+                    output_dir = f"enhanced_images_{session_id}"
+                
+                Path(output_dir).mkdir(parents=True, exist_ok=True)
+                
+                image_hash, result = self._find_near_duplicate(processed_image, prompt, output_dir, session_id)
+                if result is None:
+                    with stage_timer(timings, 'call'):
+                        response, issues = self._call_and_check(processed_image, prompt)
+                    
+                    # Process response
+                    with stage_timer(timings, 'save'):
+                        result = self._process_gemini_response(response, output_dir, session_id)
+                    result.quality_issues = issues
+                    self._remember_result(image_hash, processed_image.size, prompt, session_id, result)
+                
+                # Add metadata
+                self._add_result_metadata(result, session_id, image_path, prompt, start_time)
+                processing_time = result.processing_time_seconds
+                
+                logger.info(
+                    f"Enhancement completed successfully in {processing_time:.2f}s",
+                    extra={'stage_timings_ms': timings}
+                )
+                ENHANCE_SUCCESSES.inc(mode='single')
+                observe_stage_timings(timings)
+                return result
+                
+            except Exception as e:
+                logger.error(f"Enhancement failed for session {session_id}: {str(e)}", extra={'stage_timings_ms': timings})
+                ENHANCE_FAILURES.inc(mode='single', error_class=type(e).__name__)
+                observe_stage_timings(timings)
+                if isinstance(e, (ImageProcessingError, GeminiAPIError, BudgetExceededError)):
+                    raise
+                raise PhotoProError(f"Unexpected error during enhancement: {str(e)}")
+    
+    def enhance_batch(self, items: Iterable[BatchItem], prompt: str, output_dir: str,
+                      pipeline_config: PipelineConfig = None, lane: str = BULK) -> Iterator[PipelineJob]:
+        """
+        Enhance a stream of uploads with bounded memory.
         
-        try:
-            # Prepare image
-            processed_image = self.image_processor.prepare_image(image_path)
+        Items flow through read -> prepare -> call -> save stages with bounded queues and a
+        shared memory budget, so peak memory does not grow with the batch size. Uploads are
+        only read when they enter the pipeline and every stage drops its pixel data as soon
+        as the next stage has what it needs.
+        
+        Args:
+            items (Iterable[BatchItem]): Uploads to enhance, consumed lazily
+            prompt (str): Enhancement prompt shared by the batch
+            output_dir (str): Directory to save enhanced images
+            pipeline_config (PipelineConfig, optional): Queue depths, workers and memory budget
+            lane (str): Scheduler lane for the model calls; ``INTERACTIVE`` for single uploads
+            
+        Yields:
+            PipelineJob: Finished jobs in completion order, with ``result`` or ``error`` set
+        """
+        if pipeline_config is None:
+            # Keep every CPU worker process busy when the pool is enabled
+            cpu_workers = self.cpu_pool.workers if self.cpu_pool is not None else 1
+            pipeline_config = PipelineConfig(prepare_workers=cpu_workers, save_workers=cpu_workers)
+        pipeline = BatchPipeline(pipeline_config)
+        Path(output_dir).mkdir(parents=True, exist_ok=True)
+        if isinstance(items, Sized):
+            self.quality_budget.expect(len(items))
+        max_width, max_height = self.image_config.max_size
+        
+        with tempfile.TemporaryDirectory() as work_dir:
+            def read(job: PipelineJob) -> None:
+                data = job.item.read()
+                with Image.open(BytesIO(data)) as img:
+                    width, height = img.size
+                # Reserve the worst case up front (full decode + prepared + output) so later
+                # stages only ever shrink the reservation and cannot deadlock on the budget
+                scale = min(1.0, max_width / width, max_height / height)
+                prepared_bytes = int(width * scale) * int(height * scale) * 3
+                pipeline.budget.resize(job, width * height * 3 + 2 * prepared_bytes)
+                
+                path = os.path.join(work_dir, f"{job.index}_{os.path.basename(job.item.name)}")
+                with open(path, "wb") as f:
+                    f.write(data)
+                job.state['path'] = path
             
-            if output_dir is None:
-                output_dir = f"enhanced_images_{session_id}"
+            def prepare(job: PipelineJob) -> None:
+                path = job.state.pop('path')
+                job.state['start_time'] = datetime.now()
+                job.state['session_id'] = str(uuid.uuid4())[:8]
+                try:
+                    with log_session(job.state['session_id']), stage_timer(job.timings, 'prepare'):
+                        image = self._prepare_image(path)
+                finally:
+                    os.remove(path)
+                job.state['image'] = image
+                pipeline.budget.resize(job, 2 * image.size[0] * image.size[1] * 3)
             
-            Path(output_dir).mkdir(parents=True, exist_ok=True)
+            def call(job: PipelineJob) -> None:
+                image = job.state.pop('image')
+                session_id = job.state['session_id']
+                with log_session(session_id):
+                    image_hash, reused = self._find_near_duplicate(image, prompt, output_dir, session_id)
+                    if reused is None:
+                        with stage_timer(job.timings, 'call'):
+                            job.state['response'], job.state['quality_issues'] = self._call_and_check(image, prompt, lane)
+                        job.state['reuse'] = (image_hash, image.size)
+                    else:
+                        job.state['reused'] = reused
+                pipeline.budget.resize(job, image.size[0] * image.size[1] * 3)
+                image.close()
             
-            response = self._call_gemini_api_with_retry(processed_image, prompt)
+            def save(job: PipelineJob) -> None:
+                session_id = job.state['session_id']
+                with log_session(session_id):
+                    result = job.state.pop('reused', None)
+                    if result is None:
+                        response = job.state.pop('response')
+                        with stage_timer(job.timings, 'save'):
+                            result = self._process_gemini_response(response, output_dir, session_id)
+                        result.quality_issues = job.state.pop('quality_issues')
+                        image_hash, image_size = job.state.pop('reuse')
+                        self._remember_result(image_hash, image_size, prompt, session_id, result)
+                    job.result = self._add_result_metadata(
+                        result, session_id, job.item.name, prompt, job.state['start_time']
+                    )
+                    logger.info(
+                        f"Batch item {job.item.name} completed in {job.result.processing_time_seconds:.2f}s",
+                        extra={'stage_timings_ms': job.timings}
+                    )
             
-            # Process response
-            result = self._process_gemini_response(response, output_dir, session_id)
+            def counted(items: Iterable[BatchItem]) -> Iterator[BatchItem]:
+                for item in items:
+                    ENHANCE_REQUESTS.inc(mode='batch')
+                    yield item
             
-            # Add metadata
-            processing_time = (datetime.now() - start_time).total_seconds()
-            result.update({
-                'session_id': session_id,
-                'original_image': image_path,
-                'prompt': prompt,
-                'processing_time_seconds': processing_time,
-                'timestamp': datetime.now().isoformat()
-            })
+            for job in pipeline.run(counted(items), read, prepare, call, save):
+                if job.error is None:
+                    ENHANCE_SUCCESSES.inc(mode='batch')
+                else:
+                    ENHANCE_FAILURES.inc(mode='batch', error_class=type(job.error).__name__)
+                observe_stage_timings(job.timings)
+                yield job
+    
+    def enhance_region(self, image_path: str, prompt: str, box: Tuple[int, int, int, int],
+                       output_dir: str = None, margin: float = 0.25) -> EnhancementResult:
+        """
+        Enhance only a region of an image and composite the result into the full-resolution original.
+        
+        The region plus a margin is cropped from the original, downscaled to ``max_size`` only if
+        it is larger, and sent on its own, so the edit gets more pixels than it would in a
+        downscaled full frame. The result is feathered back over the margin; everything outside
+        the crop keeps the original pixels.
+        
+        Args:
+            image_path (str): Path to the input image
+            prompt (str): Enhancement prompt for the region
+            box (Tuple[int, int, int, int]): Region as (left, top, right, bottom) in original pixels
+            output_dir (str, optional): Directory to save the composited image
+            margin (float): Context margin around the region, as a fraction of its larger side
             
-            logger.info(f"Enhancement completed successfully in {processing_time:.2f}s")
-            return result
+        Returns:
+            EnhancementResult: Result containing the composited image info and metadata
             
-        except Exception as e:
-            logger.error(f"Enhancement failed for session {session_id}: {str(e)}")
-            if isinstance(e, (ImageProcessingError, GeminiAPIError)):
+        Raises:
+            ImageProcessingError: If the image or region is invalid
+            GeminiAPIError: If Gemini API call fails
+            BudgetExceededError: If the call would exceed a session or process token budget
+        """
+        start_time = datetime.now()
+        session_id = str(uuid.uuid4())[:8]
+        timings = {}
+        
+        with log_session(session_id):
+            logger.info(f"Starting region enhancement session {session_id} for image: {image_path} {box}")
+            ENHANCE_REQUESTS.inc(mode='region')
+            
+            try:
+                original = None
+                try:
+                    with stage_timer(timings, 'prepare'):
+                        original = self.image_processor.load_original(image_path)
+                        crop_box = self.image_processor.region_crop_box(box, original.size, margin)
+                        region = original.crop(crop_box)
+                        region.thumbnail(self.image_config.max_size, self.image_config.resampling_method)
+                    
+                    if output_dir is None:
+                        output_dir = f"enhanced_images_{session_id}"
+                    Path(output_dir).mkdir(parents=True, exist_ok=True)
+                    
+                    with stage_timer(timings, 'call'), region:
+                        response = self._call_gemini_api_with_retry(region, prompt)
+                    
+                    # Each image part is composited into its own copy; the original stays ours to close
+                    with stage_timer(timings, 'save'):
+                        result = self._process_gemini_response(
+                            response, output_dir, session_id,
+                            transform=lambda edited: self.image_processor.composite_region(
+                                original.copy(), edited, crop_box, box
+                            )
+                        )
+                finally:
+                    if original is not None:
+                        original.close()
+                
+                result.region, result.crop_box = tuple(box), crop_box
+                self._add_result_metadata(result, session_id, image_path, prompt, start_time)
+                logger.info(
+                    f"Region enhancement completed in {result.processing_time_seconds:.2f}s",
+                    extra={'stage_timings_ms': timings}
+                )
+                ENHANCE_SUCCESSES.inc(mode='region')
+                observe_stage_timings(timings)
+                return result
+                
+            except Exception as e:
+                logger.error(f"Region enhancement failed for session {session_id}: {str(e)}", extra={'stage_timings_ms': timings})
+                ENHANCE_FAILURES.inc(mode='region', error_class=type(e).__name__)
+                observe_stage_timings(timings)
+                if isinstance(e, (ImageProcessingError, GeminiAPIError, BudgetExceededError)):
+                    raise
+                raise PhotoProError(f"Unexpected error during region enhancement: {str(e)}")
+    
+    def enhance_variants(self, image_path: str, prompt: str, count: int, output_dir: str = None) -> List[EnhancementResult]:
+        """
+        Generate several variants of one image for the user to choose from.
+        
+        Variants are requested as ``count`` candidates of a single call; models that do not
+        support multiple candidates get the missing variants as concurrent calls instead.
+        Every variant's image is processed and saved in parallel.
+        
+        Args:
+            image_path (str): Path to the input image
+            prompt (str): Enhancement prompt for Gemini
+            count (int): Number of variants
+            output_dir (str, optional): Directory to save enhanced images
+            
+        Returns:
+            List[EnhancementResult]: One result per variant, numbered by ``variant``
+            
+        Raises:
+            ImageProcessingError: If image processing fails
+            GeminiAPIError: If Gemini API call fails
+            BudgetExceededError: If the call would exceed a session or process token budget
+        """
+        start_time = datetime.now()
+        session_id = str(uuid.uuid4())[:8]
+        timings = {}
+        
+        with log_session(session_id):
+            logger.info(f"Starting {count}-variant session {session_id} for image: {image_path}")
+            ENHANCE_REQUESTS.inc(mode='variants')
+            
+            try:
+                with stage_timer(timings, 'prepare'):
+                    processed_image = self._prepare_image(image_path)
+                
+                if output_dir is None:
+                    output_dir = f"enhanced_images_{session_id}"
+                Path(output_dir).mkdir(parents=True, exist_ok=True)
+                
+                with stage_timer(timings, 'call'):
+                    responses = self._generate_variants(processed_image, prompt, count)
+                processed_image.close()
+                
+                candidates = [
+                    (response, index) for response in responses for index in range(len(response.candidates))
+                ][:count]
+                
+                def save_variant(variant: int) -> EnhancementResult:
+                    variant_id = f"{session_id}-{variant}"
+                    response, index = candidates[variant - 1]
+                    with log_session(variant_id):
+                        result = self._process_gemini_response(response, output_dir, variant_id, candidate=index)
+                        result.variant = variant
+                        return self._add_result_metadata(result, variant_id, image_path, prompt, start_time)
+                
+                with stage_timer(timings, 'save'), ThreadPoolExecutor(max_workers=len(candidates)) as executor:
+                    results = list(executor.map(save_variant, range(1, len(candidates) + 1)))
+                
+                logger.info(
+                    f"{len(results)} variant(s) completed in {(datetime.now() - start_time).total_seconds():.2f}s",
+                    extra={'stage_timings_ms': timings}
+                )
+                ENHANCE_SUCCESSES.inc(mode='variants')
+                observe_stage_timings(timings)
+                return results
+                
+            except Exception as e:
+                logger.error(f"Variant generation failed for session {session_id}: {str(e)}", extra={'stage_timings_ms': timings})
+                ENHANCE_FAILURES.inc(mode='variants', error_class=type(e).__name__)
+                observe_stage_timings(timings)
+                if isinstance(e, (ImageProcessingError, GeminiAPIError, BudgetExceededError)):
+                    raise
+                raise PhotoProError(f"Unexpected error during variant generation: {str(e)}")
+    
+    def _generate_variants(self, image: Image.Image, prompt: str, count: int) -> List[Any]:
+        """Return responses holding at least ``count`` candidates in total."""
+        backend, model_name = self.router.route(image.size)
+        key = (getattr(backend, 'breaker_key', backend.name), model_name)
+        responses = []
+        
+        if count > 1 and _candidate_count_support.get(key, True):
+            try:
+                response = self._call_gemini_api_with_retry(image, prompt, candidate_count=count, max_retries=1)
+                responses.append(response)
+                _candidate_count_support[key] = len(response.candidates) >= count
+            except BackendUnavailableError:
                 raise
-            raise PhotoProError(f"Unexpected error during enhancement: {str(e)}")
+            except GeminiAPIError as e:
+                # A rejected request means no candidate support; transient failures just fall back
+                # to concurrent calls, which retry as usual
+                if classify_failure(e.__cause__) is None:
+                    _candidate_count_support[key] = False
+            if not _candidate_count_support.get(key, True):
+                logger.info(f"{backend.name}:{model_name} does not return multiple candidates; using concurrent calls")
+        
+        missing = count - sum(len(response.candidates) for response in responses)
+        if missing > 0:
+            with ThreadPoolExecutor(max_workers=missing) as executor:
+                # Each call must be its own sample, so none of them go through the result cache
+                responses.extend(executor.map(
+                    lambda _: self._call_gemini_api_with_retry(image, prompt, use_cache=False), range(missing)
+                ))
+        return responses
+    
+    def enhance_frames(self, image_path: str, prompt: str, output_dir: str = None,
+                       frame_config: FrameConfig = None) -> EnhancementResult:
+        """
+        Enhance every frame of a multi-frame GIF, WebP or TIFF and reassemble it.
+
+        Frames are decoded one at a time; consecutive frames that are identical or nearly so
+        share one model call, so cost and memory follow the number of unique frames. Unique
+        frames are enhanced concurrently and written back with the source frame timing.
+
+        Args:
+            image_path (str): Path to the multi-frame input
+            prompt (str): Enhancement prompt applied to every frame
+            output_dir (str, optional): Directory to save the result
+            frame_config (FrameConfig, optional): Dedup threshold, frame cap and concurrency
+
+        Returns:
+            EnhancementResult: Result with the reassembled file, plus ``frame_count`` and ``unique_frames``
+
+        Raises:
+            ImageProcessingError: If the input is not multi-frame or has too many unique frames
+            GeminiAPIError: If a frame's model call fails
+            BudgetExceededError: If a call would exceed a session or process token budget
+        """
+        frame_config = frame_config or FrameConfig()
+        start_time = datetime.now()
+        session_id = str(uuid.uuid4())[:8]
+        timings = {}
+
+        with log_session(session_id):
+            logger.info(f"Starting frame enhancement session {session_id} for image: {image_path}")
+            ENHANCE_REQUESTS.inc(mode='frames')
+
+            try:
+                self.image_processor.validator.validate_image_file(image_path)
+                if output_dir is None:
+                    output_dir = f"enhanced_images_{session_id}"
+                Path(output_dir).mkdir(parents=True, exist_ok=True)
+
+                deduper = FrameDeduper(frame_config.dedup_threshold)
+                futures = []
+                # Bounds the prepared frames waiting for a model call
+                window = threading.BoundedSemaphore(2 * frame_config.workers)
+
+                def enhance(frame: Frame) -> Image.Image:
+                    try:
+                        response = self._call_gemini_api_with_retry(frame.image, prompt, lane=BULK)
+                    finally:
+                        frame.image.close()
+                        window.release()
+                    return restore_alpha(self._decode_first_image(response), frame.alpha)
+
+                executor = ThreadPoolExecutor(max_workers=frame_config.workers)
+                try:
+                    with stage_timer(timings, 'call'), Image.open(image_path) as img:
+                        if not is_multi_frame(img):
+                            raise ImageProcessingError(f"{os.path.basename(image_path)} has a single frame")
+                        image_format, loop = img.format, img.info.get('loop')
+
+                        for frame in iter_frames(img, self.image_config):
+                            if not deduper.add(frame):
+                                frame.image.close()
+                                continue
+                            if len(futures) >= frame_config.max_unique_frames:
+                                raise ImageProcessingError(
+                                    f"More than {frame_config.max_unique_frames} unique frames; "
+                                    f"trim the animation or raise the limit"
+                                )
+                            window.acquire()
+                            # Stop feeding frames as soon as one of them has failed
+                            failed = next((f for f in futures if f.done() and f.exception() is not None), None)
+                            if failed is not None:
+                                frame.image.close()
+                                failed.result()
+                            futures.append(executor.submit(enhance, frame))
+
+                        frames = [future.result() for future in futures]
+                finally:
+                    executor.shutdown(wait=True, cancel_futures=True)
+
+                extension, mime = FRAME_FORMATS[image_format]
+                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+                filename = f"enhanced_{session_id}_{timestamp}{extension}"
+                output_path = os.path.join(output_dir, filename)
+
+                with stage_timer(timings, 'save'):
+                    save_frames(frames, deduper.runs, output_path, image_format, loop)
+                    image_info = EnhancedImage(output_path, filename, frames[0].size, image_format, frames[0].mode, mime)
+                    if image_format == 'TIFF':
+                        # Browsers cannot show TIFF; keep a first-page preview next to it
+                        image_info.preview_path = self._save_image(
+                            frames[0], os.path.join(output_dir, f"preview_{session_id}.png")
+                        )
+                for frame in frames:
+                    frame.close()
+
+                result = EnhancementResult(
+                    output_directory=output_dir,
+                    enhanced_images=[image_info],
+                    frame_count=sum(run.frame_count for run in deduper.runs),
+                    unique_frames=len(deduper.runs)
+                )
+                self._add_result_metadata(result, session_id, image_path, prompt, start_time)
+
+                logger.info(
+                    f"Frame enhancement completed in {result.processing_time_seconds:.2f}s: "
+                    f"{result.unique_frames} unique of {result.frame_count} frames",
+                    extra={'stage_timings_ms': timings}
+                )
+                ENHANCE_SUCCESSES.inc(mode='frames')
+                observe_stage_timings(timings)
+                return result
+
+            except Exception as e:
+                logger.error(f"Frame enhancement failed for session {session_id}: {str(e)}", extra={'stage_timings_ms': timings})
+                ENHANCE_FAILURES.inc(mode='frames', error_class=type(e).__name__)
+                observe_stage_timings(timings)
+                if isinstance(e, (ImageProcessingError, GeminiAPIError, BudgetExceededError)):
+                    raise
+                raise PhotoProError(f"Unexpected error during frame enhancement: {str(e)}")
+
+    def start_edit_session(self, image_path: str, max_undo: int = 10) -> EditSession:
+        """
+        Prepare an upload once and start an iterative editing session on it.
+        
+        Args:
+            image_path (str): Path to the original image
+            max_undo (int): Number of previous steps kept in memory for undo
+            
+        Returns:
+            EditSession: Session holding the prepared image
+        """
+        return EditSession(self._prepare_image(image_path), os.path.basename(image_path), max_undo)
     
-    def _call_gemini_api_with_retry(self, image: Image.Image, prompt: str) -> Any:
+    def edit(self, session: EditSession, prompt: str) -> EnhancementResult:
+        """
+        Apply a refinement prompt to the session's current image and make the result current.
+        
+        Args:
+            session (EditSession): Session started with ``start_edit_session``
+            prompt (str): Refinement prompt, e.g. "now make it warmer"
+            
+        Returns:
+            EnhancementResult: Result for this step, saved under ``session.output_dir``
+            
+        Raises:
+            GeminiAPIError: If the call fails or the response has no image to continue from
+            BudgetExceededError: If the call would exceed a session or process token budget
+        """
+        start_time = datetime.now()
+        session_id = str(uuid.uuid4())[:8]
+        timings = {}
+        
+        with log_session(session_id):
+            logger.info(f"Edit step {len(session.steps) + 1} for {session.source_name}")
+            ENHANCE_REQUESTS.inc(mode='edit')
+            
+            try:
+                with stage_timer(timings, 'call'):
+                    # Repeating a refinement should produce a new take, not replay the last one
+                    response = self._call_gemini_api_with_retry(session.current, prompt, use_cache=False)
+                
+                decoded_images = []
+                with stage_timer(timings, 'save'):
+                    result = self._process_gemini_response(response, session.output_dir, session_id, decoded_images)
+                if not decoded_images:
+                    raise GeminiAPIError("Gemini response has no image to continue editing from")
+                
+                next_image = decoded_images[0]
+                for extra_image in decoded_images[1:]:
+                    extra_image.close()
+                if next_image.mode != 'RGB':
+                    next_image = next_image.convert('RGB')
+                next_image.thumbnail(self.image_config.max_size, self.image_config.resampling_method)
+                session.push(next_image, result)
+                
+                self._add_result_metadata(result, session_id, session.source_name, prompt, start_time)
+                logger.info(
+                    f"Edit step completed in {result.processing_time_seconds:.2f}s",
+                    extra={'stage_timings_ms': timings}
+                )
+                ENHANCE_SUCCESSES.inc(mode='edit')
+                observe_stage_timings(timings)
+                return result
+                
+            except Exception as e:
+                logger.error(f"Edit step failed for session {session_id}: {str(e)}", extra={'stage_timings_ms': timings})
+                ENHANCE_FAILURES.inc(mode='edit', error_class=type(e).__name__)
+                observe_stage_timings(timings)
+                if isinstance(e, (ImageProcessingError, GeminiAPIError, BudgetExceededError)):
+                    raise
+                raise PhotoProError(f"Unexpected error during edit: {str(e)}")
+    
+    def _find_near_duplicate(self, image: Image.Image, prompt: str, output_dir: str,
+                             session_id: str) -> Tuple[Optional[int], Optional[EnhancementResult]]:
+        """
+        Look up a prior result for a near-identical image and prompt.
+        
+        Returns:
+            Tuple: The image's dHash (None when reuse is off) and a result copied into
+            ``output_dir``, or None when there is nothing to reuse
+        """
+        if self.reuse_index is None:
+            return None, None
+        
+        image_hash = dhash(image)
+        match = self.reuse_index.lookup(image_hash, reuse_key(prompt, self.router.route(image.size)[1]))
+        if match is None:
+            return image_hash, None
+        
+        entry, distance = match
+        enhanced_images = []
+        try:
+            for i, image_info in enumerate(entry.enhanced_images):
+                filename = f"enhanced_{session_id}_{i}{os.path.splitext(image_info.path)[1]}"
+                output_path = os.path.join(output_dir, filename)
+                shutil.copyfile(image_info.path, output_path)
+                enhanced_images.append(replace(image_info, path=output_path, filename=filename))
+        except OSError as e:
+            logger.warning(f"Stored result of session {entry.session_id} is gone, calling the model: {str(e)}")
+            self.reuse_index.discard(entry)
+            return image_hash, None
+        
+        logger.info(f"Reusing result of session {entry.session_id} for near-duplicate image (distance {distance})")
+        return image_hash, EnhancementResult(
+            output_directory=output_dir,
+            text_responses=list(entry.text_responses),
+            enhanced_images=enhanced_images,
+            reused_from=entry.session_id,
+            hash_distance=distance
+        )
+    
+    def _remember_result(self, image_hash: Optional[int], image_size: Tuple[int, int], prompt: str,
+                         session_id: str, result: EnhancementResult) -> None:
+        if image_hash is not None and result.enhanced_images and not result.quality_issues:
+            self.reuse_index.add(image_hash, reuse_key(prompt, self.router.route(image_size)[1]), session_id, result)
+    
+    def _circuit_breaker(self, backend: ModelBackend) -> CircuitBreaker:
+        return get_circuit_breaker(
+            getattr(backend, 'breaker_key', backend.name),
+            self.gemini_config.circuit_failure_threshold,
+            self.gemini_config.circuit_recovery_seconds
+        )
+    
+    @profiled('prepare_image')
+    def _prepare_image(self, image_path: str) -> Image.Image:
+        if self.frame_cache is None:
+            return self._decode_and_prepare(image_path)
+        
+        # Re-runs of the same upload map the prepared pixels instead of decoding again
+        key = self.frame_cache.key_for_file(image_path, self.image_config)
+        image = self.frame_cache.get_frame(key)
+        if image is None:
+            image = self._decode_and_prepare(image_path)
+            self.frame_cache.put_frame(key, image)
+        return image
+    
+    def _decode_and_prepare(self, image_path: str) -> Image.Image:
+        if self.cpu_pool is not None:
+            return self.cpu_pool.prepare_image(image_path, self.image_config)
+        return self.image_processor.prepare_image(image_path)
+    
+    @profiled('save_enhanced_image')
+    def _save_image(self, image: Image.Image, output_path: str) -> str:
+        if self.cpu_pool is not None:
+            return self.cpu_pool.save_enhanced_image(image, output_path, self.image_config)
+        return self.image_processor.save_enhanced_image(image, output_path)
+    
+    def _add_result_metadata(self, result: EnhancementResult, session_id: str, image_path: str, prompt: str,
+                             start_time: datetime) -> EnhancementResult:
+        result.session_id = session_id
+        result.original_image = image_path
+        result.prompt = prompt
+        result.processing_time_seconds = (datetime.now() - start_time).total_seconds()
+        result.timestamp = time.time()
+        return result
+    
+    def _call_and_check(self, image: Image.Image, prompt: str, lane: str = INTERACTIVE) -> Tuple[Any, List[str]]:
+        """
+        Call the model and check the output; failed outputs are requested again while the
+        engine's retry budget allows. Only the first call's errors propagate; a failed retry
+        keeps the last response it had.
+        
+        Returns:
+            Tuple[Any, List[str]]: The last response and the quality issues it still has
+        """
+        response = self._call_gemini_api_with_retry(image, prompt, lane=lane)
+        if not self.quality.enabled:
+            return response, []
+        
+        self.quality_budget.record_check()
+        issues = self._check_response(response, image)
+        retries = 0
+        while issues and retries < self.quality.max_retries_per_image and self.quality_budget.try_retry():
+            retries += 1
+            logger.warning(f"Output failed quality check ({', '.join(issues)}), requesting it again", extra={'sample': True})
+            QUALITY_RETRIES.inc()
+            try:
+                retried = self._call_gemini_api_with_retry(image, prompt, lane=lane, refresh=True)
+            except (GeminiAPIError, BudgetExceededError) as e:
+                # The first response is still usable; keep it rather than failing the image
+                logger.warning(f"Quality retry failed, keeping the previous output: {str(e)}")
+                break
+            response, issues = retried, self._check_response(retried, image)
+        return response, issues
+    
+    def _check_response(self, response: Any, source: Image.Image) -> List[str]:
+        output = None
+        try:
+            for part in response.candidates[0].content.parts:
+                if part.inline_data is not None:
+                    output = Image.open(BytesIO(part.inline_data.data))
+                    break
+            issues = check_output(source, output, self.quality)
+        except Exception as e:
+            # An undecodable image is left for _process_gemini_response to report
+            logger.warning(f"Could not check output quality: {str(e)}")
+            issues = []
+        finally:
+            if output is not None:
+                output.close()
+        for issue in issues or ['ok']:
+            QUALITY_CHECKS.inc(issue=issue)
+        return issues
+    
+    def _call_gemini_api_with_retry(self, image: Image.Image, prompt: str, candidate_count: int = 1,
+                                    max_retries: int = None, lane: str = INTERACTIVE, refresh: bool = False,
+                                    use_cache: bool = True) -> Any:
         """
         Call Gemini API with retry logic.
         
         Args:
             image (Image.Image): Processed image
             prompt (str): Enhancement prompt
+            candidate_count (int): Number of candidates to request
+            max_retries (int, optional): Override ``GeminiConfig.max_retries``
+            lane (str): Scheduler lane the attempts wait in
+            refresh (bool): Skip any cached response and replace it with a fresh one
+            use_cache (bool): Set to False for calls that must not share a response with an
+                identical request, such as the separate calls behind each variant
             
         Returns:
             Gemini API response
             
         Raises:
             GeminiAPIError: If all retry attempts fail
+            BudgetExceededError: If the next attempt could exceed a token budget
         """
+        backend, model_name = self.router.route(image.size)
+        
+        # Encode once; every retry reuses the same bytes
+        image_bytes, mime_type = self._encode_for_upload(image)
+        image_part = types.Part.from_bytes(data=image_bytes, mime_type=mime_type)
+        logger.info(
+            f"Upload payload: {len(image_bytes) / 1024:.1f} KB {mime_type} "
+            f"({image.size[0]}x{image.size[1]}, quality {self.image_config.upload_quality})",
+            extra={'upload_bytes': len(image_bytes), 'sample': True}
+        )
+        
+        def call() -> Any:
+            return self._call_with_retry(
+                backend, model_name, image_part, len(image_bytes), image.size, prompt, candidate_count, max_retries, lane
+            )
+        
+        if self.result_cache is None or not use_cache:
+            return call()
+        
+        # Identical uploads and settings share one model call, across sessions and replicas
+        key = result_cache_key(
+            image_bytes, prompt, model_name, candidate_count, self.gemini_config.response_modalities
+        )
+        if refresh:
+            self.result_cache.invalidate(key)
+        return decode_response(self.result_cache.get_or_compute(key, lambda: encode_response(call())))
+    
+    def _encode_for_upload(self, image: Image.Image) -> Tuple[bytes, str]:
+        key = image.info.get(FRAME_KEY_INFO) if self.frame_cache is not None else None
+        if key is None:
+            return self.image_processor.encode_for_upload(image)
+        
+        upload_format = self.image_config.upload_format.upper()
+        variant = f"{upload_format.lower()}{self.image_config.upload_quality}"
+        image_bytes = self.frame_cache.get_payload(key, variant)
+        if image_bytes is not None:
+            return image_bytes, Image.MIME[upload_format]
+        image_bytes, mime_type = self.image_processor.encode_for_upload(image)
+        self.frame_cache.put_payload(key, variant, image_bytes)
+        return image_bytes, mime_type
+    
+    def _call_with_retry(self, backend: ModelBackend, model_name: str, image_part: types.Part, upload_bytes: int,
+                         image_size: Tuple[int, int], prompt: str, candidate_count: int, max_retries: Optional[int],
+                         lane: str) -> Any:
         last_exception = None
+        breaker = self._circuit_breaker(backend)
+        # Every attempt is charged, so each one reserves its estimate against the budgets first
+        estimated_usage = estimate_usage(prompt, image_size, candidate_count)
+        estimated_tokens = estimated_usage.total_tokens
+        max_retries = max_retries or self.gemini_config.max_retries
         
-        for attempt in range(self.gemini_config.max_retries):
+        for attempt in range(max_retries):
+            if not breaker.allow_request():
+                raise BackendUnavailableError(
+                    f"Backend {backend.name} unavailable ({breaker.last_failure_class}); "
+                    f"retry in {breaker.retry_after:.0f}s",
+                    breaker.retry_after
+                )
+            
+            try:
+                self.usage.reserve(estimated_tokens)
+                try:
+                    # Slots are held per attempt, never across the backoff sleep
+                    slot = self.scheduler.acquire(self.tenant, lane)
+                except BaseException:
+                    self.usage.settle(estimated_tokens, None)
+                    raise
+            except BaseException:
+                # Nothing was sent, so a half-open probe slot must go back to the breaker
+                breaker.cancel_request()
+                raise
+            response = None
+            hedges = []
+            
+            def reserve_hedge() -> bool:
+                # A hedge is a second billed request: it needs budget of its own
+                try:
+                    self.usage.reserve(estimated_tokens)
+                except BudgetExceededError:
+                    return False
+                hedges.append(estimated_tokens)
+                return True
+            
             try:
-                logger.info(f"Calling Gemini API (attempt {attempt + 1}/{self.gemini_config.max_retries})")
+                logger.info(
+                    f"Calling {backend.name}:{model_name} (attempt {attempt + 1}/{max_retries})",
+                    extra={'sample': True}
+                )
+                
+                if attempt > 0:
+                    API_RETRIES.inc(backend=backend.name, model=model_name)
+                
+                cache_name = self._get_prompt_cache(backend, model_name, prompt)
+                if cache_name:
+                    try:
+                        BYTES_UPLOADED.inc(upload_bytes)
+                        response = self._generate(
+                            backend, model_name, [image_part], cached_content=cache_name,
+                            candidate_count=candidate_count, before_hedge=reserve_hedge
+                        )
+                    except Exception as e:
+                        logger.warning(f"Cached prompt call failed, falling back to full prompt: {str(e)}")
+                        self._disable_prompt_cache(backend, model_name)
                 
-                response = self.client.models.generate_content(
-                    model=self.gemini_config.model_name,
-                    contents=[(prompt,), image],
-                    config=types.GenerateContentConfig(
-                        response_modalities=self.gemini_config.response_modalities
+                if response is None:
+                    BYTES_UPLOADED.inc(upload_bytes + len(prompt.encode('utf-8')))
+                    response = self._generate(
+                        backend, model_name, [(prompt,), image_part], candidate_count=candidate_count,
+                        before_hedge=reserve_hedge
                     )
-                )
                 
                 if not response.candidates:
                     raise GeminiAPIError("No candidates in Gemini response")
                 
+                API_CALLS.inc(backend=backend.name, model=model_name, outcome='success')
+                breaker.record_success()
                 return response
                 
             except Exception as e:
                 last_exception = e
+                breaker.record_failure(e)
+                API_CALLS.inc(backend=backend.name, model=model_name, outcome=type(e).__name__)
                 logger.warning(f"Gemini API attempt {attempt + 1} failed: {str(e)}")
-                
-                if attempt < self.gemini_config.max_retries - 1:
-                    import time
-                    time.sleep(2 ** attempt)  
+            
+            finally:
+                self.scheduler.release(slot)
+                self.usage.settle(estimated_tokens, UsageRecord.from_response(response) if response is not None else None)
+                # Only one of a hedged pair reports usage, but the provider bills both
+                for hedge_tokens in hedges:
+                    self.usage.settle(hedge_tokens, estimated_usage)
+            
+            # No point backing off when the breaker has just opened; the next attempt fails fast
+            if attempt < max_retries - 1 and not breaker.is_open:
+                time.sleep(2 ** attempt)  
+        
+        raise GeminiAPIError(f"Gemini API failed after {max_retries} attempts: {str(last_exception)}") from last_exception
+    
+    def _generate(self, backend: ModelBackend, model_name: str, contents: List[Any], cached_content: str = None,
+                  candidate_count: int = 1, before_hedge: Callable[[], bool] = None) -> Any:
+        config = types.GenerateContentConfig(
+            response_modalities=self.gemini_config.response_modalities,
+            cached_content=cached_content,
+            candidate_count=candidate_count if candidate_count > 1 else None
+        )
+        policy = get_hedge_policy(
+            backend.name, model_name,
+            self.gemini_config.hedge_percentile,
+            self.gemini_config.hedge_budget_fraction,
+            self.gemini_config.hedge_min_samples
+        )
+        hedge_delay = policy.start_call()
+        start = time.perf_counter()
+        
+        if self.gemini_config.hedge_enabled and hedge_delay is not None:
+            response = run_async(hedged_call(
+                lambda: backend.agenerate(model=model_name, contents=contents, config=config),
+                hedge_delay, policy, before_hedge
+            ))
+        else:
+            response = backend.generate(model=model_name, contents=contents, config=config)
         
-        raise GeminiAPIError(f"Gemini API failed after {self.gemini_config.max_retries} attempts: {str(last_exception)}")
+        policy.latency.record(time.perf_counter() - start)
+        return response
+    
+    def _get_prompt_cache(self, backend: ModelBackend, model_name: str, prompt: str) -> Optional[str]:
+        """Return the cached-content name for a shared prompt, creating it on first use."""
+        if self._shared_prompt is None or prompt != self._shared_prompt:
+            return None
+        
+        key = (id(backend), model_name)
+        with self._prompt_cache_lock:
+            if key in self._prompt_caches:
+                if self._prompt_caches[key]:
+                    CACHE_LOOKUPS.inc(cache='prompt', result='hit')
+                return self._prompt_caches[key]
+            CACHE_LOOKUPS.inc(cache='prompt', result='miss')
+            
+            cache_name = None
+            if isinstance(backend, PromptCachingBackend):
+                try:
+                    cache_name = backend.create_prompt_cache(
+                        model_name, prompt, self.gemini_config.prompt_cache_ttl_seconds
+                    )
+                    logger.info(f"Uploaded shared prompt once as {cache_name} ({len(prompt)} chars)")
+                except Exception as e:
+                    logger.warning(f"Prompt caching unavailable for {backend.name}:{model_name}: {str(e)}")
+            
+            self._prompt_caches[key] = cache_name
+            self._prompt_cache_backends[id(backend)] = backend
+            return cache_name
+    
+    def _disable_prompt_cache(self, backend: ModelBackend, model_name: str) -> None:
+        with self._prompt_cache_lock:
+            cache_name = self._prompt_caches.get((id(backend), model_name))
+            self._prompt_caches[(id(backend), model_name)] = None
+        if cache_name:
+            try:
+                backend.delete_prompt_cache(cache_name)
+            except Exception as e:
+                logger.warning(f"Failed to delete prompt cache {cache_name}: {str(e)}")
+    
+    def _decode_first_image(self, response: Any) -> Image.Image:
+        """Decode the first image part of a response into a loaded RGB image."""
+        try:
+            for part in response.candidates[0].content.parts:
+                if part.inline_data is not None:
+                    BYTES_DOWNLOADED.inc(len(part.inline_data.data))
+                    with Image.open(BytesIO(part.inline_data.data)) as image:
+                        return image.convert('RGB')
+        except Exception as e:
+            raise GeminiAPIError(f"Failed to process Gemini response: {str(e)}")
+        raise GeminiAPIError("No image in Gemini response")
     
-    def _process_gemini_response(self, response: Any, output_dir: str, session_id: str) -> Dict[str, Any]:
+    @profiled('process_response')
+    def _process_gemini_response(self, response: Any, output_dir: str, session_id: str,
+                                 decoded_images: List[Image.Image] = None,
+                                 transform: Callable[[Image.Image], Image.Image] = None,
+                                 candidate: int = 0) -> EnhancementResult:
         """
         Process Gemini API response and save results.
         
@@ -156,49 +1132,57 @@ class GeminiEnhancementEngine:
             response: Gemini API response
             output_dir (str): Output directory
             session_id (str): Session identifier
+            decoded_images (List[Image.Image], optional): If given, receives the decoded images
+                instead of closing them, for callers that keep working on the result
+            transform (Callable, optional): Applied to each decoded image before it is saved
+            candidate (int): Index of the response candidate to process
             
         Returns:
-            Dict[str, Any]: Processing results
+            EnhancementResult: Processing results
             
         Raises:
             GeminiAPIError: If response processing fails
         """
         try:
-            result = {
-                'text_responses': [],
-                'enhanced_images': [],
-                'output_directory': output_dir
-            }
+            result = EnhancementResult(output_directory=output_dir)
             
-            for part in response.candidates[0].content.parts:
+            for part in response.candidates[candidate].content.parts:
                 if part.text is not None:
-                    result['text_responses'].append(part.text)
-                    logger.info(f"Gemini text response: {part.text}")
+                    result.text_responses.append(part.text)
+                    logger.debug(f"Gemini text response: {part.text}", extra={'sample': True})
                 
                 elif part.inline_data is not None:
+                    BYTES_DOWNLOADED.inc(len(part.inline_data.data))
                     enhanced_image = Image.open(BytesIO(part.inline_data.data))
+                    if transform is not None:
+                        with enhanced_image:
+                            enhanced_image = transform(enhanced_image)
+                    try:
+                        # Generate unique filename
+                        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+                        # Later image parts get a suffix so they do not overwrite the first
+                        suffix = f"_{len(result.enhanced_images)}" if result.enhanced_images else ""
+                        filename = f"enhanced_{session_id}_{timestamp}{suffix}.png"
+                        output_path = os.path.join(output_dir, filename)
+                        
+                        # Save enhanced image
+                        saved_path = self._save_image(enhanced_image, output_path)
+                        
+                        # Add image info to result
+                        image_info = EnhancedImage(
+                            saved_path, filename, enhanced_image.size, enhanced_image.format, enhanced_image.mode
+                        )
+                    finally:
+                        if decoded_images is None:
+                            enhanced_image.close()
+                    if decoded_images is not None:
+                        enhanced_image.load()
+                        decoded_images.append(enhanced_image)
+                    result.enhanced_images.append(image_info)
                     
-                    # Generate unique filename
-                    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                    filename = f"enhanced_{session_id}_{timestamp}.png"
-                    output_path = os.path.join(output_dir, filename)
-                    
-                    # Save enhanced image
-                    saved_path = self.image_processor.save_enhanced_image(enhanced_image, output_path)
-                    
-                    # Add image info to result
-                    image_info = {
-                        'path': saved_path,
-                        'filename': filename,
-                        'size': enhanced_image.size,
-                        'format': enhanced_image.format,
-                        'mode': enhanced_image.mode
-                    }
-                    result['enhanced_images'].append(image_info)
-                    
-                    logger.info(f"Saved enhanced image: {saved_path}")
+                    logger.debug(f"Saved enhanced image: {saved_path}", extra={'sample': True})
             
-            if not result['enhanced_images'] and not result['text_responses']:
+            if not result.enhanced_images and not result.text_responses:
                 raise GeminiAPIError("No usable content in Gemini response")
             
             return result
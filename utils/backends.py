@@ -0,0 +1,262 @@
+import base64
+import hashlib
+import threading
+from io import BytesIO
+from dataclasses import dataclass
+from typing import Optional, Tuple, Dict, Any, List, Protocol, runtime_checkable
+
+import httpx
+from PIL import Image
+from google import genai
+from google.genai import types
+
+from utils.handler import PhotoProError, logs
+
+logger = logs()
+
+
+class ModelBackendError(PhotoProError):
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+@runtime_checkable
+class ModelBackend(Protocol):
+    """Anything able to run a ``generate_content`` style call against an image model."""
+
+    name: str
+
+    def generate(self, model: str, contents: List[Any], config: types.GenerateContentConfig) -> types.GenerateContentResponse:
+        ...
+
+    async def agenerate(self, model: str, contents: List[Any], config: types.GenerateContentConfig) -> types.GenerateContentResponse:
+        ...
+
+    def health(self, model: str) -> bool:
+        ...
+
+
+@runtime_checkable
+class PromptCachingBackend(ModelBackend, Protocol):
+    """Backend able to upload a shared instruction prefix once and reference it by name."""
+
+    def create_prompt_cache(self, model: str, prompt: str, ttl_seconds: int) -> str:
+        ...
+
+    def delete_prompt_cache(self, name: str) -> None:
+        ...
+
+
+class GeminiBackend:
+    """Google Gemini SDK backend."""
+
+    def __init__(self, api_key: str, client: Optional[genai.Client] = None):
+        self.name = "gemini"
+        # Quota and auth failures are per key, so the circuit breaker is too
+        self.breaker_key = f"gemini:{hashlib.sha256((api_key or '').encode('utf-8')).hexdigest()[:12]}"
+        try:
+            self.client = client or genai.Client(api_key=api_key)
+        except Exception as e:
+            raise ModelBackendError(f"Failed to configure Gemini client: {str(e)}")
+
+    def generate(self, model: str, contents: List[Any], config: types.GenerateContentConfig) -> types.GenerateContentResponse:
+        return self.client.models.generate_content(model=model, contents=contents, config=config)
+
+    async def agenerate(self, model: str, contents: List[Any], config: types.GenerateContentConfig) -> types.GenerateContentResponse:
+        return await self.client.aio.models.generate_content(model=model, contents=contents, config=config)
+
+    def health(self, model: str) -> bool:
+        try:
+            self.client.models.get(model=model)
+            return True
+        except Exception as e:
+            logger.warning(f"Gemini health check failed for {model}: {str(e)}")
+            return False
+
+    def create_prompt_cache(self, model: str, prompt: str, ttl_seconds: int) -> str:
+        cache = self.client.caches.create(
+            model=model,
+            config=types.CreateCachedContentConfig(
+                contents=[prompt],
+                ttl=f"{ttl_seconds}s",
+                display_name="photopro-shared-prompt"
+            )
+        )
+        return cache.name
+
+    def delete_prompt_cache(self, name: str) -> None:
+        self.client.caches.delete(name=name)
+
+
+class LocalHTTPBackend:
+    """
+    Backend for a local model server speaking the Gemini REST JSON format.
+
+    Requests are sent to ``{base_url}/v1beta/models/{model}:generateContent`` and the
+    JSON body is parsed back into a ``GenerateContentResponse``, so the engine cannot
+    tell it apart from the SDK. Useful for load tests and offline development together
+    with ``utils.fake_backend``.
+    """
+
+    def __init__(self, base_url: str = "http://127.0.0.1:8089", timeout_seconds: float = 60.0):
+        self.name = "local"
+        self.base_url = base_url.rstrip('/')
+        self.breaker_key = f"local:{self.base_url}"
+        self.timeout_seconds = timeout_seconds
+        self._client = httpx.Client(base_url=self.base_url, timeout=timeout_seconds)
+
+    def generate(self, model: str, contents: List[Any], config: types.GenerateContentConfig) -> types.GenerateContentResponse:
+        response = self._client.post(self._generate_url(model), json=build_rest_request(contents, config))
+        return self._parse_response(response)
+
+    async def agenerate(self, model: str, contents: List[Any], config: types.GenerateContentConfig) -> types.GenerateContentResponse:
+        async with httpx.AsyncClient(base_url=self.base_url, timeout=self.timeout_seconds) as client:
+            response = await client.post(self._generate_url(model), json=build_rest_request(contents, config))
+        return self._parse_response(response)
+
+    def health(self, model: str) -> bool:
+        try:
+            return self._client.get("/health").status_code == 200
+        except httpx.HTTPError as e:
+            logger.warning(f"Local backend health check failed: {str(e)}")
+            return False
+
+    def create_prompt_cache(self, model: str, prompt: str, ttl_seconds: int) -> str:
+        response = self._client.post("/v1beta/cachedContents", json={
+            'model': f"models/{model}",
+            'contents': [{'role': 'user', 'parts': [{'text': prompt}]}],
+            'ttl': f"{ttl_seconds}s"
+        })
+        if response.status_code != 200:
+            raise ModelBackendError(
+                f"Local backend could not create prompt cache: HTTP {response.status_code}", response.status_code
+            )
+        return response.json()['name']
+
+    def delete_prompt_cache(self, name: str) -> None:
+        self._client.delete(f"/v1beta/{name}")
+
+    def close(self) -> None:
+        self._client.close()
+
+    def _generate_url(self, model: str) -> str:
+        return f"/v1beta/models/{model}:generateContent"
+
+    def _parse_response(self, response: httpx.Response) -> types.GenerateContentResponse:
+        if response.status_code != 200:
+            raise ModelBackendError(
+                f"Local backend returned HTTP {response.status_code}: {response.text[:200]}", response.status_code
+            )
+        return types.GenerateContentResponse.model_validate_json(response.content)
+
+
+_backends: Dict[str, ModelBackend] = {}
+_backends_lock = threading.Lock()
+
+
+def get_gemini_backend(api_key: str) -> GeminiBackend:
+    """
+    Process-wide Gemini backend per API key.
+
+    Reusing the client keeps its connection pool, so later requests skip DNS and TLS setup.
+    """
+    key = f"gemini:{hashlib.sha256((api_key or '').encode('utf-8')).hexdigest()}"
+    with _backends_lock:
+        if key not in _backends:
+            _backends[key] = GeminiBackend(api_key)
+        return _backends[key]
+
+
+def get_local_backend(base_url: str) -> LocalHTTPBackend:
+    """Process-wide local backend per base URL, sharing one keep-alive HTTP client."""
+    key = f"local:{base_url.rstrip('/')}"
+    with _backends_lock:
+        if key not in _backends:
+            _backends[key] = LocalHTTPBackend(base_url)
+        return _backends[key]
+
+
+def build_rest_request(contents: List[Any], config: Optional[types.GenerateContentConfig]) -> Dict[str, Any]:
+    """
+    Convert SDK style ``contents`` and ``config`` into a Gemini REST request body.
+
+    Args:
+        contents (List[Any]): Strings, tuples of strings, PIL images or ``types.Part`` objects
+        config (types.GenerateContentConfig): Generation config
+
+    Returns:
+        Dict[str, Any]: JSON serialisable request body
+    """
+    parts = []
+    for item in contents:
+        items = item if isinstance(item, (tuple, list)) else (item,)
+        for value in items:
+            parts.append(_to_rest_part(value))
+
+    body = {'contents': [{'role': 'user', 'parts': parts}]}
+    if config is not None:
+        generation_config = config.model_dump(mode='json', by_alias=True, exclude_none=True)
+        # REST carries the cache reference next to the contents, not in generationConfig
+        cached_content = generation_config.pop('cachedContent', None)
+        if cached_content:
+            body['cachedContent'] = cached_content
+        body['generationConfig'] = generation_config
+    return body
+
+
+def _to_rest_part(value: Any) -> Dict[str, Any]:
+    if isinstance(value, str):
+        return {'text': value}
+    if isinstance(value, types.Part):
+        if value.inline_data is not None:
+            return _inline_part(value.inline_data.data, value.inline_data.mime_type)
+        return value.model_dump(mode='json', by_alias=True, exclude_none=True)
+    if isinstance(value, Image.Image):
+        buffer = BytesIO()
+        value.save(buffer, format='PNG')
+        return _inline_part(buffer.getvalue(), 'image/png')
+    raise ModelBackendError(f"Unsupported content type for local backend: {type(value).__name__}")
+
+
+def _inline_part(data: bytes, mime_type: str) -> Dict[str, Any]:
+    return {'inlineData': {'mimeType': mime_type, 'data': base64.b64encode(data).decode('ascii')}}
+
+
+@dataclass
+class RoutingRule:
+    """
+    Send requests whose prepared image is at most ``max_pixels`` to ``model_name``.
+
+    ``backend`` overrides the engine's default backend for matching requests.
+    """
+    model_name: str
+    max_pixels: Optional[int] = None
+    backend: Optional[ModelBackend] = None
+
+    def matches(self, image_size: Tuple[int, int]) -> bool:
+        if self.max_pixels is None:
+            return True
+        return image_size[0] * image_size[1] <= self.max_pixels
+
+
+class ModelRouter:
+    def __init__(self, default_backend: ModelBackend, default_model: str, rules: List[RoutingRule] = None):
+        self.default_backend = default_backend
+        self.default_model = default_model
+        self.rules = list(rules or [])
+
+    def route(self, image_size: Tuple[int, int]) -> Tuple[ModelBackend, str]:
+        """
+        Pick the backend and model for a request. The first matching rule wins.
+
+        Args:
+            image_size (Tuple[int, int]): Size of the prepared image sent to the model
+
+        Returns:
+            Tuple[ModelBackend, str]: Backend and model name to use
+        """
+        for rule in self.rules:
+            if rule.matches(image_size):
+                return rule.backend or self.default_backend, rule.model_name
+        return self.default_backend, self.default_model
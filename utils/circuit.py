@@ -0,0 +1,139 @@
+import time
+import threading
+from typing import Optional, Dict, Callable
+
+import httpx
+from google.genai import errors as genai_errors
+
+from utils.handler import logs
+from utils.metrics import CIRCUIT_STATE
+
+logger = logs()
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+def classify_failure(error: Exception) -> Optional[str]:
+    """
+    Map an API error to the failure class that should trip the breaker.
+
+    Returns ``'quota'``, ``'auth'`` or ``'unavailable'`` for errors that will keep failing for
+    every image, and ``None`` for per-request problems (bad input, blocked content, ...).
+    """
+    status_code = getattr(error, 'status_code', None)
+    if isinstance(error, genai_errors.APIError):
+        status_code = error.code
+
+    if status_code == 429:
+        return 'quota'
+    if status_code in (401, 403):
+        return 'auth'
+    if status_code is not None and status_code >= 500:
+        return 'unavailable'
+    if isinstance(error, (httpx.TransportError, ConnectionError, TimeoutError)):
+        return 'unavailable'
+    return None
+
+
+class CircuitBreaker:
+    """
+    Closed -> open after ``failure_threshold`` consecutive tripping failures; open -> half-open
+    after ``recovery_seconds``, letting ``half_open_max_calls`` probes through; a successful
+    probe closes the circuit and a failed one re-opens it.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, recovery_seconds: float = 30.0,
+                 half_open_max_calls: int = 1,
+                 classify: Callable[[Exception], Optional[str]] = classify_failure):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_seconds = recovery_seconds
+        self.half_open_max_calls = half_open_max_calls
+        self.classify = classify
+
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.last_failure_class: Optional[str] = None
+        self._opened_at = 0.0
+        self._half_open_calls = 0
+        self._lock = threading.Lock()
+        CIRCUIT_STATE.set(_STATE_VALUES[CLOSED], breaker=name)
+
+    @property
+    def is_open(self) -> bool:
+        """True while requests are being rejected (open and not yet due for a probe)."""
+        with self._lock:
+            return self.state == OPEN and self.retry_after > 0
+
+    @property
+    def retry_after(self) -> float:
+        """Seconds until the next half-open probe is allowed."""
+        return max(0.0, self._opened_at + self.recovery_seconds - time.monotonic())
+
+    def allow_request(self) -> bool:
+        with self._lock:
+            if self.state == OPEN:
+                if self.retry_after > 0:
+                    return False
+                self._set_state(HALF_OPEN)
+                self._half_open_calls = 0
+
+            if self.state == HALF_OPEN:
+                if self._half_open_calls >= self.half_open_max_calls:
+                    return False
+                self._half_open_calls += 1
+            return True
+
+    def cancel_request(self) -> None:
+        """Give back a request allowed by ``allow_request`` that was never sent."""
+        with self._lock:
+            if self.state == HALF_OPEN and self._half_open_calls > 0:
+                self._half_open_calls -= 1
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.consecutive_failures = 0
+            if self.state != CLOSED:
+                logger.info(f"Circuit {self.name} closed after successful probe")
+                self._set_state(CLOSED)
+
+    def record_failure(self, error: Exception) -> None:
+        failure_class = self.classify(error)
+        with self._lock:
+            if failure_class is None:
+                # The backend answered; a probe that got a per-request error still proves it is up
+                if self.state == HALF_OPEN:
+                    self._set_state(CLOSED)
+                return
+
+            self.consecutive_failures += 1
+            self.last_failure_class = failure_class
+            if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                logger.warning(
+                    f"Circuit {self.name} opened after {self.consecutive_failures} '{failure_class}' failure(s); "
+                    f"failing fast for {self.recovery_seconds:.0f}s"
+                )
+                self._opened_at = time.monotonic()
+                self._set_state(OPEN)
+
+    def _set_state(self, state: str) -> None:
+        self.state = state
+        CIRCUIT_STATE.set(_STATE_VALUES[state], breaker=self.name)
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(name: str, failure_threshold: int = 5, recovery_seconds: float = 30.0) -> CircuitBreaker:
+    """Process-wide breaker per backend, shared by every engine instance."""
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name, failure_threshold, recovery_seconds)
+        breaker = _breakers[name]
+        breaker.failure_threshold, breaker.recovery_seconds = failure_threshold, recovery_seconds
+        return breaker
@@ -0,0 +1,133 @@
+import threading
+import multiprocessing
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple, Dict
+
+import numpy as np
+from PIL import Image
+
+from utils.handler import logs
+from utils.image import ImageConfig, ImageProcessingError, ImageProcessor
+
+logger = logs()
+
+_PIXEL_MODES = ('RGB', 'RGBA', 'L')
+
+
+class CPUStagePool:
+    """
+    Run the CPU heavy image stages (decode/resize and PNG encode) in worker processes.
+
+    Only paths and small descriptors are pickled; pixel data crosses the process boundary
+    through ``multiprocessing.shared_memory`` blocks. The parent always unlinks them, and
+    spawned workers share its resource tracker so nothing is reported as leaked.
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        # spawn: forking a process that runs Streamlit and HTTP client threads is unsafe
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn')
+        )
+
+    def prepare_image(self, image_path: str, config: ImageConfig) -> Image.Image:
+        """
+        Decode, orient and resize an image in a worker process.
+
+        Args:
+            image_path (str): Path to the image file
+            config (ImageConfig): Image settings for the worker
+
+        Returns:
+            Image.Image: Prepared image, owned by the calling process
+
+        Raises:
+            ImageProcessingError: If image processing fails
+        """
+        name, shape, mode = self._executor.submit(_prepare_in_worker, image_path, config).result()
+        shm = shared_memory.SharedMemory(name=name)
+        try:
+            pixels = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+            image = Image.fromarray(pixels.copy(), mode)
+            del pixels
+        finally:
+            shm.close()
+            shm.unlink()
+        return image
+
+    def save_enhanced_image(self, image: Image.Image, output_path: str, config: ImageConfig) -> str:
+        """
+        Encode and save an image in a worker process.
+
+        Args:
+            image (Image.Image): PIL Image to save
+            output_path (str): Path where to save the image
+            config (ImageConfig): Image settings for the worker
+
+        Returns:
+            str: Path to saved image
+
+        Raises:
+            ImageProcessingError: If saving fails
+        """
+        if image.mode not in _PIXEL_MODES:
+            image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+        pixels = np.asarray(image)
+
+        shm = shared_memory.SharedMemory(create=True, size=max(pixels.nbytes, 1))
+        try:
+            np.ndarray(pixels.shape, dtype=np.uint8, buffer=shm.buf)[...] = pixels
+            return self._executor.submit(
+                _save_in_worker, shm.name, pixels.shape, image.mode, output_path, config
+            ).result()
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+_pools: Dict[int, CPUStagePool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_cpu_pool(workers: int) -> Optional[CPUStagePool]:
+    """Process-wide pool with the given worker count, or ``None`` to stay in-process."""
+    if workers <= 0:
+        return None
+    with _pools_lock:
+        if workers not in _pools:
+            logger.info(f"Starting CPU stage pool with {workers} worker process(es)")
+            _pools[workers] = CPUStagePool(workers)
+        return _pools[workers]
+
+
+def _prepare_in_worker(image_path: str, config: ImageConfig) -> Tuple[str, Tuple[int, ...], str]:
+    image = ImageProcessor(config).prepare_image(image_path)
+    pixels = np.asarray(image)
+
+    shm = shared_memory.SharedMemory(create=True, size=max(pixels.nbytes, 1))
+    try:
+        np.ndarray(pixels.shape, dtype=np.uint8, buffer=shm.buf)[...] = pixels
+    except Exception as e:
+        shm.close()
+        shm.unlink()
+        raise ImageProcessingError(f"Failed to share prepared image: {str(e)}")
+    shm.close()
+    return shm.name, pixels.shape, image.mode
+
+
+def _save_in_worker(name: str, shape: Tuple[int, ...], mode: str, output_path: str, config: ImageConfig) -> str:
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        pixels = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+        image = Image.fromarray(pixels, mode)
+        saved_path = ImageProcessor(config).save_enhanced_image(image, output_path)
+        del image, pixels
+        return saved_path
+    finally:
+        shm.close()
+
@@ -0,0 +1,171 @@
+"""
+Local stand-in for the Gemini REST API.
+
+Run with ``python -m utils.fake_backend --port 8089`` and point ``LocalHTTPBackend``
+at it. Every image sent in a request is returned with a slight warm tint, after an
+optional artificial latency, which is enough for load testing and offline development.
+Bad outputs (``blank``, ``unchanged``, ``aspect_ratio``, ``text_only``) can be queued with
+``FakeGeminiServer.inject`` to exercise the output quality check.
+"""
+import argparse
+import base64
+import json
+import threading
+import time
+import uuid
+from collections import deque
+from io import BytesIO
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Dict, Any, List
+
+from PIL import Image, ImageEnhance, ImageOps
+
+
+class FakeGeminiHandler(BaseHTTPRequestHandler):
+    server: "FakeGeminiServer"
+
+    def do_GET(self):
+        if self.path == '/health':
+            self._send_json(200, {'status': 'ok'})
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self.server.request_bytes += length
+        body = json.loads(self.rfile.read(length) or b'{}')
+
+        if self.path == '/v1beta/cachedContents':
+            name = f"cachedContents/{uuid.uuid4().hex[:12]}"
+            self.server.cached_contents[name] = body.get('contents', [])
+            self._send_json(200, {'name': name, 'model': body.get('model')})
+            return
+
+        if not self.path.endswith(':generateContent'):
+            self._send_json(404, {'error': 'not found'})
+            return
+
+        cached_content = body.get('cachedContent')
+        if cached_content and cached_content not in self.server.cached_contents:
+            self._send_json(404, {'error': f"unknown cached content {cached_content}"})
+            return
+
+        if self.server.latency_seconds:
+            time.sleep(self.server.latency_seconds)
+
+        self._send_json(200, self.server.build_response(body))
+
+    def do_DELETE(self):
+        name = self.path.removeprefix('/v1beta/')
+        self.server.cached_contents.pop(name, None)
+        self._send_json(200, {})
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, payload: Dict[str, Any]) -> None:
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class FakeGeminiServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 8089, latency_seconds: float = 0.0):
+        super().__init__((host, port), FakeGeminiHandler)
+        self.latency_seconds = latency_seconds
+        self.cached_contents: Dict[str, List[Dict[str, Any]]] = {}
+        self.request_bytes = 0
+        self.faults: deque = deque()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeGeminiServer":
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+    def inject(self, fault: str, count: int = 1) -> None:
+        """Make the next ``count`` generate calls return a bad output of the given kind."""
+        self.faults.extend([fault] * count)
+
+    def build_response(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        parts = [part for content in body.get('contents', []) for part in content.get('parts', [])]
+        config = body.get('generationConfig', {})
+        candidate_count = config.get('candidateCount', 1)
+
+        prompt_chars = sum(len(part.get('text', '')) for part in parts)
+        cached_chars = sum(
+            len(part.get('text', ''))
+            for content in self.cached_contents.get(body.get('cachedContent'), [])
+            for part in content.get('parts', [])
+        )
+        images = [part['inlineData'] for part in parts if 'inlineData' in part]
+        try:
+            fault = self.faults.popleft()
+        except IndexError:
+            fault = None
+        if fault == 'text_only':
+            images = []
+
+        candidates = []
+        for index in range(candidate_count):
+            out_parts: List[Dict[str, Any]] = [{'text': 'Enhanced image generated by the local fake backend.'}]
+            for inline in images:
+                out_parts.append({'inlineData': {'mimeType': 'image/png', 'data': _tint(inline['data'], index, fault)}})
+            candidates.append({'content': {'role': 'model', 'parts': out_parts}, 'index': index})
+
+        return {
+            'candidates': candidates,
+            'usageMetadata': {
+                'promptTokenCount': (prompt_chars + cached_chars) // 4 + 258 * len(images),
+                'cachedContentTokenCount': cached_chars // 4,
+                'candidatesTokenCount': 1290 * len(images) * candidate_count,
+                'totalTokenCount': (prompt_chars + cached_chars) // 4 + (258 + 1290 * candidate_count) * len(images),
+            },
+        }
+
+
+def _tint(data: str, variant: int, fault: Optional[str] = None) -> str:
+    with Image.open(BytesIO(base64.b64decode(data))) as img:
+        enhanced = img.convert('RGB')
+    if fault != 'unchanged':
+        enhanced = ImageEnhance.Color(enhanced).enhance(1.2 + 0.1 * variant)
+    if fault == 'blank':
+        enhanced = Image.new('RGB', enhanced.size, (128, 128, 128))
+    elif fault == 'aspect_ratio':
+        enhanced = ImageOps.fit(enhanced, (min(enhanced.size),) * 2)
+    buffer = BytesIO()
+    enhanced.save(buffer, format='PNG')
+    return base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the Gemini REST API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--latency', type=float, default=0.0, help="Artificial latency per request in seconds")
+    args = parser.parse_args()
+
+    server = FakeGeminiServer(args.host, args.port, args.latency)
+    print(f"Fake Gemini backend listening on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+Local stand-in for a Redis server, speaking just enough RESP for the result cache.
+
+Run with ``python -m utils.fake_redis --port 6390`` and set
+``PHOTOPRO_RESULT_CACHE=redis://127.0.0.1:6390/0`` on every replica. Supports ``PING``,
+``SELECT``, ``GET``, ``SET`` (with ``EX``/``PX``/``NX``/``XX``), ``DEL``, ``EXISTS`` and
+``FLUSHDB``; data lives in memory only.
+"""
+import argparse
+import threading
+import time
+from socketserver import StreamRequestHandler, ThreadingTCPServer
+from typing import Optional, Tuple, Dict
+
+from utils.result_cache import read_reply
+
+
+class FakeRedisHandler(StreamRequestHandler):
+    server: "FakeRedisServer"
+
+    def handle(self):
+        db = 0
+        while True:
+            try:
+                command = read_reply(self.rfile)
+            except (EOFError, ConnectionError):
+                return
+            if not isinstance(command, list) or not command:
+                self._send(b'-ERR protocol error\r\n')
+                continue
+
+            name = command[0].upper()
+            args = command[1:]
+            if name == b'SELECT':
+                db = int(args[0])
+                self._send(b'+OK\r\n')
+            else:
+                self._send(self.server.execute(db, name, args))
+
+    def _send(self, data: bytes) -> None:
+        self.wfile.write(data)
+        self.wfile.flush()
+
+
+class FakeRedisServer(ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 6390):
+        super().__init__((host, port), FakeRedisHandler)
+        self.databases: Dict[int, Dict[bytes, Tuple[bytes, Optional[float]]]] = {}
+        self.commands = 0
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"redis://{host}:{port}/0"
+
+    def start(self) -> "FakeRedisServer":
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+    def execute(self, db: int, name: bytes, args: list) -> bytes:
+        with self._lock:
+            self.commands += 1
+            data = self.databases.setdefault(db, {})
+
+            if name == b'PING':
+                return b'+PONG\r\n'
+            if name == b'GET':
+                value = self._get(data, args[0])
+                return b'$-1\r\n' if value is None else _bulk(value)
+            if name == b'SET':
+                return self._set(data, args)
+            if name == b'DEL':
+                removed = sum(1 for key in args if data.pop(key, None) is not None)
+                return b':%d\r\n' % removed
+            if name == b'EXISTS':
+                return b':%d\r\n' % sum(1 for key in args if self._get(data, key) is not None)
+            if name == b'FLUSHDB':
+                data.clear()
+                return b'+OK\r\n'
+            return b'-ERR unknown command\r\n'
+
+    def _get(self, data: Dict[bytes, Tuple[bytes, Optional[float]]], key: bytes) -> Optional[bytes]:
+        item = data.get(key)
+        if item is None:
+            return None
+        if item[1] is not None and item[1] < time.monotonic():
+            del data[key]
+            return None
+        return item[0]
+
+    def _set(self, data: Dict[bytes, Tuple[bytes, Optional[float]]], args: list) -> bytes:
+        key, value, options = args[0], args[1], [arg.upper() for arg in args[2:]]
+        expires_at = None
+        if b'EX' in options:
+            expires_at = time.monotonic() + int(args[2 + options.index(b'EX') + 1])
+        if b'PX' in options:
+            expires_at = time.monotonic() + int(args[2 + options.index(b'PX') + 1]) / 1000
+
+        exists = self._get(data, key) is not None
+        if (b'NX' in options and exists) or (b'XX' in options and not exists):
+            return b'$-1\r\n'
+        data[key] = (value, expires_at)
+        return b'+OK\r\n'
+
+
+def _bulk(value: bytes) -> bytes:
+    return b'$%d\r\n%s\r\n' % (len(value), value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for a Redis result cache")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=6390)
+    args = parser.parse_args()
+
+    server = FakeRedisServer(args.host, args.port)
+    print(f"Fake Redis listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,6 @@
+from utils.usage import UsageLabels, UsageLedger
+
+
 class ImageFilterManager:
     def __init__(self):
         self.filters_prompts = {
@@ -283,6 +286,16 @@ Corner Radius: Apply a corner radius of {corner_radius}px for rounded corners (0
             raise KeyError("Filter does not have parametrs")
         return self.filter_parameters[filter]
     
+    def usage_labels(self, prompt_type, configured_filters=None):
+        return UsageLabels(template=prompt_type, filters=tuple(sorted(configured_filters or {})))
+    
+    def get_filter_usage(self, ledger: UsageLedger):
+        # Token usage per filter next to its template length, to spot filters whose prompts cost the most
+        return {
+            filter_name: {**usage, 'template_chars': len(self.filters_prompts.get(filter_name, ''))}
+            for filter_name, usage in ledger.snapshot()['by_filter'].items()
+        }
+    
     def combine_filter_prompts(self, configured_filters):
         if not configured_filters:
             return ""
@@ -0,0 +1,138 @@
+import os
+import shutil
+import hashlib
+import tempfile
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+from PIL import Image
+
+from utils.handler import logs
+from utils.image import ImageConfig
+from utils.metrics import CACHE_LOOKUPS
+
+logger = logs()
+
+# Set on prepared images served or filled by the cache, so later stages can find their entry
+FRAME_KEY_INFO = 'photopro_frame_key'
+
+
+class PreparedFrameCache:
+    """
+    Per-session disk cache of prepared images, stored as raw RGB arrays and memory-mapped on read.
+
+    Entries are keyed by the upload's content hash and the ``ImageConfig`` fields that affect
+    preparation, so re-running the same upload with another prompt skips decode, orientation
+    and resize. Hits are copy-on-write maps of the file: no pixels are read until they are
+    used and nothing is written back. The encoded model payload of a prepared image is cached
+    next to it. Least recently used entries are dropped once ``max_bytes`` is exceeded.
+    """
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024, directory: str = None):
+        self.max_bytes = max_bytes
+        self.directory = directory or tempfile.mkdtemp(prefix="photopro_frames_")
+        os.makedirs(self.directory, exist_ok=True)
+        self.total_bytes = 0
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Temp directories go away with the session that owns the cache
+        self._finalizer = (weakref.finalize(self, shutil.rmtree, self.directory, True)
+                           if directory is None else None)
+
+    @staticmethod
+    def key_for_file(image_path: str, config: ImageConfig) -> str:
+        with open(image_path, 'rb') as file:
+            digest = hashlib.file_digest(file, 'sha256')
+        # Only settings that change the prepared pixels or whether the upload is accepted
+        digest.update(repr((
+            config.max_size, int(config.resampling_method), config.supported_formats,
+            config.max_file_size_mb, config.min_dimension, config.max_dimension
+        )).encode('utf-8'))
+        return digest.hexdigest()
+
+    def get_frame(self, key: str) -> Optional[Image.Image]:
+        path = self._touch(f"{key}.npy")
+        if path is None:
+            CACHE_LOOKUPS.inc(cache='prepared_frame', result='miss')
+            return None
+        try:
+            pixels = np.load(path, mmap_mode='c')
+        except OSError:
+            # Evicted by another thread between lookup and load
+            CACHE_LOOKUPS.inc(cache='prepared_frame', result='miss')
+            return None
+        height, width, _ = pixels.shape
+        image = Image.frombuffer('RGB', (width, height), pixels, 'raw', 'RGB', 0, 1)
+        image.info[FRAME_KEY_INFO] = key
+        CACHE_LOOKUPS.inc(cache='prepared_frame', result='hit')
+        return image
+
+    def put_frame(self, key: str, image: Image.Image) -> None:
+        """Store a prepared RGB image and tag it with its key; failures only cost the cache entry."""
+        if image.mode != 'RGB':
+            return
+        name = f"{key}.npy"
+        try:
+            # np.save appends .npy to names without it
+            temp_path = os.path.join(self.directory, f"{key}.{threading.get_ident()}.tmp.npy")
+            np.save(temp_path, np.asarray(image))
+            self._add(name, temp_path)
+            image.info[FRAME_KEY_INFO] = key
+        except Exception as e:
+            logger.warning(f"Failed to cache prepared frame: {str(e)}")
+
+    def get_payload(self, key: str, variant: str) -> Optional[bytes]:
+        """Encoded upload bytes for a cached frame; ``variant`` names the encoding settings."""
+        path = self._touch(f"{key}.{variant}.bin")
+        if path is not None:
+            try:
+                with open(path, 'rb') as file:
+                    data = file.read()
+                CACHE_LOOKUPS.inc(cache='upload_payload', result='hit')
+                return data
+            except OSError:
+                pass
+        CACHE_LOOKUPS.inc(cache='upload_payload', result='miss')
+        return None
+
+    def put_payload(self, key: str, variant: str, data: bytes) -> None:
+        name = f"{key}.{variant}.bin"
+        try:
+            temp_path = os.path.join(self.directory, f"{name}.{threading.get_ident()}.tmp")
+            with open(temp_path, 'wb') as file:
+                file.write(data)
+            self._add(name, temp_path)
+        except Exception as e:
+            logger.warning(f"Failed to cache upload payload: {str(e)}")
+
+    def close(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+        if self._finalizer is not None:
+            self._finalizer()
+
+    def _touch(self, name: str) -> Optional[str]:
+        with self._lock:
+            if name not in self._entries:
+                return None
+            self._entries.move_to_end(name)
+            return os.path.join(self.directory, name)
+
+    def _add(self, name: str, temp_path: str) -> None:
+        size = os.path.getsize(temp_path)
+        with self._lock:
+            os.replace(temp_path, os.path.join(self.directory, name))
+            self.total_bytes += size - self._entries.pop(name, 0)
+            self._entries[name] = size
+            while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+                evicted, evicted_size = self._entries.popitem(last=False)
+                self.total_bytes -= evicted_size
+                try:
+                    # Open maps keep their pages; the file is only unlinked
+                    os.remove(os.path.join(self.directory, evicted))
+                except OSError:
+                    pass
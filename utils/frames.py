@@ -0,0 +1,155 @@
+from dataclasses import dataclass
+from typing import Optional, Iterator, List
+
+import numpy as np
+from PIL import Image, ImageOps
+
+from utils.handler import logs
+from utils.image import ImageConfig, ImageProcessingError
+from utils.metrics import CACHE_LOOKUPS
+
+logger = logs()
+
+# Output format and MIME type per multi-frame input format
+FRAME_FORMATS = {'GIF': ('.gif', 'image/gif'), 'WEBP': ('.webp', 'image/webp'), 'TIFF': ('.tiff', 'image/tiff')}
+
+
+@dataclass
+class FrameConfig:
+    """Settings for enhancing multi-frame GIF, WebP and TIFF files."""
+    # Mean absolute difference (0-255) on a 64x64 grayscale thumbnail below which a frame
+    # counts as a repeat of the previous unique frame
+    dedup_threshold: float = 1.0
+    max_unique_frames: int = 48
+    workers: int = 4
+
+
+@dataclass
+class Frame:
+    index: int
+    image: Image.Image
+    duration_ms: Optional[int]
+    # Transparency of the source frame; None when it is fully opaque
+    alpha: Optional[Image.Image] = None
+
+
+@dataclass
+class FrameRun:
+    """Consecutive source frames that share one enhanced frame."""
+    unique_index: int
+    frame_count: int
+    duration_ms: Optional[int]
+
+
+def is_multi_frame(img: Image.Image) -> bool:
+    return getattr(img, 'is_animated', False) and img.format in FRAME_FORMATS
+
+
+def iter_frames(img: Image.Image, config: ImageConfig) -> Iterator[Frame]:
+    """
+    Decode frames one at a time, upright, in RGB and resized to ``config.max_size``.
+
+    Only the current frame is held in memory; GIF frames come out fully composited.
+    Transparent frames are flattened onto white, since converting a palette frame straight
+    to RGB paints its transparent pixels with whatever colour the palette holds there, and
+    their alpha is kept in ``Frame.alpha``.
+    """
+    for index in range(img.n_frames):
+        img.seek(index)
+        alpha = None
+        if img.mode in ('RGBA', 'LA', 'PA') or 'transparency' in img.info:
+            rgba = ImageOps.exif_transpose(img.convert('RGBA'))
+            rgba.thumbnail(config.max_size, config.resampling_method)
+            if rgba.getchannel('A').getextrema()[0] < 255:
+                alpha = rgba.getchannel('A')
+                frame = Image.alpha_composite(Image.new('RGBA', rgba.size, 'white'), rgba).convert('RGB')
+            else:
+                frame = rgba.convert('RGB')
+            rgba.close()
+        else:
+            frame = ImageOps.exif_transpose(img.convert('RGB'))
+            frame.thumbnail(config.max_size, config.resampling_method)
+        duration = img.info.get('duration')
+        yield Frame(index, frame, int(duration) if duration is not None else None, alpha)
+
+
+def restore_alpha(image: Image.Image, alpha: Optional[Image.Image]) -> Image.Image:
+    """Reapply a source frame's transparency to its enhanced counterpart."""
+    if alpha is None:
+        return image
+    rgba = image.convert('RGBA')
+    image.close()
+    rgba.putalpha(alpha if alpha.size == rgba.size else alpha.resize(rgba.size, Image.Resampling.LANCZOS))
+    return rgba
+
+
+class FrameDeduper:
+    """Collapse identical or near-identical consecutive frames into runs."""
+
+    def __init__(self, threshold: float):
+        self.threshold = threshold
+        self.runs: List[FrameRun] = []
+        self._signature: Optional[np.ndarray] = None
+
+    def add(self, frame: Frame) -> bool:
+        """
+        Record a frame; returns True if it starts a new run and needs enhancing.
+
+        Frames are compared with the first frame of the current run rather than their
+        predecessor, so a slow fade cannot drift through the threshold one frame at a time.
+        """
+        signature = np.asarray(frame.image.convert('L').resize((64, 64), Image.Resampling.BOX), dtype=np.float32)
+        if (self._signature is not None and signature.shape == self._signature.shape
+                and float(np.abs(signature - self._signature).mean()) < self.threshold):
+            run = self.runs[-1]
+            run.frame_count += 1
+            if frame.duration_ms is not None:
+                run.duration_ms = (run.duration_ms or 0) + frame.duration_ms
+            CACHE_LOOKUPS.inc(cache='frame_dedup', result='hit')
+            return False
+
+        CACHE_LOOKUPS.inc(cache='frame_dedup', result='miss')
+        self._signature = signature
+        self.runs.append(FrameRun(len(self.runs), 1, frame.duration_ms))
+        return True
+
+
+def save_frames(frames: List[Image.Image], runs: List[FrameRun], output_path: str, image_format: str,
+                loop: Optional[int] = None) -> str:
+    """
+    Reassemble enhanced frames with the source timing.
+
+    Animated formats get one frame per run with the run's combined duration; TIFF has no
+    timing, so each run is expanded back to one page per source frame. ``loop`` is only
+    written when the source had one; a GIF without it plays once.
+
+    Raises:
+        ImageProcessingError: If saving fails
+    """
+    try:
+        size = frames[0].size
+        frames = [frame if frame.size == size else frame.resize(size, Image.Resampling.LANCZOS) for frame in frames]
+        if any(frame.mode == 'RGBA' for frame in frames):
+            frames = [frame.convert('RGBA') for frame in frames]
+
+        if image_format == 'TIFF':
+            pages = [frames[run.unique_index] for run in runs for _ in range(run.frame_count)]
+            pages[0].save(output_path, format='TIFF', save_all=True, append_images=pages[1:], compression='tiff_deflate')
+            return output_path
+
+        sequence = [frames[run.unique_index] for run in runs]
+        durations = [run.duration_ms or 100 for run in runs]
+        save_kwargs = {'quality': 90, 'method': 4} if image_format == 'WEBP' else {'optimize': True}
+        if loop is not None:
+            save_kwargs['loop'] = loop
+        if image_format == 'GIF' and frames[0].mode == 'RGBA':
+            # Clear each frame before the next so transparent areas do not show the previous one
+            save_kwargs['disposal'] = 2
+        sequence[0].save(
+            output_path, format=image_format, save_all=True, append_images=sequence[1:],
+            duration=durations, **save_kwargs
+        )
+        return output_path
+
+    except Exception as e:
+        raise ImageProcessingError(f"Failed to save frames: {str(e)}")
@@ -1,17 +1,152 @@
+import os
+import json
+import queue
+import random
+import time
+import atexit
 import logging
+import threading
+import logging.handlers
+import contextvars
+from contextlib import contextmanager
+from typing import Optional, Dict, Iterator
 
-def logs(filename:str='photopro.log'):
-    # logging
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.FileHandler(filename),
-            logging.StreamHandler()
-        ]
-    )
+_STANDARD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+_session_id: contextvars.ContextVar = contextvars.ContextVar('photopro_session_id', default=None)
+_listener: Optional[logging.handlers.QueueListener] = None
+_configure_lock = threading.Lock()
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line; ``extra`` fields such as session_id or timings are kept as keys."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD_ATTRS and key != 'sample':
+                payload[key] = value
+        if record.exc_info:
+            payload['exception'] = self.formatException(record.exc_info)
+        return json.dumps(payload, default=str)
+
+
+class ContextFilter(logging.Filter):
+    """Attach the current enhancement session id to every record logged inside ``log_session``."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not hasattr(record, 'session_id'):
+            session_id = _session_id.get()
+            if session_id is not None:
+                record.session_id = session_id
+        return True
+
+
+@contextmanager
+def log_session(session_id: str) -> Iterator[None]:
+    """Tag records logged by this thread/task with ``session_id`` until the block exits."""
+    token = _session_id.set(session_id)
+    try:
+        yield
+    finally:
+        _session_id.reset(token)
+
+
+@contextmanager
+def stage_timer(timings: Dict[str, float], stage: str) -> Iterator[None]:
+    """Record the wall time of a block in milliseconds under ``timings[stage]``."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = round((time.perf_counter() - start) * 1000, 1)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keep only a fraction of high-volume records, per level.
+
+    Only records logged with ``extra={'sample': True}`` are sampled; everything else passes.
+    """
+
+    def __init__(self, rates: Dict[int, float]):
+        super().__init__()
+        self.rates = rates
 
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not getattr(record, 'sample', False):
+            return True
+        return random.random() < self.rates.get(record.levelno, 1.0)
+
+
+def parse_sample_rates(spec: str) -> Dict[int, float]:
+    """Parse ``"INFO=0.1,DEBUG=0.01"`` into ``{logging.INFO: 0.1, logging.DEBUG: 0.01}``."""
+    rates = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        level, _, rate = item.partition('=')
+        rates[logging.getLevelName(level.strip().upper())] = float(rate)
+    return rates
+
+
+def configure_logging(filename: str = 'photopro.log', level: str = None, max_bytes: int = None,
+                      backup_count: int = None, sample_rates: Dict[int, float] = None) -> None:
+    """
+    Install non-blocking logging for the process. Later calls are no-ops.
+
+    Records are put on an in-memory queue by the calling thread; a background listener writes
+    them as JSON lines to a rotating file and as plain text to stderr. Settings default to the
+    ``PHOTOPRO_LOG_*`` environment variables.
+
+    Args:
+        filename (str): Log file path, overridden by ``PHOTOPRO_LOG_FILE``
+        level (str, optional): Root level, ``PHOTOPRO_LOG_LEVEL`` (default INFO)
+        max_bytes (int, optional): Rotate after this size, ``PHOTOPRO_LOG_MAX_BYTES`` (default 10 MB)
+        backup_count (int, optional): Rotated files to keep, ``PHOTOPRO_LOG_BACKUPS`` (default 5)
+        sample_rates (Dict[int, float], optional): Per-level keep rate for sampled records,
+            ``PHOTOPRO_LOG_SAMPLE`` e.g. ``"INFO=0.1,DEBUG=0.01"``
+    """
+    global _listener
+
+    with _configure_lock:
+        if _listener is not None:
+            return
+
+        filename = os.environ.get('PHOTOPRO_LOG_FILE', filename)
+        level = level or os.environ.get('PHOTOPRO_LOG_LEVEL', 'INFO')
+        max_bytes = max_bytes or int(os.environ.get('PHOTOPRO_LOG_MAX_BYTES', 10 * 1024 * 1024))
+        backup_count = backup_count if backup_count is not None else int(os.environ.get('PHOTOPRO_LOG_BACKUPS', 5))
+        if sample_rates is None:
+            sample_rates = parse_sample_rates(os.environ.get('PHOTOPRO_LOG_SAMPLE', ''))
+
+        file_handler = logging.handlers.RotatingFileHandler(filename, maxBytes=max_bytes, backupCount=backup_count)
+        file_handler.setFormatter(JSONFormatter())
+        stream_handler = logging.StreamHandler()
+        stream_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+
+        log_queue: queue.Queue = queue.Queue(-1)
+        queue_handler = logging.handlers.QueueHandler(log_queue)
+        queue_handler.addFilter(SamplingFilter(sample_rates))
+        queue_handler.addFilter(ContextFilter())
+
+        root = logging.getLogger()
+        root.setLevel(level)
+        root.addHandler(queue_handler)
+
+        _listener = logging.handlers.QueueListener(log_queue, file_handler, stream_handler, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)
+
+
+def logs(filename: str = 'photopro.log'):
+    # logging
+    configure_logging(filename)
     return logging.getLogger(__name__)
 
+
 class PhotoProError(Exception):
-    pass
\ No newline at end of file
+    pass
@@ -0,0 +1,139 @@
+import asyncio
+import threading
+from collections import deque
+from typing import Optional, Tuple, Dict, Any, Awaitable, Callable
+
+import numpy as np
+
+from utils.handler import logs
+from utils.metrics import HEDGED_REQUESTS
+
+logger = logs()
+
+
+class LatencyTracker:
+    """Rolling window of call latencies used to derive the hedging delay."""
+
+    def __init__(self, window: int = 500):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, percentile: float, min_samples: int) -> Optional[float]:
+        with self._lock:
+            if len(self._samples) < min_samples:
+                return None
+            samples = np.fromiter(self._samples, dtype=np.float64)
+        return float(np.percentile(samples, percentile))
+
+
+class HedgePolicy:
+    """
+    Decide when to fire a duplicate request and keep hedges within a budget.
+
+    A hedge is sent once an attempt has been running for longer than the observed
+    ``percentile`` latency, and only while hedges stay below ``budget_fraction`` of all calls.
+    """
+
+    def __init__(self, percentile: float = 95.0, budget_fraction: float = 0.05, min_samples: int = 20):
+        self.percentile = percentile
+        self.budget_fraction = budget_fraction
+        self.min_samples = min_samples
+        self.latency = LatencyTracker()
+        self.calls = 0
+        self.hedges = 0
+        self._lock = threading.Lock()
+
+    def start_call(self) -> Optional[float]:
+        """Count a call and return the hedge delay in seconds, or ``None`` to not hedge yet."""
+        with self._lock:
+            self.calls += 1
+        return self.latency.percentile(self.percentile, self.min_samples)
+
+    def try_hedge(self) -> bool:
+        with self._lock:
+            if self.hedges + 1 > self.budget_fraction * self.calls:
+                return False
+            self.hedges += 1
+            return True
+
+
+_policies: Dict[Tuple[str, str], HedgePolicy] = {}
+_policies_lock = threading.Lock()
+
+
+def get_hedge_policy(backend_name: str, model_name: str, percentile: float, budget_fraction: float,
+                     min_samples: int) -> HedgePolicy:
+    """Process-wide policy per backend/model, so latency history survives short-lived engines."""
+    with _policies_lock:
+        key = (backend_name, model_name)
+        if key not in _policies:
+            _policies[key] = HedgePolicy(percentile, budget_fraction, min_samples)
+        policy = _policies[key]
+        policy.percentile, policy.budget_fraction, policy.min_samples = percentile, budget_fraction, min_samples
+        return policy
+
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+
+
+def run_async(coroutine: Awaitable[Any]) -> Any:
+    """
+    Run a coroutine on the shared background event loop and wait for its result.
+
+    One long-lived loop keeps async SDK clients bound to a single loop and lets any thread,
+    including Streamlit script threads and pipeline workers, use them.
+    """
+    global _loop
+
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="photopro-async", daemon=True).start()
+    return asyncio.run_coroutine_threadsafe(coroutine, _loop).result()
+
+
+async def hedged_call(call: Callable[[], Awaitable[Any]], delay: float, policy: HedgePolicy,
+                      before_hedge: Optional[Callable[[], bool]] = None) -> Any:
+    """
+    Await ``call()``; if it is still running after ``delay`` seconds and the budget allows,
+    start a second ``call()``, return whichever succeeds first and cancel the other.
+
+    Cancelling only stops waiting: the losing request was already sent and is still billed.
+
+    Args:
+        call (Callable): Factory returning a fresh request coroutine
+        delay (float): Seconds to wait before hedging
+        policy (HedgePolicy): Policy holding the hedge budget
+        before_hedge (Callable, optional): Called before a hedge is sent, e.g. to reserve its
+            cost; returning False skips the hedge
+
+    Returns:
+        The first successful response
+    """
+    primary = asyncio.ensure_future(call())
+    done, _ = await asyncio.wait({primary}, timeout=delay)
+    if done or not policy.try_hedge() or (before_hedge is not None and not before_hedge()):
+        return await primary
+
+    logger.info(f"Attempt still running after {delay:.2f}s, sending hedged request", extra={'sample': True})
+    hedge = asyncio.ensure_future(call())
+    pending = {primary, hedge}
+    error = None
+
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    HEDGED_REQUESTS.inc(winner='hedge' if task is hedge else 'primary')
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
@@ -1,10 +1,11 @@
 import os
 import uuid
+import hashlib
 import logging
 from io import BytesIO
 from pathlib import Path
 from typing import Optional, Tuple, Dict, Any, List
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
 from datetime import datetime
 
 import numpy as np
@@ -13,6 +14,8 @@ from google import genai
 from google.genai import types
 
 from utils.handler import PhotoProError, logs
+from utils.metrics import CACHE_LOOKUPS
+from utils.results import EnhancementResult
 
 logger = logs()
 
@@ -23,9 +26,16 @@ class ImageProcessingError(PhotoProError):
 class ImageConfig:
     max_size: Tuple[int, int] = (1024, 1024)
     resampling_method: Image.Resampling = Image.Resampling.LANCZOS
-    supported_formats: Tuple[str, ...] = ('JPEG', 'PNG', 'WEBP', 'TIFF', 'BMP')
+    supported_formats: Tuple[str, ...] = ('JPEG', 'PNG', 'WEBP', 'TIFF', 'BMP', 'GIF')
     max_file_size_mb: int = 20
+    min_dimension: int = 16
+    max_dimension: int = 12000
     quality: int = 95
+    # Encoding of the prepared image sent to the model (not the saved output)
+    upload_format: str = 'JPEG'
+    upload_quality: int = 90
+    # Worker processes for decode/resize and encode (0 = in-process)
+    cpu_workers: int = 0
 
 
 class ImageValidator:
@@ -62,11 +72,7 @@ class ImageValidator:
         # Validate image format
         try:
             with Image.open(image_path) as img:
-                if img.format not in self.config.supported_formats:
-                    raise ImageProcessingError(
-                        f"Unsupported image format: {img.format}. "
-                        f"Supported formats: {', '.join(self.config.supported_formats)}"
-                    )
+                self._check_header(img)
                 
                 # Check if image can be loaded
                 img.verify()
@@ -77,6 +83,125 @@ class ImageValidator:
             raise ImageProcessingError(f"Invalid image file: {str(e)}")
         
         return True
+    
+    def validate_image_bytes(self, data: bytes) -> Tuple[str, Tuple[int, int], bool]:
+        """
+        Header-only validation of an in-memory image, without decoding pixels.
+        
+        Args:
+            data (bytes): Raw file contents
+            
+        Returns:
+            Tuple[str, Tuple[int, int], bool]: Image format, size and whether it has several frames
+            
+        Raises:
+            ImageProcessingError: If image is invalid
+        """
+        file_size_mb = len(data) / (1024 * 1024)
+        if file_size_mb > self.config.max_file_size_mb:
+            raise ImageProcessingError(
+                f"Image file too large: {file_size_mb:.2f}MB > {self.config.max_file_size_mb}MB"
+            )
+        
+        try:
+            with Image.open(BytesIO(data)) as img:
+                self._check_header(img)
+                return img.format, img.size, getattr(img, 'is_animated', False)
+                
+        except Exception as e:
+            if isinstance(e, ImageProcessingError):
+                raise
+            raise ImageProcessingError(f"Invalid image file: {str(e)}")
+    
+    def _check_header(self, img: Image.Image) -> None:
+        if img.format not in self.config.supported_formats:
+            raise ImageProcessingError(
+                f"Unsupported image format: {img.format}. "
+                f"Supported formats: {', '.join(self.config.supported_formats)}"
+            )
+        
+        width, height = img.size
+        if min(width, height) < self.config.min_dimension:
+            raise ImageProcessingError(
+                f"Image too small: {width}x{height} (minimum side {self.config.min_dimension}px)"
+            )
+        if max(width, height) > self.config.max_dimension:
+            raise ImageProcessingError(
+                f"Image too large: {width}x{height} (maximum side {self.config.max_dimension}px)"
+            )
+
+
+@dataclass
+class PreflightEntry:
+    """A unique upload in a batch and every filename that carried the same bytes."""
+    digest: str
+    filename: str
+    index: int
+    format: str
+    size: Tuple[int, int]
+    duplicates: List[str]
+    multi_frame: bool = False
+    
+    @property
+    def filenames(self) -> List[str]:
+        return [self.filename] + self.duplicates
+
+
+@dataclass
+class PreflightReport:
+    unique: List[PreflightEntry]
+    # (filename, reason) in upload order; names are not unique across uploads
+    rejected: List[Tuple[str, str]]
+    
+    @property
+    def duplicate_count(self) -> int:
+        return sum(len(entry.duplicates) for entry in self.unique)
+    
+    def fan_out(self, entry: PreflightEntry, result: EnhancementResult) -> List[EnhancementResult]:
+        """Copy the result of a unique upload to every filename that shared its bytes."""
+        return [replace(result, original_filename=filename) for filename in entry.filenames]
+
+
+class BatchPreflight:
+    def __init__(self, config: ImageConfig):
+        self.validator = ImageValidator(config)
+    
+    def run(self, files: List[Tuple[str, bytes]]) -> PreflightReport:
+        """
+        Hash and header-check a batch of uploads before any API work starts.
+        
+        Args:
+            files (List[Tuple[str, bytes]]): (filename, contents) pairs in upload order
+            
+        Returns:
+            PreflightReport: Unique uploads with their duplicates, and rejected files with reasons
+        """
+        unique: Dict[str, PreflightEntry] = {}
+        rejected: List[Tuple[str, str]] = []
+        
+        for index, (filename, data) in enumerate(files):
+            digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+            
+            if digest in unique:
+                unique[digest].duplicates.append(filename)
+                CACHE_LOOKUPS.inc(cache='upload_dedup', result='hit')
+                continue
+            CACHE_LOOKUPS.inc(cache='upload_dedup', result='miss')
+            
+            try:
+                image_format, size, multi_frame = self.validator.validate_image_bytes(data)
+            except ImageProcessingError as e:
+                rejected.append((filename, str(e)))
+                continue
+            
+            unique[digest] = PreflightEntry(digest, filename, index, image_format, size, [], multi_frame)
+        
+        report = PreflightReport(list(unique.values()), rejected)
+        logger.info(
+            f"Preflight: {len(files)} file(s), {len(report.unique)} unique, "
+            f"{report.duplicate_count} duplicate(s), {len(rejected)} rejected"
+        )
+        return report
 
 
 
@@ -111,14 +236,14 @@ class ImageProcessor:
                 # Resize image
                 if img.size[0] > self.config.max_size[0] or img.size[1] > self.config.max_size[1]:
                     img.thumbnail(self.config.max_size, self.config.resampling_method)
-                    logger.info(f"Resized image to {img.size}")
+                    logger.debug(f"Resized image to {img.size}", extra={'sample': True})
                 
                 # Apply auto-orientation based on EXIF data
                 img = ImageOps.exif_transpose(img)
                 
                 processed_img = img.copy()
                 
-            logger.info(f"Successfully prepared image: {image_path}")
+            logger.debug(f"Successfully prepared image: {image_path}", extra={'sample': True})
             return processed_img
             
         except Exception as e:
@@ -126,6 +251,124 @@ class ImageProcessor:
                 raise
             raise ImageProcessingError(f"Failed to prepare image: {str(e)}")
     
+    def load_original(self, image_path: str) -> Image.Image:
+        """
+        Load an image at full resolution, upright and in RGB, for local compositing.
+
+        Args:
+            image_path (str): Path to the image file
+
+        Returns:
+            Image.Image: Full-resolution PIL Image
+
+        Raises:
+            ImageProcessingError: If the image cannot be loaded
+        """
+        try:
+            self.validator.validate_image_file(image_path)
+
+            with Image.open(image_path) as img:
+                img = ImageOps.exif_transpose(img)
+                if img.mode != 'RGB':
+                    img = img.convert('RGB')
+                return img.copy()
+
+        except Exception as e:
+            if isinstance(e, ImageProcessingError):
+                raise
+            raise ImageProcessingError(f"Failed to load image: {str(e)}")
+
+    def region_crop_box(self, box: Tuple[int, int, int, int], image_size: Tuple[int, int],
+                        margin: float = 0.25) -> Tuple[int, int, int, int]:
+        """
+        Grow a region by a margin on every side, clamped to the image bounds.
+
+        Args:
+            box (Tuple[int, int, int, int]): Region as (left, top, right, bottom) pixels
+            image_size (Tuple[int, int]): Size of the full image
+            margin (float): Margin as a fraction of the region's larger side
+
+        Returns:
+            Tuple[int, int, int, int]: Crop box sent to the model
+
+        Raises:
+            ImageProcessingError: If the region is empty or outside the image
+        """
+        width, height = image_size
+        left, top, right, bottom = max(0, box[0]), max(0, box[1]), min(width, box[2]), min(height, box[3])
+        if right - left < self.config.min_dimension or bottom - top < self.config.min_dimension:
+            raise ImageProcessingError(
+                f"Region {box} is smaller than {self.config.min_dimension}px or outside the {width}x{height} image"
+            )
+
+        pad = int(round(max(right - left, bottom - top) * margin))
+        return max(0, left - pad), max(0, top - pad), min(width, right + pad), min(height, bottom + pad)
+
+    def composite_region(self, original: Image.Image, edited: Image.Image, crop_box: Tuple[int, int, int, int],
+                         box: Tuple[int, int, int, int]) -> Image.Image:
+        """
+        Blend an edited crop back into the full-resolution original.
+
+        The edit is fully applied inside ``box`` and fades out linearly across the margin
+        between ``box`` and ``crop_box``; sides where the crop touches the image border are
+        not feathered. Pixels outside ``crop_box`` are left untouched.
+
+        Args:
+            original (Image.Image): Full-resolution original, modified in place
+            edited (Image.Image): Model output for the crop
+            crop_box (Tuple[int, int, int, int]): Where the crop was taken from
+            box (Tuple[int, int, int, int]): The region the user selected
+
+        Returns:
+            Image.Image: The composited original
+        """
+        crop_width, crop_height = crop_box[2] - crop_box[0], crop_box[3] - crop_box[1]
+        if edited.size != (crop_width, crop_height):
+            edited = edited.resize((crop_width, crop_height), self.config.resampling_method)
+        if edited.mode != original.mode:
+            edited = edited.convert(original.mode)
+
+        def ramp(length: int, start_margin: int, end_margin: int) -> np.ndarray:
+            position = np.arange(length, dtype=np.float32) + 0.5
+            start = np.clip(position / start_margin, 0, 1) if start_margin > 0 else np.ones(length, np.float32)
+            end = np.clip((length - position) / end_margin, 0, 1) if end_margin > 0 else np.ones(length, np.float32)
+            return np.minimum(start, end)
+
+        ramp_x = ramp(crop_width, max(0, box[0] - crop_box[0]), max(0, crop_box[2] - box[2]))
+        ramp_y = ramp(crop_height, max(0, box[1] - crop_box[1]), max(0, crop_box[3] - box[3]))
+        mask = Image.fromarray((np.minimum(ramp_y[:, None], ramp_x[None, :]) * 255).astype(np.uint8), 'L')
+
+        original.paste(edited, crop_box[:2], mask)
+        return original
+
+    def encode_for_upload(self, image: Image.Image) -> Tuple[bytes, str]:
+        """
+        Encode a prepared image once into the payload sent to the model.
+        
+        Args:
+            image (Image.Image): Prepared PIL Image
+            
+        Returns:
+            Tuple[bytes, str]: Encoded bytes and their MIME type
+            
+        Raises:
+            ImageProcessingError: If encoding fails
+        """
+        upload_format = self.config.upload_format.upper()
+        save_kwargs = {}
+        if upload_format in ('JPEG', 'WEBP'):
+            save_kwargs['quality'] = self.config.upload_quality
+        if upload_format == 'JPEG':
+            save_kwargs['optimize'] = True
+        
+        try:
+            buffer = BytesIO()
+            image.save(buffer, format=upload_format, **save_kwargs)
+            return buffer.getvalue(), Image.MIME[upload_format]
+            
+        except Exception as e:
+            raise ImageProcessingError(f"Failed to encode image for upload: {str(e)}")
+    
     def save_enhanced_image(self, image: Image.Image, output_path: str) -> str:
         """
         Save enhanced image with optimized settings.
@@ -155,7 +398,7 @@ class ImageProcessor:
                 save_kwargs['method'] = 6
             
             image.save(output_path, **save_kwargs)
-            logger.info(f"Saved enhanced image to: {output_path}")
+            logger.debug(f"Saved enhanced image to: {output_path}", extra={'sample': True})
             
             return output_path
             
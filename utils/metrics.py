@@ -0,0 +1,226 @@
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Tuple, Dict, List
+
+from utils.handler import logs
+
+logger = logs()
+
+LabelValues = Tuple[str, ...]
+
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _format_labels(self, values: LabelValues, extra: Dict[str, str] = None) -> str:
+        pairs = list(zip(self.labelnames, values)) + list((extra or {}).items())
+        if not pairs:
+            return ''
+        escaped = (f'{name}="{_escape(value)}"' for name, value in pairs)
+        return '{' + ','.join(escaped) + '}'
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            lines.extend(self._samples())
+        return lines
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> List[str]:
+        return [f"{self.name}{self._format_labels(key)} {value}" for key, value in self._values.items()]
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def dec(self, amount: float = 1.0, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._counts: Dict[LabelValues, List[int]] = {}
+        self._sums: Dict[LabelValues, float] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts = self._counts.setdefault(key, [0] * (len(self.buckets) + 1))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._sums[key] = self._sums.get(key, 0.0) + value
+
+    def _samples(self) -> List[str]:
+        lines = []
+        for key, counts in self._counts.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f"{self.name}_bucket{self._format_labels(key, {'le': le})} {cumulative}")
+            lines.append(f"{self.name}_sum{self._format_labels(key)} {self._sums[key]}")
+            lines.append(f"{self.name}_count{self._format_labels(key)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """Render every metric in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+REGISTRY = MetricsRegistry()
+
+ENHANCE_REQUESTS = REGISTRY.counter(
+    'photopro_enhance_requests_total', 'Images submitted for enhancement', ('mode',))
+ENHANCE_SUCCESSES = REGISTRY.counter(
+    'photopro_enhance_successes_total', 'Images enhanced successfully', ('mode',))
+ENHANCE_FAILURES = REGISTRY.counter(
+    'photopro_enhance_failures_total', 'Failed enhancements by error class', ('mode', 'error_class'))
+API_CALLS = REGISTRY.counter(
+    'photopro_api_calls_total', 'Model API attempts by outcome', ('backend', 'model', 'outcome'))
+API_RETRIES = REGISTRY.counter(
+    'photopro_api_retries_total', 'Model API retry attempts', ('backend', 'model'))
+HEDGED_REQUESTS = REGISTRY.counter(
+    'photopro_hedged_requests_total', 'Hedged model calls by which request won', ('winner',))
+STAGE_LATENCY = REGISTRY.histogram(
+    'photopro_stage_latency_seconds', 'Latency of enhancement stages', ('stage',))
+BYTES_UPLOADED = REGISTRY.counter(
+    'photopro_bytes_uploaded_total', 'Request payload bytes sent to the model, retries included')
+BYTES_DOWNLOADED = REGISTRY.counter(
+    'photopro_bytes_downloaded_total', 'Image bytes received from the model')
+CACHE_LOOKUPS = REGISTRY.counter(
+    'photopro_cache_lookups_total', 'Cache lookups by cache and result (hit/miss)', ('cache', 'result'))
+QUEUE_DEPTH = REGISTRY.gauge(
+    'photopro_queue_depth', 'Jobs waiting in each batch pipeline queue', ('stage',))
+CIRCUIT_STATE = REGISTRY.gauge(
+    'photopro_circuit_state', 'Backend circuit breaker state (0 closed, 1 half-open, 2 open)', ('breaker',))
+TOKENS_USED = REGISTRY.counter(
+    'photopro_tokens_total', 'Model tokens reported in response usage metadata', ('kind',))
+SCHEDULER_WAIT = REGISTRY.histogram(
+    'photopro_scheduler_wait_seconds', 'Time model calls wait for a scheduler slot', ('lane',))
+QUALITY_CHECKS = REGISTRY.counter(
+    'photopro_quality_checks_total', 'Output quality checks by issue (ok when none)', ('issue',))
+QUALITY_RETRIES = REGISTRY.counter(
+    'photopro_quality_retries_total', 'Model calls repeated because the output failed the quality check')
+PROFILES_WRITTEN = REGISTRY.counter(
+    'photopro_profiles_written_total', 'Sampled profiling reports written, by profiled function', ('target',))
+MEMORY_BUDGET_IN_USE = REGISTRY.gauge(
+    'photopro_memory_budget_bytes', 'Bytes reserved by in-flight batch jobs')
+
+
+def observe_stage_timings(timings_ms: Dict[str, float]) -> None:
+    """Feed a ``stage_timer`` dict (milliseconds) into the stage latency histogram."""
+    for stage, milliseconds in timings_ms.items():
+        STAGE_LATENCY.observe(milliseconds / 1000, stage=stage)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server: Optional[ThreadingHTTPServer] = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(port: int, host: str = '127.0.0.1') -> ThreadingHTTPServer:
+    """
+    Serve ``/metrics`` for scraping. Only the first call per process starts a server.
+
+    Args:
+        port (int): Port to listen on
+        host (str): Interface to bind, local only by default
+
+    Returns:
+        ThreadingHTTPServer: The running server
+    """
+    global _server
+
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, daemon=True).start()
+            logger.info(f"Metrics endpoint listening on http://{host}:{port}/metrics")
+        return _server
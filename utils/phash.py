@@ -0,0 +1,177 @@
+import os
+import uuid
+import shutil
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field, replace
+from typing import Optional, Tuple, Dict, List
+
+import numpy as np
+from PIL import Image
+
+from utils.handler import logs
+from utils.metrics import CACHE_LOOKUPS
+from utils.results import EnhancedImage, EnhancementResult
+
+logger = logs()
+
+HASH_BITS = 64
+
+
+def dhash(image: Image.Image, hash_size: int = 8) -> int:
+    """
+    64-bit difference hash: signs of horizontal gradients on a 9x8 grayscale thumbnail.
+
+    Re-saved, re-compressed or resized copies of a photo land within a few bits of each other.
+    """
+    small = image.convert('L').resize((hash_size + 1, hash_size), Image.Resampling.BOX)
+    pixels = np.asarray(small, dtype=np.int16)
+    bits = np.packbits(pixels[:, 1:] > pixels[:, :-1])
+    return int.from_bytes(bits.tobytes(), 'big')
+
+
+@dataclass
+class ReuseEntry:
+    """A prior result, with its images copied into the index store."""
+    entry_id: int
+    image_hash: int
+    key: str
+    session_id: str
+    text_responses: List[str] = field(default_factory=list)
+    enhanced_images: List[EnhancedImage] = field(default_factory=list)
+
+
+class PerceptualIndex:
+    """
+    Near-duplicate index of prior results keyed by dHash and prompt.
+
+    Lookups use multi-index hashing: the 64-bit hash is split into ``max_distance + 1`` bands,
+    and any hash within ``max_distance`` bits must match at least one band exactly. Each lookup
+    only compares against entries sharing a band, which stays well under a millisecond with
+    hundreds of thousands of entries. The least recently used entries are evicted past
+    ``max_entries`` and their stored images deleted.
+    """
+
+    def __init__(self, store_dir: str, max_distance: int = 4, max_entries: int = 200_000):
+        self.store_dir = store_dir
+        self.max_distance = max_distance
+        self.max_entries = max_entries
+        self._bands = self._band_layout(max_distance + 1)
+        self._entries: "OrderedDict[int, ReuseEntry]" = OrderedDict()
+        self._tables: List[Dict[Tuple[str, int], List[int]]] = [{} for _ in self._bands]
+        self._next_id = 0
+        self._lock = threading.Lock()
+        os.makedirs(store_dir, exist_ok=True)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def lookup(self, image_hash: int, key: str) -> Optional[Tuple[ReuseEntry, int]]:
+        """
+        Find the closest prior result for the same key within ``max_distance`` bits.
+
+        Returns:
+            Optional[Tuple[ReuseEntry, int]]: The entry and its Hamming distance, or None
+        """
+        best, best_distance = None, self.max_distance + 1
+        with self._lock:
+            for table, band in zip(self._tables, self._bands):
+                for entry_id in table.get((key, self._band_value(image_hash, band)), ()):
+                    distance = (self._entries[entry_id].image_hash ^ image_hash).bit_count()
+                    if distance < best_distance:
+                        best, best_distance = entry_id, distance
+            if best is not None:
+                self._entries.move_to_end(best)
+                CACHE_LOOKUPS.inc(cache='near_duplicate', result='hit')
+                return self._entries[best], best_distance
+
+        CACHE_LOOKUPS.inc(cache='near_duplicate', result='miss')
+        return None
+
+    def add(self, image_hash: int, key: str, session_id: str, result: EnhancementResult) -> None:
+        """Copy a successful result's images into the store and index them."""
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+
+        stored_images = []
+        for image_info in result.enhanced_images:
+            # The store directory is shared by every process on the host, so names must be unique
+            # across them; an index only ever deletes files it stored itself
+            stored_path = os.path.join(self.store_dir, f"{uuid.uuid4().hex}{os.path.splitext(image_info.path)[1]}")
+            try:
+                shutil.copyfile(image_info.path, stored_path)
+            except OSError as e:
+                logger.warning(f"Could not store result for near-duplicate reuse: {str(e)}")
+                for stored in stored_images + [replace(image_info, path=stored_path)]:
+                    try:
+                        os.remove(stored.path)
+                    except OSError:
+                        pass
+                return
+            stored_images.append(replace(image_info, path=stored_path))
+
+        entry = ReuseEntry(entry_id, image_hash, key, session_id, list(result.text_responses), stored_images)
+        with self._lock:
+            self._entries[entry_id] = entry
+            for table, band in zip(self._tables, self._bands):
+                table.setdefault((key, self._band_value(image_hash, band)), []).append(entry_id)
+            while len(self._entries) > self.max_entries:
+                self._evict(next(iter(self._entries)))
+
+    def discard(self, entry: ReuseEntry) -> None:
+        """Drop an entry whose stored images can no longer be used."""
+        with self._lock:
+            if entry.entry_id in self._entries:
+                self._evict(entry.entry_id)
+
+    def _evict(self, entry_id: int) -> None:
+        entry = self._entries.pop(entry_id)
+        for table, band in zip(self._tables, self._bands):
+            bucket_key = (entry.key, self._band_value(entry.image_hash, band))
+            bucket = table[bucket_key]
+            bucket.remove(entry_id)
+            if not bucket:
+                del table[bucket_key]
+        for image_info in entry.enhanced_images:
+            try:
+                os.remove(image_info.path)
+            except OSError:
+                pass
+
+    @staticmethod
+    def _band_layout(count: int) -> List[Tuple[int, int]]:
+        """(shift, mask) for ``count`` nearly equal bit bands covering the hash."""
+        bands, start = [], 0
+        for i in range(count):
+            width = HASH_BITS // count + (1 if i < HASH_BITS % count else 0)
+            bands.append((start, (1 << width) - 1))
+            start += width
+        return bands
+
+    @staticmethod
+    def _band_value(image_hash: int, band: Tuple[int, int]) -> int:
+        shift, mask = band
+        return (image_hash >> shift) & mask
+
+
+def reuse_key(prompt: str, model_name: str) -> str:
+    """Results are only reused for the same prompt and model."""
+    return hashlib.blake2b(f"{model_name}\n{prompt}".encode('utf-8'), digest_size=16).hexdigest()
+
+
+_index: Optional[PerceptualIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_reuse_index(max_distance: int = 4) -> PerceptualIndex:
+    """Process-wide index; stored images live in ``PHOTOPRO_REUSE_DIR`` (a temp dir by default)."""
+    global _index
+
+    with _index_lock:
+        if _index is None:
+            store_dir = os.environ.get("PHOTOPRO_REUSE_DIR") or os.path.join(tempfile.gettempdir(), "photopro_reuse")
+            _index = PerceptualIndex(store_dir, max_distance)
+        return _index
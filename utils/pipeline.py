@@ -0,0 +1,272 @@
+import queue
+import threading
+from dataclasses import dataclass, field
+from typing import Optional, Dict, Any, List, Callable, Iterable, Iterator
+
+from utils.handler import logs
+from utils.metrics import MEMORY_BUDGET_IN_USE, QUEUE_DEPTH
+from utils.results import EnhancementResult
+
+logger = logs()
+
+_DONE = object()
+# How often threads blocked on a queue check whether the consumer went away
+_POLL_SECONDS = 0.1
+
+
+@dataclass
+class PipelineConfig:
+    """Bounded streaming settings for batch processing."""
+    queue_depth: int = 4
+    prepare_workers: int = 1
+    call_workers: int = 2
+    save_workers: int = 1
+    memory_budget_mb: int = 512
+
+
+@dataclass
+class BatchItem:
+    """One upload fed into the pipeline; ``read`` is only called when the item enters the read stage."""
+    key: Any
+    name: str
+    read: Callable[[], bytes]
+
+
+@dataclass
+class PipelineJob:
+    item: BatchItem
+    index: int
+    state: Dict[str, Any] = field(default_factory=dict)
+    result: Optional[EnhancementResult] = None
+    error: Optional[Exception] = None
+    reserved_bytes: int = 0
+    timings: Dict[str, float] = field(default_factory=dict)
+
+
+class _GaugedQueue(queue.Queue):
+    """Bounded queue that reports its depth to the ``photopro_queue_depth`` gauge."""
+    
+    def __init__(self, stage: str, maxsize: int):
+        super().__init__(maxsize=maxsize)
+        self.stage = stage
+    
+    def _put(self, item):
+        super()._put(item)
+        QUEUE_DEPTH.set(len(self.queue), stage=self.stage)
+    
+    def _get(self):
+        item = super()._get()
+        QUEUE_DEPTH.set(len(self.queue), stage=self.stage)
+        return item
+
+
+class MemoryBudget:
+    """
+    Byte budget shared by every in-flight job.
+
+    ``acquire`` blocks until enough budget is free, which is what pushes back on the
+    read stage. A single job larger than the whole budget is still admitted when nothing
+    else is in flight, so an oversized image cannot deadlock the pipeline. After ``close``
+    nothing waits any more, so stopped pipelines can wind down.
+    """
+
+    def __init__(self, limit_bytes: int):
+        self.limit_bytes = limit_bytes
+        self.in_use = 0
+        self._closed = False
+        self._condition = threading.Condition()
+
+    def acquire(self, nbytes: int) -> None:
+        with self._condition:
+            while not self._closed and self.in_use and self.in_use + nbytes > self.limit_bytes:
+                self._condition.wait()
+            self.in_use += nbytes
+            MEMORY_BUDGET_IN_USE.set(self.in_use)
+
+    def release(self, nbytes: int) -> None:
+        with self._condition:
+            self.in_use -= nbytes
+            MEMORY_BUDGET_IN_USE.set(self.in_use)
+            self._condition.notify_all()
+
+    def close(self) -> None:
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def resize(self, job: PipelineJob, nbytes: int) -> None:
+        """Change a job's reservation; growing may block, shrinking wakes waiters."""
+        delta = nbytes - job.reserved_bytes
+        if delta > 0:
+            self.acquire(delta)
+        elif delta < 0:
+            self.release(-delta)
+        job.reserved_bytes = nbytes
+
+
+class BatchPipeline:
+    """
+    Run jobs through ``read -> prepare -> call -> save`` stages connected by bounded queues.
+
+    Each stage is a callable taking a ``PipelineJob`` and storing what the next stage needs
+    in ``job.state``; stages should drop references they no longer need so pixel buffers
+    are freed as early as possible. A job that fails in any stage skips the remaining stages
+    and is yielded with ``job.error`` set.
+
+    If the consumer stops iterating early, the stage threads notice within ``_POLL_SECONDS``
+    (or once a stage call in progress returns), drop their jobs, release their memory
+    reservations and exit.
+    """
+
+    def __init__(self, config: PipelineConfig = None):
+        self.config = config or PipelineConfig()
+        self.budget = MemoryBudget(self.config.memory_budget_mb * 1024 * 1024)
+
+    def run(self, items: Iterable[BatchItem], read: Callable[[PipelineJob], None],
+            prepare: Callable[[PipelineJob], None], call: Callable[[PipelineJob], None],
+            save: Callable[[PipelineJob], None]) -> Iterator[PipelineJob]:
+        """
+        Stream items through the stages, yielding jobs in completion order.
+
+        Args:
+            items (Iterable[BatchItem]): Items to process, consumed lazily
+            read (Callable): Read stage, may reserve memory via ``self.budget``
+            prepare (Callable): Decode/resize stage
+            call (Callable): Model call stage
+            save (Callable): Response processing stage, sets ``job.result``
+
+        Yields:
+            PipelineJob: Finished jobs, successful or failed
+        """
+        depth = self.config.queue_depth
+        queues = [_GaugedQueue(stage, depth) for stage in ('read', 'prepare', 'call', 'save')]
+        stop = threading.Event()
+
+        stages = [
+            (read, queues[0], queues[1], 1),
+            (prepare, queues[1], queues[2], self.config.prepare_workers),
+            (call, queues[2], queues[3], self.config.call_workers),
+        ]
+        out_queue: queue.Queue = _GaugedQueue('done', depth)
+        stages.append((save, queues[3], out_queue, self.config.save_workers))
+
+        all_queues = queues + [out_queue]
+        # The last thread to exit after a stop drains whatever was queued after the consumer's drain
+        alive = [1 + sum(workers for *_, workers in stages)]
+        alive_lock = threading.Lock()
+
+        def exited() -> None:
+            with alive_lock:
+                alive[0] -= 1
+                if alive[0] == 0 and stop.is_set():
+                    for q in all_queues:
+                        self._drain(q)
+
+        threads = [threading.Thread(target=self._feed, args=(items, queues[0], stop, exited), daemon=True)]
+        for stage, in_queue, next_queue, workers in stages:
+            remaining = [workers]
+            lock = threading.Lock()
+            for _ in range(workers):
+                threads.append(threading.Thread(
+                    target=self._work,
+                    args=(stage, in_queue, next_queue, next_queue is out_queue, remaining, lock, stop, exited),
+                    daemon=True
+                ))
+
+        for thread in threads:
+            thread.start()
+
+        try:
+            while True:
+                job = out_queue.get()
+                if job is _DONE:
+                    break
+                yield job
+        finally:
+            stop.set()
+            self.budget.close()
+            for q in all_queues:
+                self._drain(q)
+
+    def _feed(self, items: Iterable[BatchItem], first_queue: queue.Queue, stop: threading.Event,
+              exited: Callable[[], None]) -> None:
+        try:
+            for index, item in enumerate(items):
+                if stop.is_set() or not self._put(first_queue, PipelineJob(item, index), stop):
+                    break
+            self._put(first_queue, _DONE, stop)
+        finally:
+            exited()
+
+    def _work(self, stage: Callable[[PipelineJob], None], in_queue: queue.Queue, out_queue: queue.Queue,
+              is_last: bool, remaining: List[int], lock: threading.Lock, stop: threading.Event,
+              exited: Callable[[], None]) -> None:
+        try:
+            self._work_loop(stage, in_queue, out_queue, is_last, remaining, lock, stop)
+        finally:
+            exited()
+
+    def _work_loop(self, stage: Callable[[PipelineJob], None], in_queue: queue.Queue, out_queue: queue.Queue,
+                   is_last: bool, remaining: List[int], lock: threading.Lock, stop: threading.Event) -> None:
+        while True:
+            job = self._get(in_queue, stop)
+            if job is None:
+                return
+            if job is _DONE:
+                # Let sibling workers see the sentinel; the last one out forwards it
+                self._put(in_queue, _DONE, stop)
+                with lock:
+                    remaining[0] -= 1
+                    if remaining[0] == 0:
+                        self._put(out_queue, _DONE, stop)
+                return
+
+            if job.error is None and not stop.is_set():
+                try:
+                    stage(job)
+                except Exception as e:
+                    logger.error(f"Pipeline stage {stage.__name__} failed for {job.item.name}: {str(e)}")
+                    job.error = e
+                    job.state.clear()
+
+            if is_last or job.error is not None:
+                job.state.clear()
+            if is_last and job.reserved_bytes:
+                self.budget.release(job.reserved_bytes)
+                job.reserved_bytes = 0
+
+            if not self._put(out_queue, job, stop):
+                return
+
+    def _get(self, q: queue.Queue, stop: threading.Event) -> Any:
+        """Next queued item, or None once the pipeline is stopped."""
+        while not stop.is_set():
+            try:
+                return q.get(timeout=_POLL_SECONDS)
+            except queue.Empty:
+                continue
+        return None
+
+    def _put(self, q: queue.Queue, item: Any, stop: threading.Event) -> bool:
+        """Queue an item unless the pipeline stops first, in which case its reservation is released."""
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=_POLL_SECONDS)
+                return True
+            except queue.Full:
+                continue
+        self._release(item)
+        return False
+
+    def _release(self, item: Any) -> None:
+        if isinstance(item, PipelineJob) and item.reserved_bytes:
+            self.budget.release(item.reserved_bytes)
+            item.reserved_bytes = 0
+
+    def _drain(self, q: queue.Queue) -> None:
+        while True:
+            try:
+                job = q.get_nowait()
+            except queue.Empty:
+                return
+            self._release(job)
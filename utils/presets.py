@@ -0,0 +1,253 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from dataclasses import dataclass, asdict
+from typing import Optional, Dict, Any, List, Iterable
+
+from utils.filters import ImageFilterManager
+from utils.handler import PhotoProError, logs
+
+logger = logs()
+
+_FORMAT_VERSION = 1
+
+FilterConfig = Dict[str, Dict[str, Any]]
+
+
+class PresetError(PhotoProError):
+    pass
+
+
+def filters_hash(configured_filters: FilterConfig) -> str:
+    """Stable hash of a filter configuration, independent of dict order."""
+    canonical = json.dumps(configured_filters, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+@dataclass
+class FilterPreset:
+    """A named filter configuration with its prompt compiled ahead of time."""
+    name: str
+    filters: FilterConfig
+    prompt: str
+    # Hash of ``filters``; presets with the same configuration share it
+    content_hash: str
+    # Hash of the filter templates the prompt was compiled from; a mismatch means it is stale
+    template_hash: str
+    created: float = 0.0
+
+
+class PresetStore:
+    """
+    Filter presets indexed by name and by content hash, kept in memory or in a JSON file.
+
+    Prompts are compiled once when a preset is saved (or when the filter templates it was
+    compiled from change), so applying a preset or reusing its exact configuration does not
+    re-render the prompt.
+
+    A store can sit on top of a shared ``library``: its presets are listed and matched as
+    well, but saving, deleting and importing only ever change this store. A preset saved
+    here under a library preset's name shadows it.
+    """
+
+    def __init__(self, path: Optional[str] = None, filter_manager: Optional[ImageFilterManager] = None,
+                 library: Optional["PresetStore"] = None):
+        self.path = path
+        self.filter_manager = filter_manager or ImageFilterManager()
+        self.library = library
+        self._by_name: Dict[str, FilterPreset] = {}
+        self._by_hash: Dict[str, FilterPreset] = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    def names(self) -> List[str]:
+        shared = self.library.names() if self.library is not None else []
+        with self._lock:
+            return sorted(set(self._by_name) | set(shared))
+
+    def get(self, name: str) -> Optional[FilterPreset]:
+        with self._lock:
+            preset = self._by_name.get(name)
+        if preset is None and self.library is not None:
+            return self.library.get(name)
+        return preset
+
+    def find(self, configured_filters: FilterConfig) -> Optional[FilterPreset]:
+        """Preset with exactly this configuration, if one was saved."""
+        with self._lock:
+            preset = self._by_hash.get(filters_hash(configured_filters))
+        if preset is None and self.library is not None:
+            return self.library.find(configured_filters)
+        return preset
+
+    def compiled_prompt(self, configured_filters: FilterConfig) -> str:
+        """Prompt for a configuration, taken from a matching preset when there is one."""
+        preset = self.find(configured_filters)
+        if preset is not None:
+            return preset.prompt
+        return self.filter_manager.combine_filter_prompts(configured_filters)
+
+    def save(self, name: str, configured_filters: FilterConfig) -> FilterPreset:
+        """
+        Save (or overwrite) a preset and persist the store.
+
+        Raises:
+            PresetError: If the name is empty, no filters are given or writing fails
+        """
+        name = name.strip()
+        if not name:
+            raise PresetError("Preset name is required")
+        if not configured_filters:
+            raise PresetError("Select at least one filter to save a preset")
+
+        preset = self._compile(name, configured_filters, time.time())
+        with self._lock:
+            self._put(preset)
+            self._write()
+        logger.info(f"Saved filter preset '{name}' ({len(configured_filters)} filter(s))")
+        return preset
+
+    def delete(self, name: str) -> None:
+        """
+        Delete a preset of this store.
+
+        Raises:
+            PresetError: If the preset belongs to the shared library
+        """
+        with self._lock:
+            preset = self._by_name.pop(name, None)
+            if preset is not None:
+                self._reindex()
+                self._write()
+                return
+        if self.library is not None and self.library.get(name) is not None:
+            raise PresetError(f"'{name}' is a shared preset and cannot be deleted here")
+
+    def export(self, names: Optional[Iterable[str]] = None) -> bytes:
+        """JSON document with the given presets (all visible ones by default), readable by ``import_presets``."""
+        selected = [preset for preset in map(self.get, names if names is not None else self.names())
+                    if preset is not None]
+        return json.dumps(
+            {'version': _FORMAT_VERSION, 'presets': [asdict(preset) for preset in selected]}, indent=2
+        ).encode('utf-8')
+
+    def import_presets(self, data: bytes) -> List[FilterPreset]:
+        """
+        Add presets from an exported document, recompiling their prompts locally.
+
+        Raises:
+            PresetError: If the document is not a valid preset export
+        """
+        imported = [
+            self._compile(entry['name'], entry['filters'], entry.get('created', time.time()))
+            for entry in self._parse(data)
+        ]
+        with self._lock:
+            for preset in imported:
+                self._put(preset)
+            self._write()
+        return imported
+
+    def _compile(self, name: str, configured_filters: FilterConfig, created: float) -> FilterPreset:
+        unknown = [filter_name for filter_name in configured_filters
+                   if filter_name not in self.filter_manager.get_all_prompts()]
+        if unknown:
+            raise PresetError(f"Unknown filter(s) in preset '{name}': {', '.join(unknown)}")
+        return FilterPreset(
+            name=name,
+            filters=configured_filters,
+            prompt=self.filter_manager.combine_filter_prompts(configured_filters),
+            content_hash=filters_hash(configured_filters),
+            template_hash=self._template_hash(configured_filters),
+            created=created
+        )
+
+    def _template_hash(self, configured_filters: FilterConfig) -> str:
+        prompts = self.filter_manager.get_all_prompts()
+        return filters_hash({filter_name: {'template': prompts[filter_name]} for filter_name in configured_filters})
+
+    def _put(self, preset: FilterPreset) -> None:
+        self._by_name[preset.name] = preset
+        self._reindex()
+
+    def _reindex(self) -> None:
+        # Newest first, so the oldest preset wins when two share a configuration
+        self._by_hash = {}
+        for preset in sorted(self._by_name.values(), key=lambda p: p.created, reverse=True):
+            self._by_hash[preset.content_hash] = preset
+
+    def _parse(self, data: bytes) -> List[Dict[str, Any]]:
+        try:
+            document = json.loads(data)
+            if document.get('version') != _FORMAT_VERSION:
+                raise PresetError(f"Unsupported preset format version {document.get('version')}")
+            entries = document['presets']
+            for entry in entries:
+                if not isinstance(entry['name'], str) or not isinstance(entry['filters'], dict):
+                    raise PresetError("Preset entries need a name and a filters mapping")
+            return entries
+        except PresetError:
+            raise
+        except Exception as e:
+            raise PresetError(f"Invalid preset file: {str(e)}")
+
+    def _load(self) -> None:
+        if self.path is None or not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb') as file:
+            entries = self._parse(file.read())
+
+        stale = 0
+        for entry in entries:
+            try:
+                preset = FilterPreset(**entry)
+                if preset.template_hash != self._template_hash(preset.filters):
+                    preset = self._compile(preset.name, preset.filters, preset.created)
+                    stale += 1
+            except Exception as e:
+                logger.warning(f"Skipping filter preset '{entry.get('name')}': {str(e)}")
+                continue
+            self._by_name[preset.name] = preset
+        self._reindex()
+
+        if stale:
+            logger.info(f"Recompiled {stale} filter preset(s) after filter template changes")
+            self._write()
+
+    def _write(self) -> None:
+        if self.path is None:
+            return
+        directory = os.path.dirname(os.path.abspath(self.path))
+        temp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(directory, exist_ok=True)
+            with open(temp_path, 'wb') as file:
+                file.write(json.dumps(
+                    {'version': _FORMAT_VERSION, 'presets': [asdict(p) for p in self._by_name.values()]}, indent=2
+                ).encode('utf-8'))
+            os.replace(temp_path, self.path)
+        except Exception as e:
+            raise PresetError(f"Failed to write presets to {self.path}: {str(e)}")
+
+
+_library: Optional[PresetStore] = None
+_library_lock = threading.Lock()
+
+
+def get_preset_library() -> Optional[PresetStore]:
+    """
+    Process-wide shared presets from ``PHOTOPRO_PRESETS_PATH``, or None when it is not set.
+
+    Sessions layer their own stores on top and never write to it.
+    """
+    global _library
+
+    path = os.environ.get("PHOTOPRO_PRESETS_PATH")
+    if not path:
+        return None
+    with _library_lock:
+        if _library is None:
+            _library = PresetStore(path)
+        return _library
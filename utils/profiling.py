@@ -0,0 +1,264 @@
+import io
+import os
+import sys
+import time
+import pstats
+import random
+import tempfile
+import cProfile
+import itertools
+import threading
+import functools
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Optional, List, Iterator, Callable
+
+from utils.handler import logs
+from utils.metrics import PROFILES_WRITTEN
+
+logger = logs()
+
+# Outside the working directory, so reports never land in a checkout
+_DEFAULT_OUTPUT_DIR = os.path.join(tempfile.gettempdir(), "photopro_profiles")
+
+
+@dataclass
+class ProfilingConfig:
+    """Sampling profiler settings; off unless enabled."""
+    enabled: bool = False
+    # Fraction of calls to profile
+    sample_rate: float = 0.05
+    output_dir: str = _DEFAULT_OUTPUT_DIR
+    # Functions and allocation sites listed in each report
+    top_n: int = 25
+    # Interval of the wall-clock stack sampler behind the collapsed stacks
+    stack_interval_seconds: float = 0.005
+    # Traceback depth kept by tracemalloc
+    tracemalloc_frames: int = 8
+    # Oldest reports are deleted beyond this count
+    max_reports: int = 200
+
+    @classmethod
+    def from_env(cls) -> "ProfilingConfig":
+        """``PHOTOPRO_PROFILE_SAMPLE_RATE`` > 0 turns profiling on; ``PHOTOPRO_PROFILE_DIR`` sets the directory (a temp dir by default)."""
+        sample_rate = float(os.environ.get("PHOTOPRO_PROFILE_SAMPLE_RATE", "0") or 0)
+        return cls(
+            enabled=sample_rate > 0,
+            sample_rate=sample_rate or cls.sample_rate,
+            output_dir=os.environ.get("PHOTOPRO_PROFILE_DIR", cls.output_dir)
+        )
+
+
+@dataclass
+class ProfileReport:
+    name: str
+    report_path: str
+    collapsed_path: str
+    stats_path: str
+    created: float
+    size_bytes: int
+
+
+class _StackSampler(threading.Thread):
+    """Samples one thread's Python stack at a fixed interval into collapsed (folded) form."""
+
+    def __init__(self, thread_id: int, interval: float):
+        super().__init__(name="photopro-stack-sampler", daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if names:
+                self.stacks[';'.join(reversed(names))] += 1
+
+    def stop(self) -> Counter:
+        self._stop_event.set()
+        self.join()
+        return self.stacks
+
+
+class Profiler:
+    """
+    Profile a sampled fraction of hot-path calls with cProfile, a stack sampler and tracemalloc.
+
+    Only the outermost profiled call in a thread is sampled; calls nested inside it are
+    covered by its profile. tracemalloc runs only while at least one sampled call is in
+    flight, so unsampled traffic pays nothing but a random draw. Allocation reports diff
+    process-wide snapshots, so concurrent requests can show up in each other's reports.
+
+    Each sampled call writes three files to ``output_dir``: ``<id>.txt`` (top functions by
+    cumulative time and top allocation sites), ``<id>.collapsed`` (folded stacks for
+    flamegraph tools) and ``<id>.prof`` (raw pstats for snakeviz and similar).
+    """
+
+    def __init__(self, config: Optional[ProfilingConfig] = None):
+        self.config = config or ProfilingConfig()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._tracing = 0
+        self._owns_tracing = False
+        self._sequence = itertools.count()
+
+    def configure(self, enabled: bool, sample_rate: float) -> None:
+        self.config.enabled = enabled
+        self.config.sample_rate = sample_rate
+
+    @contextmanager
+    def profile(self, name: str) -> Iterator[None]:
+        config = self.config
+        if (not config.enabled or getattr(self._local, 'active', False)
+                or random.random() >= config.sample_rate):
+            yield
+            return
+
+        self._local.active = True
+        tracing = False
+        sampler = None
+        profiler = None
+        try:
+            try:
+                self._start_tracing()
+                tracing = True
+                before = tracemalloc.take_snapshot()
+                sampler = _StackSampler(threading.get_ident(), config.stack_interval_seconds)
+                sampler.start()
+                started = time.perf_counter()
+                candidate = cProfile.Profile()
+                # Python 3.12+ raises ValueError while another cProfile is active in the process
+                candidate.enable()
+                profiler = candidate
+            except Exception as e:
+                logger.warning(f"Running {name} unprofiled: {str(e)}")
+            yield
+        finally:
+            try:
+                if profiler is not None:
+                    profiler.disable()
+                    elapsed = time.perf_counter() - started
+                stacks = sampler.stop() if sampler is not None else None
+                if profiler is not None:
+                    after = tracemalloc.take_snapshot()
+                    self._write(name, elapsed, profiler, stacks, before, after)
+            except Exception as e:
+                logger.warning(f"Failed to write profile for {name}: {str(e)}")
+            finally:
+                if tracing:
+                    self._stop_tracing()
+                self._local.active = False
+
+    def reports(self, limit: int = 50) -> List[ProfileReport]:
+        """Most recent reports first."""
+        directory = self.config.output_dir
+        if not os.path.isdir(directory):
+            return []
+        reports = []
+        for entry in os.scandir(directory):
+            if not entry.name.endswith('.txt'):
+                continue
+            stem = entry.path[:-len('.txt')]
+            stat = entry.stat()
+            reports.append(ProfileReport(
+                name=entry.name[:-len('.txt')],
+                report_path=entry.path,
+                collapsed_path=f"{stem}.collapsed",
+                stats_path=f"{stem}.prof",
+                created=stat.st_mtime,
+                size_bytes=stat.st_size
+            ))
+        reports.sort(key=lambda report: report.created, reverse=True)
+        return reports[:limit]
+
+    def _start_tracing(self) -> None:
+        with self._lock:
+            if self._tracing == 0 and not tracemalloc.is_tracing():
+                tracemalloc.start(self.config.tracemalloc_frames)
+                self._owns_tracing = True
+            self._tracing += 1
+
+    def _stop_tracing(self) -> None:
+        with self._lock:
+            self._tracing -= 1
+            # Leave tracing alone if something else started it
+            if self._tracing == 0 and self._owns_tracing:
+                tracemalloc.stop()
+                self._owns_tracing = False
+
+    def _write(self, name: str, elapsed: float, profiler: cProfile.Profile, stacks: Counter,
+               before: tracemalloc.Snapshot, after: tracemalloc.Snapshot) -> None:
+        config = self.config
+        os.makedirs(config.output_dir, exist_ok=True)
+        report_id = f"{time.strftime('%Y%m%d_%H%M%S')}_{name}_{os.getpid()}_{next(self._sequence)}"
+        stem = os.path.join(config.output_dir, report_id)
+
+        profiler.dump_stats(f"{stem}.prof")
+
+        with open(f"{stem}.collapsed", 'w', encoding='utf-8') as file:
+            for stack, count in stacks.most_common():
+                file.write(f"{stack} {count}\n")
+
+        stats_text = io.StringIO()
+        pstats.Stats(profiler, stream=stats_text).sort_stats(pstats.SortKey.CUMULATIVE).print_stats(config.top_n)
+
+        allocation_lines = []
+        allocations = after.compare_to(before, 'lineno')
+        for difference in allocations[:config.top_n]:
+            allocation_lines.append(
+                f"{difference.size_diff / 1024:+10.1f} KiB {difference.count_diff:+8d} blocks  {difference.traceback}"
+            )
+        total_kib = sum(difference.size_diff for difference in allocations) / 1024
+
+        with open(f"{stem}.txt", 'w', encoding='utf-8') as file:
+            file.write(f"{name}: {elapsed * 1000:.1f} ms wall, {sum(stacks.values())} stack samples, "
+                       f"{total_kib:+.1f} KiB net allocated\n\n")
+            file.write(f"Top {config.top_n} functions by cumulative time\n")
+            file.write(stats_text.getvalue())
+            file.write(f"\nTop {config.top_n} allocation sites (net change)\n")
+            file.write("\n".join(allocation_lines) + "\n")
+
+        PROFILES_WRITTEN.inc(target=name)
+        logger.info(f"Profile written: {stem}.txt ({elapsed * 1000:.0f} ms)")
+        self._prune()
+
+    def _prune(self) -> None:
+        for report in self.reports(limit=sys.maxsize)[self.config.max_reports:]:
+            for path in (report.report_path, report.collapsed_path, report.stats_path):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+
+_profiler: Optional[Profiler] = None
+_profiler_lock = threading.Lock()
+
+
+def get_profiler() -> Profiler:
+    """Process-wide profiler, configured from the environment on first use."""
+    global _profiler
+
+    with _profiler_lock:
+        if _profiler is None:
+            _profiler = Profiler(ProfilingConfig.from_env())
+        return _profiler
+
+
+def profiled(name: str) -> Callable:
+    """Decorator form of ``get_profiler().profile(name)``."""
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with get_profiler().profile(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
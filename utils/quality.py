@@ -0,0 +1,113 @@
+import threading
+from collections import deque
+from dataclasses import dataclass
+from typing import Optional, List
+
+import numpy as np
+from PIL import Image
+
+from utils.handler import logs
+
+logger = logs()
+
+TEXT_ONLY = 'text_only'
+BLANK = 'blank'
+UNCHANGED = 'unchanged'
+ASPECT_RATIO = 'aspect_ratio'
+
+
+@dataclass
+class QualityConfig:
+    """Thresholds for the automatic output check and the retry budget."""
+    enabled: bool = True
+    # Shannon entropy (bits) of the 256-bin luma histogram; flat or near-flat frames score ~0
+    min_entropy: float = 2.0
+    # Outputs under ``min_entropy`` are only blank if also below this fraction of the input's
+    # entropy, so enhancing an already flat input (a document scan, a clear sky) is not flagged
+    min_entropy_ratio: float = 0.5
+    # Mean absolute RGB difference (0-255) between 64x64 thumbnails of input and output
+    min_change: float = 1.0
+    # Allowed relative difference between input and output aspect ratios
+    max_aspect_drift: float = 0.05
+    max_retries_per_image: int = 1
+    # Retries allowed as a fraction of checked images (at least one)
+    retry_budget_fraction: float = 0.2
+    # Number of most recent checks the retry budget is computed over
+    retry_budget_window: int = 200
+
+
+def check_output(source: Image.Image, output: Optional[Image.Image], config: QualityConfig) -> List[str]:
+    """
+    Cheap vectorized checks of a model output against the image that was sent.
+
+    Args:
+        source (Image.Image): Prepared image sent to the model
+        output (Image.Image, optional): Decoded output, or None when the response had no image
+        config (QualityConfig): Thresholds
+
+    Returns:
+        List[str]: Issues found, empty when the output looks fine
+    """
+    if output is None:
+        return [TEXT_ONLY]
+
+    issues = []
+    source_ratio = source.size[0] / source.size[1]
+    output_ratio = output.size[0] / output.size[1]
+    if abs(output_ratio / source_ratio - 1) > config.max_aspect_drift:
+        issues.append(ASPECT_RATIO)
+
+    output_small = np.asarray(output.convert('RGB').resize((64, 64), Image.Resampling.BOX), dtype=np.float32)
+    source_small = np.asarray(source.convert('RGB').resize((64, 64), Image.Resampling.BOX), dtype=np.float32)
+    output_entropy = _luma_entropy(output_small)
+    if output_entropy < config.min_entropy and output_entropy < config.min_entropy_ratio * _luma_entropy(source_small):
+        issues.append(BLANK)
+
+    if float(np.abs(output_small - source_small).mean()) < config.min_change:
+        issues.append(UNCHANGED)
+
+    return issues
+
+
+def _luma_entropy(pixels: np.ndarray) -> float:
+    """Shannon entropy (bits) of the 256-bin luma histogram of an RGB array."""
+    luma = pixels @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    histogram = np.bincount(luma.astype(np.uint8).ravel(), minlength=256) / luma.size
+    nonzero = histogram[histogram > 0]
+    return float(-(nonzero * np.log2(nonzero)).sum())
+
+
+class RetryBudget:
+    """
+    Cap automatic quality retries at a fraction of the recently checked images (at least one).
+
+    Only the last ``window`` checks and the retries made after them count, so a long-lived
+    engine neither banks budget from old traffic nor stays throttled by old failures. When
+    a batch size is known up front, its images not yet checked count towards the cap, so
+    failures early in a batch are not starved of the budget the rest of the batch will bring.
+    """
+
+    def __init__(self, fraction: float, window: int = 200):
+        self.fraction = fraction
+        self.window = window
+        # Retries made after each recent check, oldest first
+        self._checks = deque(maxlen=window)
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def expect(self, count: int) -> None:
+        with self._lock:
+            self._pending += count
+
+    def record_check(self) -> None:
+        with self._lock:
+            self._checks.append(0)
+            self._pending = max(0, self._pending - 1)
+
+    def try_retry(self) -> bool:
+        with self._lock:
+            basis = min(self.window, len(self._checks) + self._pending)
+            if not self._checks or sum(self._checks) + 1 > max(1.0, self.fraction * basis):
+                return False
+            self._checks[-1] += 1
+            return True
@@ -0,0 +1,501 @@
+import os
+import json
+import time
+import socket
+import struct
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Optional, Tuple, Dict, Any, List, Callable, Protocol, runtime_checkable
+from urllib.parse import urlparse
+
+from google.genai import types
+
+from utils.handler import PhotoProError, logs
+from utils.metrics import CACHE_LOOKUPS
+
+logger = logs()
+
+
+class ResultCacheError(PhotoProError):
+    pass
+
+
+@runtime_checkable
+class CacheBackend(Protocol):
+    """Byte store shared by the result cache; ``add`` must be atomic across every client."""
+    name: str
+
+    def get(self, key: str) -> Optional[bytes]:
+        ...
+
+    def set(self, key: str, value: bytes, ttl_seconds: Optional[int] = None) -> None:
+        ...
+
+    def add(self, key: str, value: bytes, ttl_seconds: int) -> bool:
+        """Set ``key`` only if it does not exist; returns whether it was set."""
+        ...
+
+    def delete(self, key: str) -> None:
+        ...
+
+
+class MemoryCache:
+    """In-process LRU bounded by total value bytes."""
+    name = 'memory'
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self._items: "OrderedDict[str, Tuple[bytes, Optional[float]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            if item[1] is not None and item[1] < time.monotonic():
+                self._pop(key)
+                return None
+            self._items.move_to_end(key)
+            return item[0]
+
+    def set(self, key: str, value: bytes, ttl_seconds: Optional[int] = None) -> None:
+        with self._lock:
+            self._put(key, value, ttl_seconds)
+
+    def add(self, key: str, value: bytes, ttl_seconds: int) -> bool:
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None and (item[1] is None or item[1] >= time.monotonic()):
+                return False
+            self._put(key, value, ttl_seconds)
+            return True
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            if key in self._items:
+                self._pop(key)
+
+    def _put(self, key: str, value: bytes, ttl_seconds: Optional[int]) -> None:
+        if key in self._items:
+            self._pop(key)
+        self._items[key] = (value, time.monotonic() + ttl_seconds if ttl_seconds else None)
+        self.size_bytes += len(value)
+        while self.size_bytes > self.max_bytes and len(self._items) > 1:
+            self._pop(next(iter(self._items)))
+
+    def _pop(self, key: str) -> None:
+        value, _ = self._items.pop(key)
+        self.size_bytes -= len(value)
+
+
+class DiskCache:
+    """
+    One file per key under ``directory``, evicted least recently read first past ``max_bytes``.
+
+    Writes go through a temp file, with ``os.replace`` for ``set`` and ``os.link`` for ``add``,
+    so replicas sharing a volume can use the same directory. Each file starts with its expiry time (0 for
+    none); reads bump the mtime for eviction, so it cannot carry the TTL.
+    """
+    name = 'disk'
+
+    _EXPIRY = struct.Struct('>d')
+
+    def __init__(self, directory: str, max_bytes: int = 2 * 1024 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self.size_bytes = sum(entry.stat().st_size for entry in os.scandir(directory) if entry.is_file())
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        if self._expired(data):
+            self._remove(path)
+            return None
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return data[self._EXPIRY.size:]
+
+    def set(self, key: str, value: bytes, ttl_seconds: Optional[int] = None) -> None:
+        path = self._path(key)
+        data = self._encode(value, ttl_seconds)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+
+        with self._lock:
+            # An overwrite replaces the old file's bytes rather than adding to them
+            self.size_bytes += len(data) - self._size(path)
+            os.replace(temp_path, path)
+            if self.size_bytes > self.max_bytes:
+                self._evict()
+
+    def add(self, key: str, value: bytes, ttl_seconds: int) -> bool:
+        path = self._path(key)
+        data = self._encode(value, ttl_seconds)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        try:
+            # Linking a complete file claims the key atomically; no replica ever sees it half written
+            for _ in range(2):
+                try:
+                    os.link(temp_path, path)
+                except FileExistsError:
+                    if not self._remove_expired(path):
+                        return False
+                    continue
+                with self._lock:
+                    self.size_bytes += len(data)
+                return True
+            return False
+        finally:
+            os.remove(temp_path)
+
+    def delete(self, key: str) -> None:
+        self._remove(self._path(key))
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key.replace(':', '_'))
+
+    def _encode(self, value: bytes, ttl_seconds: Optional[int]) -> bytes:
+        return self._EXPIRY.pack(time.time() + ttl_seconds if ttl_seconds else 0.0) + value
+
+    def _expired(self, data: bytes) -> bool:
+        # Files too short for the header (torn or foreign) count as expired
+        if len(data) < self._EXPIRY.size:
+            return True
+        (expires,) = self._EXPIRY.unpack_from(data)
+        return expires != 0.0 and expires < time.time()
+
+    def _remove_expired(self, path: str) -> bool:
+        """Remove the file at ``path`` if it has expired; returns whether the key is free."""
+        try:
+            with open(path, 'rb') as f:
+                header = f.read(self._EXPIRY.size)
+                inode = os.fstat(f.fileno()).st_ino
+            if len(header) < self._EXPIRY.size or not self._expired(header):
+                return False
+            # Another replica may have replaced the expired entry since it was read
+            if os.stat(path).st_ino != inode:
+                return False
+        except FileNotFoundError:
+            return True
+        self._remove(path)
+        return True
+
+    @staticmethod
+    def _size(path: str) -> int:
+        try:
+            return os.path.getsize(path)
+        except FileNotFoundError:
+            return 0
+
+    def _remove(self, path: str) -> None:
+        with self._lock:
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+            except FileNotFoundError:
+                return
+            self.size_bytes -= size
+
+    def _evict(self) -> None:
+        entries = sorted(
+            (entry for entry in os.scandir(self.directory) if entry.is_file() and not entry.name.endswith('.tmp')),
+            key=lambda entry: entry.stat().st_mtime
+        )
+        total = sum(entry.stat().st_size for entry in entries)
+        for entry in entries:
+            if total <= self.max_bytes * 0.9:
+                break
+            try:
+                total -= entry.stat().st_size
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+        self.size_bytes = total
+
+
+class RedisCache:
+    """
+    Minimal RESP client for a Redis-compatible server, one connection per thread.
+
+    Only ``GET``, ``SET`` (with ``EX``/``NX``), ``DEL`` and ``SELECT`` are used, so any server
+    speaking the protocol works, including ``utils.fake_redis.FakeRedisServer`` in tests.
+    """
+    name = 'redis'
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 6379, db: int = 0, prefix: str = 'photopro:',
+                 timeout_seconds: float = 5.0):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.prefix = prefix
+        self.timeout_seconds = timeout_seconds
+        self._local = threading.local()
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self._command(b'GET', self.prefix + key)
+
+    def set(self, key: str, value: bytes, ttl_seconds: Optional[int] = None) -> None:
+        args = [b'SET', self.prefix + key, value]
+        if ttl_seconds:
+            args += [b'EX', str(int(ttl_seconds))]
+        self._command(*args)
+
+    def add(self, key: str, value: bytes, ttl_seconds: int) -> bool:
+        return self._command(b'SET', self.prefix + key, value, b'NX', b'EX', str(int(ttl_seconds))) is not None
+
+    def delete(self, key: str) -> None:
+        self._command(b'DEL', self.prefix + key)
+
+    def _command(self, *args: Any) -> Any:
+        # Retry once on a fresh connection; the server may have closed an idle one
+        for attempt in range(2):
+            connection, reader = self._connection()
+            try:
+                connection.sendall(encode_command(*args))
+                return read_reply(reader)
+            except (OSError, EOFError) as e:
+                self._close()
+                if attempt:
+                    raise ResultCacheError(f"Redis cache {self.host}:{self.port} unavailable: {str(e)}")
+
+    def _connection(self) -> Tuple[socket.socket, Any]:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            sock = socket.create_connection((self.host, self.port), timeout=self.timeout_seconds)
+            connection = self._local.connection = (sock, sock.makefile('rb'))
+            if self.db:
+                sock.sendall(encode_command(b'SELECT', str(self.db)))
+                read_reply(connection[1])
+        return connection
+
+    def _close(self) -> None:
+        connection = getattr(self._local, 'connection', None)
+        self._local.connection = None
+        if connection is not None:
+            connection[1].close()
+            connection[0].close()
+
+
+def encode_command(*args: Any) -> bytes:
+    parts = [b'*%d\r\n' % len(args)]
+    for arg in args:
+        data = arg if isinstance(arg, bytes) else str(arg).encode('utf-8')
+        parts.append(b'$%d\r\n%s\r\n' % (len(data), data))
+    return b''.join(parts)
+
+
+def read_reply(stream) -> Any:
+    line = stream.readline()
+    if not line:
+        raise EOFError("connection closed")
+    kind, body = line[:1], line[1:-2]
+    if kind == b'+':
+        return body.decode('utf-8')
+    if kind == b'-':
+        raise ResultCacheError(f"Redis error: {body.decode('utf-8')}")
+    if kind == b':':
+        return int(body)
+    if kind == b'$':
+        length = int(body)
+        if length < 0:
+            return None
+        data = stream.read(length + 2)
+        return data[:-2]
+    if kind == b'*':
+        length = int(body)
+        return None if length < 0 else [read_reply(stream) for _ in range(length)]
+    raise ResultCacheError(f"Unexpected Redis reply: {line!r}")
+
+
+def encode_response(response: Any) -> bytes:
+    """
+    Pack a model response's candidates into ``[header length][JSON header][image bytes...]``.
+
+    Images stay raw bytes instead of base64, and only the parts the engine reads are kept.
+    """
+    header, blobs = [], []
+    for candidate in response.candidates or []:
+        parts = []
+        for part in (candidate.content.parts if candidate.content is not None else None) or []:
+            if part.text is not None:
+                parts.append({'text': part.text})
+            elif part.inline_data is not None:
+                parts.append({'mime': part.inline_data.mime_type, 'size': len(part.inline_data.data)})
+                blobs.append(part.inline_data.data)
+        header.append(parts)
+
+    header_bytes = json.dumps(header).encode('utf-8')
+    return struct.pack('>I', len(header_bytes)) + header_bytes + b''.join(blobs)
+
+
+def decode_response(payload: bytes) -> types.GenerateContentResponse:
+    (header_length,) = struct.unpack_from('>I', payload)
+    offset = 4 + header_length
+    candidates = []
+    for candidate_parts in json.loads(payload[4:offset]):
+        parts = []
+        for part in candidate_parts:
+            if 'text' in part:
+                parts.append(types.Part(text=part['text']))
+            else:
+                parts.append(types.Part.from_bytes(data=payload[offset:offset + part['size']], mime_type=part['mime']))
+                offset += part['size']
+        candidates.append(types.Candidate(content=types.Content(role='model', parts=parts)))
+    return types.GenerateContentResponse(candidates=candidates)
+
+
+def result_cache_key(image_bytes: bytes, prompt: str, model_name: str, candidate_count: int,
+                     response_modalities: List[str]) -> str:
+    """Key a call by exactly what is sent: the encoded upload, prompt, model and generation settings."""
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(image_bytes)
+    digest.update(json.dumps([prompt, model_name, candidate_count, sorted(response_modalities)]).encode('utf-8'))
+    return f"result:{digest.hexdigest()}"
+
+
+class ResultCache:
+    """
+    Model responses cached in a pluggable backend, with single-flight deduplication.
+
+    Concurrent identical calls in one process share one in-flight computation. Across
+    replicas the first caller takes a short-lived lock key in the backend and the others poll
+    for its result, so each distinct request reaches the model once. Backend failures are
+    logged and fall back to calling the model directly.
+    """
+
+    def __init__(self, backend: CacheBackend, ttl_seconds: int = 24 * 3600, lock_seconds: int = 180,
+                 poll_interval: float = 0.2):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self.lock_seconds = lock_seconds
+        self.poll_interval = poll_interval
+        self._inflight: Dict[str, Future] = {}
+        self._inflight_lock = threading.Lock()
+
+    def get_or_compute(self, key: str, compute: Callable[[], bytes]) -> bytes:
+        """
+        Return the cached value for ``key``, computing and storing it at most once.
+
+        Args:
+            key (str): Cache key
+            compute (Callable[[], bytes]): Produces the value on a miss; its errors propagate
+                to every caller waiting on the same key
+
+        Returns:
+            bytes: The cached or freshly computed value
+        """
+        with self._inflight_lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+
+        if not leader:
+            CACHE_LOOKUPS.inc(cache='result', result='shared')
+            return future.result()
+
+        try:
+            value = self._get_or_compute_shared(key, compute)
+            future.set_result(value)
+            return value
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._inflight_lock:
+                del self._inflight[key]
+
+    def invalidate(self, key: str) -> None:
+        """Drop a cached value, e.g. a response whose output failed the quality check."""
+        try:
+            self.backend.delete(key)
+        except Exception as e:
+            logger.warning(f"Failed to invalidate result cache entry: {str(e)}")
+
+    def _get_or_compute_shared(self, key: str, compute: Callable[[], bytes]) -> bytes:
+        lock_key = f"lock:{key}"
+        deadline = time.monotonic() + self.lock_seconds
+
+        while True:
+            try:
+                value = self.backend.get(key)
+                if value is not None:
+                    CACHE_LOOKUPS.inc(cache='result', result='hit')
+                    return value
+                holds_lock = self.backend.add(lock_key, b'1', self.lock_seconds)
+            except Exception as e:
+                logger.warning(f"Result cache {self.backend.name} unavailable, calling the model: {str(e)}")
+                CACHE_LOOKUPS.inc(cache='result', result='error')
+                return compute()
+
+            if holds_lock or time.monotonic() > deadline:
+                break
+            # Another replica is computing this result
+            time.sleep(self.poll_interval)
+
+        CACHE_LOOKUPS.inc(cache='result', result='miss')
+        try:
+            value = compute()
+            try:
+                self.backend.set(key, value, self.ttl_seconds)
+            except Exception as e:
+                logger.warning(f"Failed to store result in {self.backend.name} cache: {str(e)}")
+            return value
+        finally:
+            if holds_lock:
+                try:
+                    self.backend.delete(lock_key)
+                except Exception as e:
+                    logger.warning(f"Failed to release result cache lock: {str(e)}")
+
+
+def create_cache_backend(url: str) -> CacheBackend:
+    """
+    Build a backend from a URL: ``memory``, ``memory://?max_mb=256``, ``disk:///var/cache/photopro``
+    or ``redis://host:6379/0``.
+    """
+    parsed = urlparse(url)
+    scheme = parsed.scheme or url
+    query = dict(pair.split('=', 1) for pair in parsed.query.split('&') if '=' in pair)
+
+    if scheme == 'memory':
+        return MemoryCache(int(query.get('max_mb', 256)) * 1024 * 1024)
+    if scheme == 'disk':
+        return DiskCache(parsed.path, int(query.get('max_mb', 2048)) * 1024 * 1024)
+    if scheme == 'redis':
+        db = int(parsed.path.lstrip('/') or 0)
+        return RedisCache(parsed.hostname or '127.0.0.1', parsed.port or 6379, db)
+    raise ResultCacheError(f"Unsupported result cache URL: {url}")
+
+
+_cache: Optional[ResultCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_result_cache() -> Optional[ResultCache]:
+    """Process-wide cache configured by ``PHOTOPRO_RESULT_CACHE``; None when unset."""
+    global _cache
+
+    url = os.environ.get("PHOTOPRO_RESULT_CACHE")
+    if not url:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResultCache(create_cache_backend(url))
+            logger.info(f"Result cache enabled: {_cache.backend.name}")
+        return _cache
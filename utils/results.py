@@ -0,0 +1,239 @@
+import struct
+import time
+from datetime import datetime
+from dataclasses import dataclass, field, asdict
+from typing import Optional, Tuple, Dict, Any, List, Iterable, Iterator, BinaryIO
+
+from utils.handler import PhotoProError
+
+Box = Tuple[int, int, int, int]
+
+
+class ResultFormatError(PhotoProError):
+    pass
+
+
+@dataclass(slots=True)
+class EnhancedImage:
+    """One saved output image."""
+    path: str
+    filename: str
+    size: Tuple[int, int]
+    format: Optional[str] = None
+    mode: str = 'RGB'
+    mime: str = 'image/png'
+    # Browser-friendly rendition for formats st.image cannot show
+    preview_path: Optional[str] = None
+
+
+@dataclass(slots=True)
+class EnhancementResult:
+    """
+    Outcome of one enhancement, successful or not.
+
+    Records are typed and slotted to keep history and job queues small, and encode to a
+    compact binary form with ``to_bytes``; ``to_dict`` is only meant for display.
+    """
+    session_id: str = ''
+    original_image: str = ''
+    original_filename: str = ''
+    prompt: str = ''
+    output_directory: str = ''
+    text_responses: List[str] = field(default_factory=list)
+    enhanced_images: List[EnhancedImage] = field(default_factory=list)
+    processing_time_seconds: float = 0.0
+    # Unix time the result was completed
+    timestamp: float = 0.0
+    success: bool = False
+    error: Optional[str] = None
+    reused_from: Optional[str] = None
+    hash_distance: Optional[int] = None
+    quality_issues: List[str] = field(default_factory=list)
+    variant: Optional[int] = None
+    region: Optional[Box] = None
+    crop_box: Optional[Box] = None
+    frame_count: Optional[int] = None
+    unique_frames: Optional[int] = None
+
+    @classmethod
+    def failure(cls, filename: str, error: str) -> "EnhancementResult":
+        return cls(original_filename=filename, error=error, timestamp=time.time())
+
+    @property
+    def timestamp_iso(self) -> str:
+        return datetime.fromtimestamp(self.timestamp).isoformat(timespec='seconds') if self.timestamp else ''
+
+    def to_dict(self) -> Dict[str, Any]:
+        """JSON-friendly view for display."""
+        data = asdict(self)
+        data['timestamp'] = self.timestamp_iso
+        return data
+
+    def to_bytes(self) -> bytes:
+        return encode_result(self)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "EnhancementResult":
+        return decode_result(data)
+
+
+# Binary layout, little endian:
+#   header | region (4i)? | crop_box (4i)? | image sizes (2I each) | string lengths (I each) | UTF-8 blob
+# Strings are, in order: the fixed fields below, text responses, quality issues, then the
+# string fields of each image. A length of 0xFFFFFFFF stands for None.
+_VERSION = 1
+_HEADER = struct.Struct('<BHddiiIIHBB')
+_BOX = struct.Struct('<4i')
+_NONE = 0xFFFFFFFF
+
+_SUCCESS, _REGION, _CROP_BOX, _VARIANT, _HASH_DISTANCE, _FRAMES = (1 << bit for bit in range(6))
+
+_FIXED_STRINGS = ('session_id', 'original_image', 'original_filename', 'prompt', 'output_directory', 'error',
+                  'reused_from')
+_IMAGE_STRINGS = ('path', 'filename', 'format', 'mode', 'mime', 'preview_path')
+
+
+def encode_result(result: EnhancementResult) -> bytes:
+    flags = ((_SUCCESS if result.success else 0)
+             | (_REGION if result.region is not None else 0)
+             | (_CROP_BOX if result.crop_box is not None else 0)
+             | (_VARIANT if result.variant is not None else 0)
+             | (_HASH_DISTANCE if result.hash_distance is not None else 0)
+             | (_FRAMES if result.frame_count is not None else 0))
+
+    chunks = [_HEADER.pack(
+        _VERSION, flags, result.processing_time_seconds, result.timestamp,
+        result.variant or 0, result.hash_distance or 0, result.frame_count or 0, result.unique_frames or 0,
+        len(result.text_responses), len(result.quality_issues), len(result.enhanced_images)
+    )]
+    if result.region is not None:
+        chunks.append(_BOX.pack(*result.region))
+    if result.crop_box is not None:
+        chunks.append(_BOX.pack(*result.crop_box))
+    if result.enhanced_images:
+        sizes = [value for image in result.enhanced_images for value in image.size]
+        chunks.append(struct.pack(f'<{len(sizes)}I', *sizes))
+
+    strings = [getattr(result, name) for name in _FIXED_STRINGS]
+    strings.extend(result.text_responses)
+    strings.extend(result.quality_issues)
+    for image in result.enhanced_images:
+        strings.extend(getattr(image, name) for name in _IMAGE_STRINGS)
+
+    encoded = [value.encode('utf-8') if value is not None else None for value in strings]
+    chunks.append(struct.pack(f'<{len(encoded)}I', *(_NONE if value is None else len(value) for value in encoded)))
+    chunks.extend(value for value in encoded if value)
+    return b''.join(chunks)
+
+
+def decode_result(data: bytes) -> EnhancementResult:
+    try:
+        (version, flags, processing_time, timestamp, variant, hash_distance, frame_count, unique_frames,
+         text_count, issue_count, image_count) = _HEADER.unpack_from(data)
+        if version != _VERSION:
+            raise ResultFormatError(f"Unsupported result format version {version}")
+        offset = _HEADER.size
+
+        region = crop_box = None
+        if flags & _REGION:
+            region = _BOX.unpack_from(data, offset)
+            offset += _BOX.size
+        if flags & _CROP_BOX:
+            crop_box = _BOX.unpack_from(data, offset)
+            offset += _BOX.size
+        sizes = struct.unpack_from(f'<{2 * image_count}I', data, offset)
+        offset += 8 * image_count
+
+        string_count = len(_FIXED_STRINGS) + text_count + issue_count + len(_IMAGE_STRINGS) * image_count
+        lengths = struct.unpack_from(f'<{string_count}I', data, offset)
+        offset += 4 * string_count
+        strings = []
+        for length in lengths:
+            if length == _NONE:
+                strings.append(None)
+            else:
+                strings.append(data[offset:offset + length].decode('utf-8'))
+                offset += length
+        if offset != len(data):
+            raise ResultFormatError(f"Result record has {len(data) - offset} trailing bytes")
+
+        fixed = dict(zip(_FIXED_STRINGS, strings))
+        position = len(_FIXED_STRINGS)
+        texts = strings[position:position + text_count]
+        position += text_count
+        issues = strings[position:position + issue_count]
+        position += issue_count
+        images = []
+        for i in range(image_count):
+            values = dict(zip(_IMAGE_STRINGS, strings[position:position + len(_IMAGE_STRINGS)]))
+            position += len(_IMAGE_STRINGS)
+            images.append(EnhancedImage(size=(sizes[2 * i], sizes[2 * i + 1]), **values))
+
+        return EnhancementResult(
+            **fixed,
+            text_responses=texts,
+            enhanced_images=images,
+            processing_time_seconds=processing_time,
+            timestamp=timestamp,
+            success=bool(flags & _SUCCESS),
+            hash_distance=hash_distance if flags & _HASH_DISTANCE else None,
+            quality_issues=issues,
+            variant=variant if flags & _VARIANT else None,
+            region=region,
+            crop_box=crop_box,
+            frame_count=frame_count if flags & _FRAMES else None,
+            unique_frames=unique_frames if flags & _FRAMES else None
+        )
+
+    except ResultFormatError:
+        raise
+    except Exception as e:
+        raise ResultFormatError(f"Invalid result record: {str(e)}")
+
+
+def dump_results(results: Iterable[EnhancementResult], fp: BinaryIO) -> int:
+    """Write length-prefixed records to a binary stream; returns the number written."""
+    count = 0
+    for result in results:
+        data = encode_result(result)
+        fp.write(struct.pack('<I', len(data)))
+        fp.write(data)
+        count += 1
+    return count
+
+
+def load_results(fp: BinaryIO) -> Iterator[EnhancementResult]:
+    """Read records written by ``dump_results`` one at a time."""
+    while True:
+        prefix = fp.read(4)
+        if not prefix:
+            return
+        if len(prefix) < 4:
+            raise ResultFormatError("Truncated result stream")
+        (length,) = struct.unpack('<I', prefix)
+        data = fp.read(length)
+        if len(data) < length:
+            raise ResultFormatError("Truncated result stream")
+        yield decode_result(data)
+
+
+class ResultHistory:
+    """Session history kept as encoded records; only the entries being shown are decoded."""
+
+    def __init__(self):
+        self._records: List[bytes] = []
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def append(self, result: EnhancementResult) -> None:
+        self._records.append(encode_result(result))
+
+    def extend(self, results: Iterable[EnhancementResult]) -> None:
+        self._records.extend(encode_result(result) for result in results)
+
+    def recent(self, count: int) -> List[EnhancementResult]:
+        return [decode_result(record) for record in self._records[-count:]] if count > 0 else []
+
+    def clear(self) -> None:
+        self._records.clear()
@@ -0,0 +1,171 @@
+import os
+import time
+import threading
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Optional, Dict, Deque
+
+from utils.handler import logs
+from utils.metrics import QUEUE_DEPTH, SCHEDULER_WAIT
+
+logger = logs()
+
+INTERACTIVE = 'interactive'
+BULK = 'bulk'
+LANES = (INTERACTIVE, BULK)
+
+
+@dataclass
+class SchedulerSlot:
+    """A granted (or pending) model call slot."""
+    tenant: str
+    lane: str
+    granted: threading.Event = field(default_factory=threading.Event)
+    enqueued_at: float = field(default_factory=time.perf_counter)
+
+
+@dataclass
+class _TenantQueue:
+    weight: float = 1.0
+    running: int = 0
+    # Virtual finish time of the tenant's last granted slot (start-time fair queuing)
+    finish: float = 0.0
+    waiting: Dict[str, Deque[SchedulerSlot]] = field(default_factory=lambda: {lane: deque() for lane in LANES})
+
+    @property
+    def idle(self) -> bool:
+        return self.running == 0 and not any(self.waiting.values())
+
+
+class FairScheduler:
+    """
+    Share the process's concurrent model calls fairly between sessions.
+
+    Each session (tenant) has its own queue per lane. Waiting interactive calls always go
+    before bulk ones, and ``interactive_reserved`` slots are never handed to bulk work, so a
+    single-image request does not wait behind a large batch. Within a lane, tenants are
+    served by start-time fair queuing: every granted slot advances the tenant's virtual time
+    by ``1 / weight``, and the backlogged tenant with the smallest virtual time goes next.
+    No tenant holds more than ``tenant_concurrency`` slots at once.
+    """
+
+    def __init__(self, max_concurrency: int = 8, tenant_concurrency: int = 4, interactive_reserved: int = 2):
+        if max_concurrency < 1 or tenant_concurrency < 1:
+            raise ValueError("Scheduler concurrency limits must be at least 1")
+        self.max_concurrency = max_concurrency
+        self.tenant_concurrency = tenant_concurrency
+        self.interactive_reserved = min(interactive_reserved, max_concurrency - 1)
+        self._tenants: Dict[str, _TenantQueue] = {}
+        self._running = {lane: 0 for lane in LANES}
+        self._virtual_time = 0.0
+        self._lock = threading.Lock()
+
+    def set_weight(self, tenant: str, weight: float) -> None:
+        """Give ``tenant`` a ``weight`` share of contended capacity (default 1)."""
+        if weight <= 0:
+            raise ValueError("Tenant weight must be positive")
+        with self._lock:
+            self._tenant(tenant).weight = weight
+
+    def acquire(self, tenant: str, lane: str = INTERACTIVE) -> SchedulerSlot:
+        """
+        Wait for a model call slot.
+
+        Args:
+            tenant (str): Session the call belongs to
+            lane (str): ``INTERACTIVE`` or ``BULK``
+
+        Returns:
+            SchedulerSlot: The granted slot; pass it to ``release`` when the call ends
+        """
+        if lane not in LANES:
+            raise ValueError(f"Unknown scheduler lane: {lane}")
+        slot = SchedulerSlot(tenant, lane)
+        with self._lock:
+            self._tenant(tenant).waiting[lane].append(slot)
+            self._dispatch()
+        slot.granted.wait()
+        SCHEDULER_WAIT.observe(time.perf_counter() - slot.enqueued_at, lane=lane)
+        return slot
+
+    def release(self, slot: SchedulerSlot) -> None:
+        with self._lock:
+            self._tenants[slot.tenant].running -= 1
+            self._running[slot.lane] -= 1
+            self._dispatch()
+
+    def snapshot(self) -> Dict[str, Dict[str, int]]:
+        """Running and waiting calls per tenant."""
+        with self._lock:
+            return {
+                tenant: {'running': queue.running, **{lane: len(queue.waiting[lane]) for lane in LANES}}
+                for tenant, queue in self._tenants.items()
+            }
+
+    def _tenant(self, tenant: str) -> _TenantQueue:
+        if tenant not in self._tenants:
+            self._tenants[tenant] = _TenantQueue(finish=self._virtual_time)
+        return self._tenants[tenant]
+
+    def _dispatch(self) -> None:
+        # Caller holds the lock
+        while sum(self._running.values()) < self.max_concurrency:
+            lane = INTERACTIVE
+            tenant = self._next_tenant(INTERACTIVE)
+            if tenant is None and self._running[BULK] < self.max_concurrency - self.interactive_reserved:
+                lane = BULK
+                tenant = self._next_tenant(BULK)
+            if tenant is None:
+                break
+
+            queue = self._tenants[tenant]
+            start = max(queue.finish, self._virtual_time)
+            queue.finish = start + 1.0 / queue.weight
+            self._virtual_time = start
+            queue.running += 1
+            self._running[lane] += 1
+            queue.waiting[lane].popleft().granted.set()
+
+        for lane in LANES:
+            QUEUE_DEPTH.set(sum(len(queue.waiting[lane]) for queue in self._tenants.values()), stage=f'scheduler_{lane}')
+        # Idle tenants that are not ahead of the virtual clock carry no state worth keeping
+        for tenant in [t for t, queue in self._tenants.items() if queue.idle and queue.finish <= self._virtual_time
+                       and queue.weight == 1.0]:
+            del self._tenants[tenant]
+
+    def _next_tenant(self, lane: str) -> Optional[str]:
+        best, best_start = None, None
+        for tenant, queue in self._tenants.items():
+            if not queue.waiting[lane] or queue.running >= self.tenant_concurrency:
+                continue
+            start = max(queue.finish, self._virtual_time)
+            if best is None or start < best_start:
+                best, best_start = tenant, start
+        return best
+
+
+_scheduler: Optional[FairScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> FairScheduler:
+    """
+    Process-wide scheduler shared by every session's engine.
+
+    Limits come from ``PHOTOPRO_MAX_CONCURRENT_CALLS``, ``PHOTOPRO_SESSION_CONCURRENT_CALLS``
+    and ``PHOTOPRO_INTERACTIVE_RESERVED_CALLS``.
+    """
+    global _scheduler
+
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = FairScheduler(
+                int(os.environ.get("PHOTOPRO_MAX_CONCURRENT_CALLS", 8)),
+                int(os.environ.get("PHOTOPRO_SESSION_CONCURRENT_CALLS", 4)),
+                int(os.environ.get("PHOTOPRO_INTERACTIVE_RESERVED_CALLS", 2))
+            )
+            logger.info(
+                f"Scheduler allows {_scheduler.max_concurrency} concurrent model calls, "
+                f"{_scheduler.tenant_concurrency} per session"
+            )
+        return _scheduler
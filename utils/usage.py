@@ -0,0 +1,178 @@
+import threading
+from dataclasses import dataclass, field, asdict
+from typing import Optional, Tuple, Dict, Any, List
+
+from utils.handler import PhotoProError, logs
+from utils.metrics import TOKENS_USED
+
+logger = logs()
+
+# Gemini bills ~258 tokens per 768x768 image tile and ~1290 tokens per generated image
+IMAGE_TILE_TOKENS = 258
+IMAGE_TILE_SIZE = 768
+OUTPUT_IMAGE_TOKENS = 1290
+
+
+class BudgetExceededError(PhotoProError):
+    pass
+
+
+@dataclass
+class UsageRecord:
+    calls: int = 0
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cached_tokens: int = 0
+    output_images: int = 0
+
+    @property
+    def total_tokens(self) -> int:
+        return self.input_tokens + self.output_tokens
+
+    def add(self, other: "UsageRecord") -> None:
+        self.calls += other.calls
+        self.input_tokens += other.input_tokens
+        self.output_tokens += other.output_tokens
+        self.cached_tokens += other.cached_tokens
+        self.output_images += other.output_images
+
+    @classmethod
+    def from_response(cls, response: Any) -> "UsageRecord":
+        """Read ``usage_metadata`` and the number of returned images from a model response."""
+        metadata = getattr(response, 'usage_metadata', None)
+        images = 0
+        for candidate in getattr(response, 'candidates', None) or []:
+            parts = candidate.content.parts if candidate.content is not None else None
+            images += sum(1 for part in parts or [] if part.inline_data is not None)
+
+        return cls(
+            calls=1,
+            input_tokens=getattr(metadata, 'prompt_token_count', None) or 0,
+            output_tokens=getattr(metadata, 'candidates_token_count', None) or 0,
+            cached_tokens=getattr(metadata, 'cached_content_token_count', None) or 0,
+            output_images=images
+        )
+
+
+@dataclass
+class UsageLabels:
+    """What a call is attributed to: the prompt template and the filters it was built from."""
+    template: str = 'custom'
+    filters: Tuple[str, ...] = ()
+
+
+def estimate_usage(prompt: str, image_size: Tuple[int, int], candidate_count: int = 1) -> UsageRecord:
+    """
+    Rough upper estimate of one call's usage, also charged for calls whose real usage is never reported.
+
+    Args:
+        prompt (str): Prompt text (about four characters per token)
+        image_size (Tuple[int, int]): Size of the image sent to the model
+        candidate_count (int): Number of images expected back
+
+    Returns:
+        UsageRecord: Estimated usage of a single call
+    """
+    tiles_x = -(-image_size[0] // IMAGE_TILE_SIZE)
+    tiles_y = -(-image_size[1] // IMAGE_TILE_SIZE)
+    return UsageRecord(
+        calls=1,
+        input_tokens=len(prompt) // 4 + tiles_x * tiles_y * IMAGE_TILE_TOKENS,
+        output_tokens=candidate_count * OUTPUT_IMAGE_TOKENS,
+        output_images=candidate_count
+    )
+
+
+def estimate_tokens(prompt: str, image_size: Tuple[int, int], candidate_count: int = 1) -> int:
+    """Estimated input plus output tokens of a call, used to stop submission before a budget is exceeded."""
+    return estimate_usage(prompt, image_size, candidate_count).total_tokens
+
+
+class UsageLedger:
+    """
+    Thread-safe token accounting, totalled and broken down per prompt template and per filter.
+
+    ``budget_tokens`` caps ``total_tokens`` plus tokens reserved by in-flight calls.
+    """
+
+    def __init__(self, name: str, budget_tokens: Optional[int] = None):
+        self.name = name
+        self.budget_tokens = budget_tokens
+        self.totals = UsageRecord()
+        self.by_template: Dict[str, UsageRecord] = {}
+        self.by_filter: Dict[str, UsageRecord] = {}
+        self.reserved_tokens = 0
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens: int) -> None:
+        """
+        Reserve an estimate before submitting a call.
+
+        Raises:
+            BudgetExceededError: If the call could push usage past the budget
+        """
+        with self._lock:
+            if self.budget_tokens and self.totals.total_tokens + self.reserved_tokens + tokens > self.budget_tokens:
+                raise BudgetExceededError(
+                    f"{self.name} token budget reached: {self.totals.total_tokens:,} used"
+                    f"{f' + {self.reserved_tokens:,} in flight' if self.reserved_tokens else ''}"
+                    f" of {self.budget_tokens:,}; next call needs ~{tokens:,}"
+                )
+            self.reserved_tokens += tokens
+
+    def release(self, tokens: int) -> None:
+        with self._lock:
+            self.reserved_tokens = max(0, self.reserved_tokens - tokens)
+
+    def record(self, usage: UsageRecord, labels: UsageLabels) -> None:
+        with self._lock:
+            self.totals.add(usage)
+            self.by_template.setdefault(labels.template, UsageRecord()).add(usage)
+            for filter_name in labels.filters:
+                self.by_filter.setdefault(filter_name, UsageRecord()).add(usage)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'totals': asdict(self.totals),
+                'by_template': {key: asdict(value) for key, value in self.by_template.items()},
+                'by_filter': {key: asdict(value) for key, value in self.by_filter.items()},
+                'budget_tokens': self.budget_tokens,
+            }
+
+
+PROCESS_USAGE = UsageLedger('Process')
+
+
+@dataclass
+class UsageTracker:
+    """The ledgers an engine charges: usually the browser session's and the process-wide one."""
+    ledgers: List[UsageLedger] = field(default_factory=lambda: [PROCESS_USAGE])
+    labels: UsageLabels = field(default_factory=UsageLabels)
+
+    def reserve(self, tokens: int) -> None:
+        reserved = []
+        try:
+            for ledger in self.ledgers:
+                ledger.reserve(tokens)
+                reserved.append(ledger)
+        except BudgetExceededError:
+            for ledger in reserved:
+                ledger.release(tokens)
+            raise
+
+    def settle(self, reserved_tokens: int, usage: Optional[UsageRecord]) -> None:
+        """Release a reservation and record what the call actually used, if anything."""
+        for ledger in self.ledgers:
+            ledger.release(reserved_tokens)
+            if usage is not None:
+                ledger.record(usage, self.labels)
+
+        if usage is not None:
+            TOKENS_USED.inc(usage.input_tokens, kind='input')
+            TOKENS_USED.inc(usage.output_tokens, kind='output')
+            TOKENS_USED.inc(usage.cached_tokens, kind='cached')
+            logger.info(
+                f"Usage: {usage.input_tokens} in / {usage.output_tokens} out tokens, {usage.output_images} image(s)",
+                extra={'usage': asdict(usage), 'template': self.labels.template, 'sample': True}
+            )
@@ -0,0 +1,109 @@
+import os
+import hashlib
+import tempfile
+import importlib
+import threading
+from dataclasses import dataclass, field
+from typing import Optional, Dict
+
+from utils.handler import logs, stage_timer
+
+logger = logs()
+
+# Imported lazily by the first request otherwise
+HEAVY_MODULES = ('numpy', 'httpx', 'google.genai', 'google.genai.types', 'engine')
+
+
+@dataclass
+class WarmupReport:
+    """Milliseconds spent in each warm-up step, and whether the backend answered its health check."""
+    steps_ms: Dict[str, float] = field(default_factory=dict)
+    healthy: Optional[bool] = None
+
+    @property
+    def total_ms(self) -> float:
+        return sum(self.steps_ms.values())
+
+
+def warm_up(api_key: str = None, backend=None, gemini_config=None, image_config=None,
+            health_check: bool = True) -> WarmupReport:
+    """
+    Pay the one-off costs of the first enhancement ahead of time.
+
+    Imports the SDK and imaging stack, registers every Pillow plugin, builds an engine (and
+    with it the process-wide backend client), opens a keep-alive connection with a health
+    call and runs a tiny prepare/encode/save round-trip through the same codecs and, if
+    enabled, the CPU worker processes.
+
+    Args:
+        api_key (str, optional): Gemini API key, when no backend is given
+        backend (ModelBackend, optional): Backend to warm instead of the Gemini SDK
+        gemini_config (GeminiConfig, optional): Model whose health is checked
+        image_config (ImageConfig, optional): Image settings used for the round-trip
+        health_check (bool): Whether to call the backend
+
+    Returns:
+        WarmupReport: Per-step timings
+    """
+    report = WarmupReport()
+
+    def step(name: str):
+        return stage_timer(report.steps_ms, name)
+
+    with step('imports'):
+        for module in HEAVY_MODULES:
+            importlib.import_module(module)
+        from PIL import Image
+        Image.init()
+
+    from google.genai import types
+    from engine import GeminiEnhancementEngine
+
+    with step('engine'):
+        engine = GeminiEnhancementEngine(api_key, gemini_config, image_config, backend=backend)
+
+    if health_check:
+        with step('health'):
+            report.healthy = engine.check_health()
+
+    with step('codecs'), tempfile.TemporaryDirectory() as work_dir:
+        source_path = os.path.join(work_dir, "warmup.jpg")
+        Image.linear_gradient('L').resize((64, 64)).convert('RGB').save(source_path, quality=90)
+        image = engine._prepare_image(source_path)
+        image_bytes, mime_type = engine.image_processor.encode_for_upload(image)
+        # First use of the SDK models builds their validators
+        types.Part.from_bytes(data=image_bytes, mime_type=mime_type)
+        types.GenerateContentConfig(response_modalities=engine.gemini_config.response_modalities)
+        engine._save_image(image, os.path.join(work_dir, "warmup.png"))
+        image.close()
+
+    logger.info(
+        f"Warm-up finished in {report.total_ms:.0f} ms (healthy: {report.healthy})",
+        extra={'warmup_ms': report.steps_ms}
+    )
+    return report
+
+
+_warmups: Dict[str, threading.Thread] = {}
+_warmups_lock = threading.Lock()
+
+
+def start_warm_up(api_key: str = None, backend=None, gemini_config=None, image_config=None) -> threading.Thread:
+    """
+    Warm up in a background thread, at most once per API key or backend per process.
+
+    Failures are logged and otherwise ignored; the first request then simply pays the cost.
+    """
+    key = getattr(backend, 'breaker_key', None) or hashlib.sha256((api_key or '').encode('utf-8')).hexdigest()
+
+    def run():
+        try:
+            warm_up(api_key, backend, gemini_config, image_config)
+        except Exception as e:
+            logger.warning(f"Warm-up failed: {str(e)}")
+
+    with _warmups_lock:
+        if key not in _warmups:
+            _warmups[key] = threading.Thread(target=run, name="photopro-warmup", daemon=True)
+            _warmups[key].start()
+        return _warmups[key]